@@ -0,0 +1,77 @@
+import zlib
+import base64
+import struct
+import hashlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# chunks that change how the image looks; text, time and the like are dropped
+KEPT_CHUNKS = (b'IHDR', b'PLTE', b'tRNS', b'gAMA', b'cHRM', b'sRGB', b'iCCP', b'IEND')
+
+
+def decode_data_uri(uri):
+    header, _, data = uri.partition(',')
+    if not header.endswith(';base64'):
+        raise ValueError('not a base64 data URI: {!r}'.format(header))
+    return base64.b64decode(data)
+
+
+def png_chunks(data):
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError('not a PNG')
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        length, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        yield kind, data[offset + 8:offset + 8 + length]
+        offset += length + 12
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def optimize_png(data):
+    """``data`` with one maximally deflated IDAT and no ancillary metadata, if that is smaller.
+
+    The pixels and their filters are untouched, so the image is the same.
+    """
+    chunks = list(png_chunks(data))
+    pixels = zlib.decompress(b''.join(body for kind, body in chunks if kind == b'IDAT'))
+    idat = zlib.compress(pixels, 9)
+
+    out = [PNG_SIGNATURE]
+    for kind, body in chunks:
+        if kind == b'IDAT':
+            if idat is not None:
+                out.append(png_chunk(b'IDAT', idat))
+                idat = None
+        elif kind in KEPT_CHUNKS:
+            out.append(png_chunk(kind, body))
+    optimized = b''.join(out)
+    return optimized if len(optimized) < len(data) else data
+
+
+class TierAsset(object):
+    """One tier image, named after a hash of the source PNG.
+
+    Optimizing takes ~25 ms per image, so it happens on the first request
+    for the image rather than at every worker's startup.
+    """
+
+    def __init__(self, tier, source):
+        digest = hashlib.sha256(source).hexdigest()[:16]
+        self.name = '{}.{}.png'.format(tier.lower(), digest)
+        self.etag = '"{}"'.format(digest)
+        self.source = source
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = optimize_png(self.source)
+        return self._body
+
+
+def tier_assets(images):
+    """{tier: TierAsset} for ``{tier: data URI}``."""
+    return {tier: TierAsset(tier, decode_data_uri(uri)) for tier, uri in images.items()}
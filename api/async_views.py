@@ -0,0 +1,141 @@
+import time
+import asyncio
+import concurrent.futures
+import requests
+from json import JSONDecodeError
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .ratelimit import BACKGROUND, INTERACTIVE
+from .upstream import AsyncUpstreamClient, UpstreamStatusError
+from .views import (BADGE_VARIANTS, PNG_TIMEOUT, PROFILE_TTL, UrlSettings, back_off, batcher, breaker,
+                    last_known_profile, logger, parse_profile, png_badge, png_badge_response, png_responses,
+                    profile_badge_response, profile_cache, record_upstream, registry, requests_in_flight,
+                    reserve_upstream, track_request, upstream, user_information_url, v2_variant, wants_png)
+
+# Async badge views, routed by api/urls.py when BADGE_ASYNC_VIEWS is on
+# (mazassumnida/asgi.py turns it on). The solved.ac round-trip is awaited
+# instead of holding a worker thread; caching and rendering are shared with
+# the sync views and run in a worker thread, as the shared cache does file or
+# network I/O and a render miss compresses the badge.
+
+async_upstream = AsyncUpstreamClient(
+    upstream,
+    cookie_file=getattr(settings, 'SOLVEDAC_COOKIE_FILE', None),
+    connect_timeout=getattr(settings, 'SOLVEDAC_CONNECT_TIMEOUT', 3.05),
+    read_timeout=getattr(settings, 'SOLVEDAC_READ_TIMEOUT', 10),
+    pool_size=getattr(settings, 'SOLVEDAC_ASYNC_POOL_SIZE', 100))
+
+
+async def upstream_get(url, endpoint, timing=None, priority=INTERACTIVE):
+    trial = breaker.check()
+    try:
+        wait = reserve_upstream(priority, timing)
+        if wait:
+            await asyncio.sleep(wait)
+    except BaseException:
+        # shed, or cancelled while queued: the trial goes to the next call
+        if trial:
+            breaker.release()
+        raise
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        resp = await async_upstream.get(url)
+        status = resp.status_code
+        back_off(resp)
+        return resp
+    finally:
+        record_upstream(endpoint, started, status)
+        if timing is not None:
+            timing.add('upstream', time.perf_counter() - started)
+
+
+async def fetch_profile(handle, timing=None, priority=INTERACTIVE):
+    if timing is not None:
+        timing.describe('profile', 'miss')
+    # no batching while the breaker is open: the per-handle request fails fast
+    if batcher is not None and priority == INTERACTIVE and breaker.state == 'closed':
+        # the batch request itself runs on the batcher's thread, off the event loop
+        started = time.perf_counter()
+        profile = await asyncio.wrap_future(batcher.submit(handle))
+        if timing is not None:
+            timing.add('upstream', time.perf_counter() - started)
+        if profile is not None:
+            return profile
+    resp = await upstream_get(user_information_url(handle), 'show', timing, priority)
+    if resp.status_code != 200:
+        logger.error(f"API request failed: {resp.status_code} {resp.text}")
+        raise UpstreamStatusError(resp.status_code, resp.text)
+    return parse_profile(resp, timing)
+
+
+async def load_profile(url_set, variant):
+    timing = url_set.timing
+    if timing is not None:
+        timing.describe('profile', 'hit')
+        started = time.perf_counter()
+    try:
+        profile, fresh = await profile_cache.alookup(
+            url_set.boj_handle, PROFILE_TTL[variant],
+            lambda: fetch_profile(url_set.boj_handle, timing),
+            lambda: fetch_profile(url_set.boj_handle, priority=BACKGROUND))
+        url_set.expired = not fresh
+        return profile
+    except (JSONDecodeError, requests.RequestException, httpx.HTTPError) as e:
+        return await sync_to_async(last_known_profile, thread_sensitive=False)(url_set, e)
+    finally:
+        if timing is not None:
+            timing.add('profile', time.perf_counter() - started)
+
+
+async def wait_png(future, timing=None):
+    started = time.perf_counter()
+    try:
+        # shielded: a timeout here must not cancel the job for other requests
+        png = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), PNG_TIMEOUT)
+        png_responses.labels('rasterized').inc()
+        return png
+    except Exception:
+        return None
+    finally:
+        if timing is not None:
+            timing.add('raster', time.perf_counter() - started)
+
+
+async def badge_response(request, variant):
+    registry.start()
+    in_flight = requests_in_flight.labels(variant)
+    in_flight.inc()
+    try:
+        url_set = UrlSettings(request, BADGE_VARIANTS[variant].max_len)
+        track_request(url_set, variant)
+        profile = await load_profile(url_set, variant)
+        if wants_png(request):
+            png = await sync_to_async(png_badge, thread_sensitive=False)(request, variant, url_set, profile)
+            if isinstance(png, concurrent.futures.Future):
+                png = await wait_png(png, url_set.timing)
+            return await sync_to_async(png_badge_response, thread_sensitive=False)(
+                request, variant, url_set, profile, png)
+        return await sync_to_async(profile_badge_response, thread_sensitive=False)(
+            request, variant, url_set, profile)
+    finally:
+        in_flight.dec()
+
+
+async def generate_badge(request):
+    return await badge_response(request, 'v1')
+
+
+async def generate_badge_v2(request):
+    return await badge_response(request, v2_variant(request))
+
+
+async def generate_badge_mini(request):
+    return await badge_response(request, 'mini')
+
+
+async def generate_badge_pastel(request):
+    return await badge_response(request, 'pastel')
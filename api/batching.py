@@ -0,0 +1,73 @@
+import logging
+import threading
+from concurrent.futures import Future
+
+from .cache import normalize_handle
+
+logger = logging.getLogger('testlogger')
+
+
+class LookupBatcher(object):
+    """Resolves handle lookups in batches with one multi-handle request.
+
+    ``submit`` returns a future. Pending handles are gathered for ``window``
+    seconds, or until ``max_batch`` of them are waiting, and then passed to
+    ``lookup(handles)``, which returns ``{normalized handle: profile}``. The
+    futures of handles missing from that result resolve to None, as do all
+    of them when the batch request fails, so the caller falls back to its
+    per-handle request. A batch of one handle is never sent.
+    """
+
+    def __init__(self, lookup, window=0.005, max_batch=50):
+        self.lookup = lookup
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.batched_handles = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def submit(self, handle):
+        key = normalize_handle(handle)
+        batch = None
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pending[key] = Future()
+            if len(self._pending) >= self.max_batch:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            # never on the caller's thread: it may be the async views' event loop
+            threading.Thread(target=self._run, args=(batch,), daemon=True).start()
+        return future
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._run(batch)
+
+    def _take(self):
+        batch, self._pending = self._pending, {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _run(self, batch):
+        found = {}
+        if len(batch) > 1:
+            try:
+                found = self.lookup(list(batch))
+                self.batches += 1
+                self.batched_handles += len(batch)
+            except Exception as e:
+                logger.error('batched lookup of {} handles failed: {}'.format(len(batch), e))
+        for key, future in batch.items():
+            future.set_result(found.get(key))
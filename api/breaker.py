@@ -0,0 +1,80 @@
+import time
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger('testlogger')
+
+
+class CircuitOpenError(requests.RequestException):
+    """solved.ac was not called because the circuit breaker is open."""
+
+
+class CircuitBreaker(object):
+    """Stops calling solved.ac for a while once it keeps failing.
+
+    After ``threshold`` failures in a row the breaker opens and ``check``
+    raises ``CircuitOpenError`` straight away for ``cooldown`` seconds, so
+    no worker thread waits on a timeout that is bound to happen. Then one
+    trial call is let through (half-open): a success closes the breaker, a
+    failure opens it for another cooldown. Each worker has its own breaker.
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.short_circuited = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.cooldown or self._trial:
+            return 'open'
+        return 'half-open'
+
+    def check(self):
+        """Raise ``CircuitOpenError`` unless a call may go out now; True if it is the trial call."""
+        if self.opened_at is None:
+            return False
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at >= self.cooldown and not self._trial:
+                self._trial = True
+                return True
+            self.short_circuited += 1
+        raise CircuitOpenError('solved.ac circuit breaker is open')
+
+    def release(self):
+        """Give back the trial of a call that was never sent, e.g. shed by the rate limiter."""
+        with self._lock:
+            self._trial = False
+
+    def success(self):
+        if self.failures or self.opened_at is not None:
+            with self._lock:
+                if self.opened_at is not None:
+                    logger.info('solved.ac circuit breaker closed')
+                self.failures = 0
+                self.opened_at = None
+                self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    logger.error('solved.ac circuit breaker opened after {} failures'.format(self.failures))
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+
+def upstream_failed(status):
+    # rate limits and server errors say nothing about the handle; 404 and friends do
+    return status == 429 or status >= 500
@@ -0,0 +1,336 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger('testlogger')
+
+
+# the parts of a solved.ac profile the badges use; everything else is dropped
+PROFILE_FIELDS = ('handle', 'rating', 'solvedCount', 'class', 'classDecoration')
+
+
+def normalize_handle(handle):
+    # solved.ac handles are case-insensitive, so `ccoco` and `CCoco` share an entry
+    return handle.strip().lower()
+
+
+class ProfileCache(object):
+    """Bounded per-worker LRU of parsed solved.ac profiles.
+
+    Entries are stored with the time they were fetched; freshness is decided
+    at read time against the TTL of the badge variant asking for it, so the
+    mini badge (daily) and the big badges (hourly) can share one entry.
+    Expired entries are served stale while a single background refresh runs,
+    until they are older than ``ttl + max_stale``. Concurrent misses for the
+    same handle are coalesced into one upstream call, in threads and on the
+    event loop alike.
+
+    With a ``store`` (see ``sharedcache``) this LRU is a first level in front
+    of the Django cache shared by all workers: writes go through to the
+    store, and the store is read when the local entry is missing or expired,
+    so a profile fetched by one worker is fresh for all of them. Entries are
+    kept in the store for ``retention`` seconds.
+
+    Every profile stored is also passed to ``history`` (see ``freshness``),
+    if given, which tracks how often each handle's profile changes.
+
+    ``aget`` reads and writes the store and the history in a worker thread,
+    as they may do file or network I/O; a fresh local hit stays on the loop.
+    """
+
+    def __init__(self, maxsize=4096, max_stale=86400, store=None, retention=2 * 86400, history=None):
+        self.maxsize = maxsize
+        self.max_stale = max_stale
+        self.store = store
+        self.retention = retention
+        self.history = history
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._tasks = set()
+        self.flight = SingleFlight()
+        self.aflight = AsyncSingleFlight()
+
+    def get(self, handle, ttl, loader, refresh_loader=None):
+        """Profile of ``handle``; expired entries are refreshed with ``refresh_loader`` if given."""
+        return self.lookup(handle, ttl, loader, refresh_loader)[0]
+
+    def lookup(self, handle, ttl, loader, refresh_loader=None):
+        """``get`` as (profile, fresh); ``fresh`` is False for an expired entry served while it is refreshed."""
+        key = normalize_handle(handle)
+        profile, fresh = self._lookup(key, ttl)
+        if profile is not None:
+            if not fresh:
+                self.stale_hits += 1
+                self._refresh_in_background(key, refresh_loader or loader)
+            else:
+                self.hits += 1
+            return profile, fresh
+
+        self.misses += 1
+        return self.flight.do(key, lambda: self._load(key, loader)), True
+
+    async def aget(self, handle, ttl, loader, refresh_loader=None):
+        """``get`` for the async views; the loaders are coroutine functions."""
+        return (await self.alookup(handle, ttl, loader, refresh_loader))[0]
+
+    async def alookup(self, handle, ttl, loader, refresh_loader=None):
+        """``lookup`` for the async views."""
+        key = normalize_handle(handle)
+        entry = self._local_entry(key)
+        if self._consult_store(entry, ttl):
+            entry = await sync_to_async(self._shared_entry, thread_sensitive=False)(key, entry)
+        profile, fresh = self._freshness(entry, ttl)
+        if profile is not None:
+            if not fresh:
+                self.stale_hits += 1
+                self._refresh_in_background(key, refresh_loader or loader, asynchronous=True)
+            else:
+                self.hits += 1
+            return profile, fresh
+
+        self.misses += 1
+        return await self.aflight.do(key, lambda: self._aload(key, loader)), True
+
+    def fetched_at(self, handle):
+        entry = self.last_known(handle)
+        return entry[0] if entry is not None else None
+
+    def last_known(self, handle):
+        """(fetched_at, profile) of the newest profile kept anywhere, however old, or None."""
+        return self._entry(normalize_handle(handle), ttl=0)
+
+    def refresh(self, handle, loader):
+        """Fetch now, e.g. ahead of expiry, sharing any fetch already in flight."""
+        key = normalize_handle(handle)
+        return self.flight.do(key, lambda: self._load(key, loader))
+
+    def stats(self):
+        return {
+            'entries': len(self._data),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'loads': self.flight.calls + self.aflight.calls,
+            'collapsed_loads': self.flight.collapsed + self.aflight.collapsed,
+        }
+
+    def _load(self, key, loader):
+        profile = loader()
+        self.set(key, profile)
+        return profile
+
+    async def _aload(self, key, loader):
+        profile = await loader()
+        await self.aset(key, profile)
+        return profile
+
+    def set(self, handle, profile, fetched_at=None):
+        key = normalize_handle(handle)
+        profile = {field: profile[field] for field in PROFILE_FIELDS if field in profile}
+        fetched_at = fetched_at or time.time()
+        self._remember(key, fetched_at, profile)
+        if self.store is not None:
+            self.store.set(key, profile, fetched_at, fetched_at + self.retention)
+        if self.history is not None:
+            self.history.observe(key, profile, fetched_at)
+
+    async def aset(self, handle, profile, fetched_at=None):
+        if self.store is None and self.history is None:
+            self.set(handle, profile, fetched_at)
+        else:
+            await sync_to_async(self.set, thread_sensitive=False)(handle, profile, fetched_at)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.store is not None:
+            self.store.clear()
+        if self.history is not None:
+            self.history.clear()
+
+    def _remember(self, key, fetched_at, profile):
+        with self._lock:
+            self._data[key] = (fetched_at, profile)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key, ttl):
+        return self._freshness(self._entry(key, ttl), ttl)
+
+    def _freshness(self, entry, ttl):
+        # (profile, fresh), profile is None on a miss or past the stale window
+        if entry is None:
+            return None, False
+        fetched_at, profile = entry
+        age = time.time() - fetched_at
+        if age < ttl:
+            return profile, True
+        if age < ttl + self.max_stale:
+            return profile, False
+        return None, False
+
+    def _entry(self, key, ttl):
+        # local entry, or the shared one when that is newer and the local one isn't fresh
+        entry = self._local_entry(key)
+        if self._consult_store(entry, ttl):
+            entry = self._shared_entry(key, entry)
+        return entry
+
+    def _local_entry(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+        return entry
+
+    def _consult_store(self, entry, ttl):
+        return self.store is not None and (entry is None or time.time() - entry[0] >= ttl)
+
+    def _shared_entry(self, key, entry):
+        shared = self.store.get(key)
+        if shared is not None and (entry is None or shared[0] > entry[0]):
+            self._remember(key, *shared)
+            entry = shared
+        return entry
+
+    def _refresh_in_background(self, key, loader, asynchronous=False):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def done(error=None):
+            if error is not None:
+                # keep serving the stale entry, the next expired hit retries
+                logger.error('background refresh failed for {}: {}'.format(key, error))
+            with self._lock:
+                self._refreshing.discard(key)
+
+        def refresh():
+            try:
+                self.set(key, loader())
+            except Exception as e:
+                done(e)
+            else:
+                done()
+
+        async def arefresh():
+            try:
+                await self.aset(key, await loader())
+            except Exception as e:
+                done(e)
+            else:
+                done()
+
+        if asynchronous:
+            task = asyncio.ensure_future(arefresh())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            threading.Thread(target=refresh, name='profile-refresh', daemon=True).start()
+
+
+class RenderedBadge(object):
+    """Final encoded SVG of one badge, with what the view needs to log it.
+
+    ``encoded`` maps a Content-Encoding to the precompressed body, so a hit
+    never compresses again. ``created_at`` is served as ``Last-Modified``:
+    the bytes can only change through a different cache key.
+    """
+    __slots__ = ('body', 'tier_title', 'encoded', 'created_at')
+
+    # rough per-entry bookkeeping cost on top of the bodies: key tuple, entry, dict slot
+    OVERHEAD = 256
+
+    def __init__(self, body, tier_title, encoded=None, created_at=None):
+        self.body = body
+        self.tier_title = tier_title
+        self.encoded = encoded or {}
+        self.created_at = int(created_at or time.time())
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(data) for data in self.encoded.values()) + self.OVERHEAD
+
+
+class RenderCache(object):
+    """LRU of rendered badges bounded by total bytes rather than entry count.
+
+    Keys are ``(variant, display name, profile fingerprint)``, so an entry
+    never goes stale: a changed profile produces a different key and the old
+    entry ages out. With a ``store`` (see ``sharedcache``) local misses are
+    looked up there and renders are written through, so a badge is rendered
+    and compressed once per host (or cluster) instead of once per worker.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, store=None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.size = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            badge = self._data.get(key)
+            if badge is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return badge
+        if self.store is not None:
+            badge = self.store.get(key)
+            if badge is not None:
+                self._remember(key, badge)
+                self.shared_hits += 1
+                return badge
+        self.misses += 1
+        return None
+
+    def set(self, key, badge):
+        self._remember(key, badge)
+        if self.store is not None:
+            self.store.set(key, badge)
+
+    def _remember(self, key, badge):
+        if badge.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._data[key] = badge
+            self.size += badge.size
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= evicted.size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                'entries': len(self._data), 'bytes': self.size}
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,149 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from .cache import normalize_handle
+
+
+class ChangeHistory(object):
+    """How often the badge fields of each handle's profile change.
+
+    Every profile stored in the profile cache is passed to ``observe``; for
+    each handle this keeps ``(fingerprint, first_seen, last_seen, changes)``,
+    where ``changes`` counts the fetches whose ``fingerprint(profile)``
+    differed from the one before. Changes between two fetches count once, so
+    the history is only as fine as the profile TTL.
+
+    Handles are kept in an LRU of ``maxsize``. With a ``store`` (see
+    ``sharedcache.HistoryStore``) every worker updates the same history,
+    kept for ``retention`` seconds after a handle was last seen; reads are
+    served from the LRU, so a worker sees other workers' changes once it
+    fetches the handle itself or has not looked it up before. Two workers
+    updating one handle at the same moment may lose one of the updates.
+    """
+
+    def __init__(self, fingerprint, maxsize=65536, store=None, retention=90 * 86400):
+        self.fingerprint = fingerprint
+        self.maxsize = maxsize
+        self.store = store
+        self.retention = retention
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, handle, profile, seen_at=None):
+        key = normalize_handle(handle)
+        seen_at = seen_at or time.time()
+        fingerprint = self.fingerprint(profile)
+        entry = self.store.get(key) if self.store is not None else None
+        if entry is None:
+            with self._lock:
+                entry = self._data.get(key)
+        if entry is None:
+            entry = (fingerprint, seen_at, seen_at, 0)
+        elif seen_at >= entry[2]:
+            # older profiles, e.g. read back from the shared cache, are not news
+            last, first_seen, _, changes = entry
+            entry = (fingerprint, first_seen, seen_at, changes + (fingerprint != last))
+        self._remember(key, entry)
+        if self.store is not None:
+            self.store.set(key, entry, self.retention)
+        return entry
+
+    def get(self, handle):
+        """(fingerprint, first_seen, last_seen, changes) or None for a handle never seen."""
+        key = normalize_handle(handle)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                return entry
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CachePolicy(object):
+    """``Cache-Control`` for a badge from how often its handle's profile changes.
+
+    The mean time between changes of a handle is estimated as
+    ``(last_seen - first_seen + prior) / (changes + 1)``: a handle never
+    seen is assumed to change once every ``prior`` seconds, and the
+    estimate moves towards what was observed as the history grows. A
+    variant's ``base`` lifetime is the one for a handle changing at the prior
+    rate, and scales with the estimate: with the defaults, a v1 badge (base
+    3600) of a handle seen changing every two hours for a week scales to
+    339 seconds, raised to the 3600 second profile TTL, and of one that did
+    not change in the 30 days it was seen to 31 hours; the mini badge (base
+    86400) of the latter is cached for the week cap.
+
+    The lifetime is the ``s-maxage`` for shared caches, between ``min_age``
+    and ``max_shared_age``, and never below ``floor``, the TTL of the
+    variant's profiles: a shared cache revalidating sooner would only get the
+    same cached profile again. Browsers, which can't be purged, get at most
+    ``max_age`` of it. ``stale-while-revalidate`` is the lifetime again, up to
+    ``max_stale``, like the profile cache serving stale profiles.
+    """
+
+    def __init__(self, history, prior=86400, min_age=300, max_age=86400, max_shared_age=7 * 86400,
+                 max_stale=86400):
+        self.history = history
+        self.prior = prior
+        self.min_age = min_age
+        self.max_age = max_age
+        self.max_shared_age = max_shared_age
+        self.max_stale = max_stale
+
+    def interval(self, entry):
+        """Estimated seconds between changes for a ``ChangeHistory`` entry, None for a handle never seen."""
+        if entry is None:
+            return self.prior
+        _, first_seen, last_seen, changes = entry
+        return (last_seen - first_seen + self.prior) / (changes + 1)
+
+    def lifetime(self, base, entry, floor=0):
+        lifetime = int(base * self.interval(entry) / self.prior)
+        return max(self.min_age, floor, min(self.max_shared_age, lifetime))
+
+    def cache_control(self, base, handle, floor=0):
+        lifetime = self.lifetime(base, self.history.get(handle), floor)
+        return 'max-age={}, s-maxage={}, stale-while-revalidate={}'.format(
+            min(lifetime, self.max_age), lifetime, min(lifetime, self.max_stale))
+
+
+def origin_fetches(requests_per_second, lifetime):
+    """Expected origin requests per second for a badge behind a shared cache.
+
+    With requests arriving at random at ``requests_per_second``, each origin
+    fetch is followed by ``lifetime`` seconds of hits, so on average a cycle
+    serves ``1 + requests_per_second * lifetime`` requests.
+    """
+    return requests_per_second / (1 + requests_per_second * lifetime)
+
+
+def outdated_fraction(interval, lifetime):
+    """Expected share of cached responses showing a profile that has since changed.
+
+    Changes arriving at random every ``interval`` seconds on average, and a
+    request at a random point of a ``lifetime`` long cache cycle.
+    """
+    x = lifetime / interval
+    return 1 - (1 - math.exp(-x)) / x if x else 0.0
@@ -0,0 +1,86 @@
+import re
+import sys
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import views
+from api.freshness import origin_fetches, outdated_fraction
+
+BADGE_REQUEST = re.compile(r'/api/(?:(v2|mini|pastel)/)?generate_badge\?(?:[^\s"]*&)?boj=([^&\s"]+)')
+
+# estimated time between changes, for grouping the handles
+BANDS = (
+    ('< 1 hour', 3600),
+    ('< 1 day', 86400),
+    ('< 1 week', 7 * 86400),
+    ('< 30 days', 30 * 86400),
+    ('>= 30 days', float('inf')),
+)
+
+
+class Command(BaseCommand):
+    help = ('Predict the origin traffic of the adaptive Cache-Control policy against the fixed max-age, '
+            'from an access log (or a list of handles, taken as v1 requests) and the change history '
+            'kept in the shared cache.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default='-',
+                            help='access log with badge requests, or one handle per line (default: stdin)')
+        parser.add_argument('--period', type=float, default=86400,
+                            help='seconds of traffic the source covers (default: a day)')
+
+    def handle(self, *args, **options):
+        if not views.SHARED_CACHE:
+            self.stderr.write('BADGE_CACHE is off: change histories are per worker, so every handle '
+                              'is reported as never seen')
+        period = options['period']
+        if period <= 0:
+            raise CommandError('--period must be positive')
+
+        requests = Counter()
+        source = sys.stdin if options['source'] == '-' else open(options['source'])
+        with source:
+            for line in source:
+                match = BADGE_REQUEST.search(line)
+                if match:
+                    requests[(match.group(1) or 'v1', match.group(2))] += 1
+                elif line.strip() and ' ' not in line.strip():
+                    requests[('v1', line.strip())] += 1
+        if not requests:
+            raise CommandError('no badge requests found')
+
+        policy = views.cache_policy
+        bands = {name: [0] * 7 for name, _ in BANDS + (('never seen', None),)}
+        for (variant, handle), count in requests.items():
+            entry = views.change_history.get(handle)
+            interval = policy.interval(entry)
+            band = 'never seen' if entry is None else next(name for name, bound in BANDS if interval < bound)
+            base = views.BADGE_VARIANTS[variant].max_age
+            lifetime = policy.lifetime(base, entry, views.PROFILE_TTL[variant])
+            rate = count / period
+            row = bands[band]
+            row[0] += 1
+            row[1] += count
+            row[2] += origin_fetches(rate, base) * period
+            row[3] += origin_fetches(rate, lifetime) * period
+            row[4] += count * outdated_fraction(interval, base)
+            row[5] += count * outdated_fraction(interval, lifetime)
+            row[6] += count * lifetime
+
+        self.stdout.write('{:<11} {:>8} {:>9} {:>12} {:>12} {:>10} {:>14}'.format(
+            'changes', 'handles', 'requests', 'origin now', 'adaptive', 's-maxage', 'outdated'))
+        total = [0] * 7
+        for name, row in bands.items():
+            if row[0]:
+                self.write_row(name, row)
+                total = [a + b for a, b in zip(total, row)]
+        self.write_row('total', total)
+        self.stdout.write('origin requests per {:g}s: {:.0f} -> {:.0f} ({:+.1f}%)'.format(
+            period, total[2], total[3], (total[3] / total[2] - 1) * 100 if total[2] else 0))
+
+    def write_row(self, name, row):
+        handles, count, fixed, adaptive, outdated_fixed, outdated_adaptive, lifetime = row
+        self.stdout.write('{:<11} {:>8} {:>9} {:>12.0f} {:>12.0f} {:>10.0f} {:>14}'.format(
+            name, handles, count, fixed, adaptive, lifetime / count,
+            '{:.1%} -> {:.1%}'.format(outdated_fixed / count, outdated_adaptive / count)))
@@ -0,0 +1,54 @@
+import re
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import views
+from api.prefetch import HeavyHitters, PrefetchScheduler
+
+BOJ_PARAM = re.compile(r'[?&]boj=([^&\s"]+)')
+
+
+class Command(BaseCommand):
+    help = ('Refresh the most requested solved.ac profiles shortly before they expire. '
+            'Request frequency is read from a list of handles or an access log.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default='-',
+                            help='file with one handle per line or an access log with boj= parameters '
+                                 '(default: stdin)')
+        parser.add_argument('--once', action='store_true', help='refresh what is due once and exit')
+        parser.add_argument('--top', type=int, default=getattr(settings, 'BADGE_PREFETCH_TOP_K', 256))
+        parser.add_argument('--interval', type=float, default=getattr(settings, 'BADGE_PREFETCH_INTERVAL', 10))
+        parser.add_argument('--lead', type=float, default=getattr(settings, 'BADGE_PREFETCH_LEAD', 60))
+        parser.add_argument('--concurrency', type=int, default=getattr(settings, 'BADGE_PREFETCH_CONCURRENCY', 4))
+        parser.add_argument('--rate', type=float, default=getattr(settings, 'BADGE_PREFETCH_RATE', 5),
+                            help='refreshes started per second')
+
+    def handle(self, *args, **options):
+        hitters = HeavyHitters(k=options['top'])
+        ttl = min(views.PROFILE_TTL.values())
+        source = sys.stdin if options['source'] == '-' else open(options['source'])
+        with source:
+            for line in source:
+                match = BOJ_PARAM.search(line)
+                handle = match.group(1) if match else line.strip()
+                if handle and not match and ' ' in handle:
+                    continue
+                if handle:
+                    hitters.record(handle, ttl)
+
+        scheduler = PrefetchScheduler(
+            views.profile_cache, hitters, views.refresh_profile, views.handle_failed,
+            interval=options['interval'], lead=options['lead'],
+            concurrency=options['concurrency'], rate=options['rate'],
+            backoff=getattr(settings, 'BADGE_PREFETCH_BACKOFF', 60),
+            max_backoff=getattr(settings, 'BADGE_PREFETCH_MAX_BACKOFF', 86400))
+        self.stdout.write('tracking {} hot handles'.format(len(hitters.top())))
+        try:
+            scheduler.run(once=options['once'])
+        except KeyboardInterrupt:
+            scheduler.stop()
+        self.stdout.write('refreshed {}, failed {}, skipped {}'.format(
+            scheduler.refreshed, scheduler.failed, scheduler.skipped))
@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import requests
+from json import JSONDecodeError
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from api import views
+from api.cache import normalize_handle
+from api.compression import compress
+from api.upstream import UpstreamStatusError
+
+# solved.ac handles; anything else would not be a safe file name either
+HANDLE = re.compile(r'^[A-Za-z0-9_]+$')
+
+MANIFEST = 'manifest.json'
+
+
+def render_handle(job):
+    """Bodies of every variant of one badge, run in the process pool.
+
+    Goes through the same ``BojDefaultSettings`` and variant render functions
+    as the badge views, so the files match what the views would send.
+    """
+    handle, profile, variants, brotli_quality = job
+    rendered = {}
+    for variant in variants:
+        spec = views.BADGE_VARIANTS[variant]
+        url_set = views.UrlSettings(None, spec.max_len, handle)
+        body = spec.render(url_set, views.BojDefaultSettings(None, url_set, profile))
+        rendered[variant] = (body, compress(body, brotli_quality) if brotli_quality is not None else {})
+    return handle, rendered
+
+
+def write_file(path, data):
+    # atomic, so a static host never serves half a badge
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class Command(BaseCommand):
+    help = ('Render the badges of a list of handles into static files, <output>/<variant>/<handle>.svg, '
+            'for a static host or CDN to serve. Handles whose profile has not changed since the last run '
+            'are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default='-',
+                            help='file with one handle per line (default: stdin)')
+        parser.add_argument('-o', '--output', required=True, help='directory to write the badges to')
+        parser.add_argument('--variant', action='append', choices=sorted(views.BADGE_VARIANTS),
+                            help='variant to render, repeatable (default: all)')
+        parser.add_argument('--compress', action='store_true',
+                            help='also write .svg.gz and .svg.br files next to each badge')
+        parser.add_argument('--brotli-quality', type=int, default=11)
+        parser.add_argument('--concurrency', type=int, default=8, help='profiles fetched at once')
+        parser.add_argument('--processes', type=int, default=None, help='render processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true', help='render every handle, changed or not')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        output = options['output']
+        variants = options['variant'] or sorted(views.BADGE_VARIANTS)
+        brotli_quality = options['brotli_quality'] if options['compress'] else None
+
+        source = sys.stdin if options['source'] == '-' else open(options['source'])
+        # one file per handle, whatever its case in the list; the first spelling is the one shown
+        unique = {}
+        with source:
+            for line in source:
+                if line.strip():
+                    unique.setdefault(normalize_handle(line), line.strip())
+        handles = list(unique.values())
+        invalid = [handle for handle in handles if not HANDLE.match(handle)]
+        for handle in invalid:
+            self.stderr.write('skipping invalid handle {!r}'.format(handle))
+        handles = [handle for handle in handles if HANDLE.match(handle)]
+        if not handles:
+            raise CommandError('no handles to render')
+
+        manifest_path = os.path.join(output, MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+
+        profiles, failed = self.fetch(handles, options['concurrency'])
+        fetched = time.perf_counter()
+        jobs, digests, skipped = [], {}, 0
+        for handle, profile in profiles.items():
+            digests[handle] = self.digest(handle, profile, variants, brotli_quality)
+            if not options['force'] and manifest.get(normalize_handle(handle)) == digests[handle] and \
+                    all(os.path.exists(self.path(output, variant, handle)) for variant in variants):
+                skipped += 1
+                continue
+            jobs.append((handle, profile, variants, brotli_quality))
+
+        for variant in variants:
+            os.makedirs(os.path.join(output, variant), exist_ok=True)
+        written = 0
+        if jobs:
+            with ProcessPoolExecutor(options['processes'], initializer=django.setup) as pool:
+                for handle, rendered in pool.map(render_handle, jobs, chunksize=max(1, len(jobs) // 64)):
+                    for variant, (body, encoded) in rendered.items():
+                        path = self.path(output, variant, handle)
+                        write_file(path, body)
+                        for coding, data in encoded.items():
+                            write_file(path + ('.br' if coding == 'br' else '.gz'), data)
+                        written += 1
+                    manifest[normalize_handle(handle)] = digests[handle]
+            self.write_tier_images(output)
+            write_file(manifest_path, json.dumps(manifest, indent=0, sort_keys=True).encode())
+
+        self.stdout.write('{} handles: rendered {} ({} files), unchanged {}, failed {}; '
+                          'fetched in {:.1f}s, rendered in {:.1f}s'.format(
+                              len(handles), len(jobs), written, skipped, len(failed),
+                              fetched - started, time.perf_counter() - fetched))
+        for handle, error in failed.items():
+            self.stderr.write('{}: {}'.format(handle, error))
+
+    def fetch(self, handles, concurrency):
+        """{handle: profile or None for unknown users}, {handle: error} for the ones that failed."""
+        ttl = min(views.PROFILE_TTL.values())
+
+        def load(handle):
+            # only profiles within their TTL: no stale ones, and no background refresh the exit would kill
+            entry = views.profile_cache.last_known(handle)
+            if entry is not None and time.time() - entry[0] < ttl:
+                return entry[1], None
+            try:
+                return views.profile_cache.refresh(handle, lambda: views.fetch_profile(handle)), None
+            except UpstreamStatusError as e:
+                if e.status == 404:
+                    # drawn as the Unknown badge, like the views do
+                    return None, None
+                return None, e
+            except (JSONDecodeError, requests.RequestException) as e:
+                # keep the files of the last run rather than drawing Unknown
+                return None, e
+
+        profiles, failed = {}, {}
+        with ThreadPoolExecutor(concurrency) as pool:
+            for handle, (profile, error) in zip(handles, pool.map(load, handles)):
+                if error is None:
+                    profiles[handle] = profile
+                else:
+                    failed[handle] = error
+        return profiles, failed
+
+    @staticmethod
+    def digest(handle, profile, variants, brotli_quality):
+        # what the files depend on: the displayed handle, the profile fields and the templates
+        return hashlib.sha1(repr((
+            handle, views.profile_fingerprint(profile), brotli_quality,
+            [(variant, views.BADGE_VARIANTS[variant].template.digest) for variant in variants],
+        )).encode()).hexdigest()
+
+    @staticmethod
+    def path(output, variant, handle):
+        return os.path.join(output, variant, normalize_handle(handle) + '.svg')
+
+    @staticmethod
+    def write_tier_images(output):
+        # v2 badges link these; point BADGE_TIER_ASSET_URL at <output>/tier/ when serving them from there
+        os.makedirs(os.path.join(output, 'tier'), exist_ok=True)
+        for asset in views.TIER_ASSETS.values():
+            path = os.path.join(output, 'tier', asset.name)
+            if not os.path.exists(path):
+                write_file(path, asset.body)
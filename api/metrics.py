@@ -0,0 +1,357 @@
+import os
+import json
+import atexit
+import logging
+import tempfile
+import threading
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('testlogger')
+
+# seconds; solved.ac answers in tens of milliseconds, renders take tens of microseconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Value(object):
+    """One labelled counter or gauge."""
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock):
+        self.value = 0
+        self._lock = lock
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class HistogramValue(object):
+    """One labelled histogram: a count per bucket (the last one is +Inf) and the sum."""
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, lock, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self):
+        return self.counts + [self.sum]
+
+
+class NullValue(object):
+    """Stands in for every value when metrics are off."""
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+    dec = set = observe = inc
+
+
+NULL_VALUE = NullValue()
+
+
+class Metric(object):
+    def __init__(self, registry, kind, name, help, labelnames=(), buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self._values = {}
+
+    def labels(self, *values):
+        value = self._values.get(values)
+        if value is None:
+            if not self.registry.enabled:
+                return NULL_VALUE
+            if len(values) != len(self.labelnames):
+                raise ValueError('{} takes labels {}'.format(self.name, self.labelnames))
+            lock = self.registry._lock
+            value = HistogramValue(lock, self.buckets) if self.kind == 'histogram' else Value(lock)
+            value = self._values.setdefault(values, value)
+        return value
+
+    def snapshot(self):
+        return {
+            'kind': self.kind,
+            'help': self.help,
+            'labels': self.labelnames,
+            'buckets': self.buckets,
+            'samples': [[list(labels), value.snapshot()] for labels, value in list(self._values.items())],
+        }
+
+
+class Registry(object):
+    """In-process metrics with Prometheus text exposition.
+
+    Recording is a dict lookup and an add under a lock. Each gunicorn worker
+    has its own registry, so with a ``directory`` every process writes a
+    snapshot to ``<directory>/metrics-<pid>.json`` every ``flush_interval``
+    seconds (and at exit), and ``exposition`` adds up the snapshots of all the
+    workers of the same server: counters and histograms from every worker,
+    including ones that have exited, gauges only from the live ones. The
+    counters of exited workers are folded into one
+    ``<directory>/exited-<master pid>.json`` and their files deleted, so
+    restarts don't grow the directory. Files left by an earlier server are
+    deleted once its master is gone.
+
+    ``collect`` registers functions called right before a snapshot, for
+    values that are cheaper to copy from elsewhere than to count twice.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0, enabled=True):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Metric(self, 'counter', name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Metric(self, 'gauge', name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Metric(self, 'histogram', name, help, labelnames, buckets))
+
+    def collect(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def clear(self):
+        """Forget every recorded value, e.g. after changing ``enabled``."""
+        for metric in self._metrics.values():
+            metric._values.clear()
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('metric {} already registered'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def start(self):
+        """Start flushing from this process, once per process; a no-op without a directory."""
+        if self._pid == os.getpid() or not (self.enabled and self.directory):
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            atexit.register(self.flush)
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def snapshot(self):
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                logger.error('metrics collector failed: {}'.format(e))
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def flush(self, metrics=None):
+        if not self.directory:
+            return
+        state = {'pid': os.getpid(), 'ppid': os.getppid(), 'metrics': metrics or self.snapshot()}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.metrics-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self._path(os.getpid()))
+        except OSError as e:
+            logger.error('could not write metrics: {}'.format(e))
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'metrics-{}.json'.format(pid))
+
+    def processes(self):
+        """[(snapshot, alive)] of this process and every other worker of the same server."""
+        own = self.snapshot()
+        found = [(own, True)]
+        if not self.directory:
+            return found
+        self.flush(own)
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return found
+        exited = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.startswith('exited-') and name.endswith('.json'):
+                # an earlier server's exited workers, once that server has stopped
+                master = name[len('exited-'):-len('.json')]
+                if path != self._exited_path() and master.isdigit() and not alive(int(master)):
+                    remove(path)
+                continue
+            if not (name.startswith('metrics-') and name.endswith('.json')) or path == self._path(os.getpid()):
+                continue
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if state['ppid'] != os.getppid():
+                # another server's worker; its files go once that server has stopped
+                if not alive(state['ppid']) and not alive(state['pid']):
+                    remove(path)
+                continue
+            if alive(state['pid']):
+                found.append((state['metrics'], True))
+            else:
+                exited.append((path, state['metrics']))
+        found.extend((metrics, False) for metrics in self._fold(exited))
+        return found
+
+    def _exited_path(self):
+        return os.path.join(self.directory, 'exited-{}.json'.format(os.getppid()))
+
+    def _fold(self, exited):
+        """Snapshots of this server's exited workers, after folding ``exited`` [(path, metrics)] into one file."""
+        if fcntl is None:
+            # nothing to make the fold atomic with, so the files stay
+            return [metrics for _, metrics in exited]
+        try:
+            fd = os.open(self._exited_path(), os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as e:
+            logger.error('could not fold exited workers\' metrics: {}'.format(e))
+            return [metrics for _, metrics in exited]
+        with os.fdopen(fd, 'r+') as f:
+            # every worker folds, one at a time; the lock goes with the file
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                folded = json.load(f)
+            except ValueError:
+                folded = {}
+            # files another worker folded while this one waited are gone
+            exited = [(path, metrics) for path, metrics in exited if os.path.exists(path)]
+            if not exited:
+                return [folded]
+            folded = unmerged(merge([(folded, False)] + [(metrics, False) for _, metrics in exited]))
+            try:
+                f.seek(0)
+                f.truncate()
+                json.dump(folded, f)
+                f.flush()
+            except OSError as e:
+                logger.error('could not fold exited workers\' metrics: {}'.format(e))
+                return [folded]
+            for path, _ in exited:
+                remove(path)
+            return [folded]
+
+    def exposition(self):
+        """All the metrics in the Prometheus text format, version 0.0.4."""
+        merged = merge(self.processes())
+
+        lines = []
+        for name, metric in sorted(merged.items()):
+            lines.append('# HELP {} {}'.format(name, metric['help']))
+            lines.append('# TYPE {} {}'.format(name, metric['kind']))
+            for labels, value in sorted(metric['samples'].items()):
+                pairs = list(zip(metric['labels'], labels))
+                if metric['kind'] != 'histogram':
+                    lines.append('{}{} {}'.format(name, format_labels(pairs), format_value(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric['buckets']) + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else format_value(bound)
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(pairs + [('le', le)]), cumulative))
+                lines.append('{}_sum{} {}'.format(name, format_labels(pairs), format_value(value[-1])))
+                lines.append('{}_count{} {}'.format(name, format_labels(pairs), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def merge(processes):
+    """{name: metric with samples as {labels: value}}, adding up [(snapshot, alive)]; gauges only if alive."""
+    merged = {}
+    for metrics, live in processes:
+        for name, metric in metrics.items():
+            if metric['kind'] == 'gauge' and not live:
+                continue
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labels, value in metric['samples']:
+                labels = tuple(labels)
+                old = target['samples'].get(labels)
+                if old is None:
+                    target['samples'][labels] = value
+                elif isinstance(value, list):
+                    target['samples'][labels] = [a + b for a, b in zip(old, value)]
+                else:
+                    target['samples'][labels] = old + value
+    return merged
+
+
+def unmerged(merged):
+    # back to the snapshot shape, which JSON can hold
+    return {name: dict(metric, samples=[[list(labels), value] for labels, value in metric['samples'].items()])
+            for name, metric in merged.items()}
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
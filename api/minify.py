@@ -0,0 +1,133 @@
+import re
+from string import Formatter
+
+# template fields and stylesheets are swapped for these while the markup is minified
+FIELD = '\ue000{}\ue001'
+FIELD_MARK = re.compile('\ue000(\\d+)\ue001')
+STYLESHEET = '\ue002{}\ue003'
+STYLESHEET_MARK = re.compile('\ue002(\\d+)\ue003')
+
+TAG = re.compile(r'<([\w:-]+)((?:\s+[\w:-]+\s*=\s*"[^"]*")*)\s*(/?)>')
+ATTRIBUTE = re.compile(r'([\w:-]+)\s*=\s*"([^"]*)"')
+STYLE = re.compile(r'(<style[^>]*>)\s*<!\[CDATA\[(.*?)\]\]>\s*(</style>)', re.S)
+EMPTY_ELEMENT = re.compile(r'<([\w:-]+)([^<>]*[^/<>])?></\1>')
+
+IMPORT = re.compile(r'\s*(@import\s+url\([^)]*\)[^;]*;)')
+KEYFRAMES = re.compile(r'\s*@keyframes\s+([\w-]+)\s*\{((?:\s*[^{}]+\{[^{}]*\})*)\s*\}')
+FRAME = re.compile(r'\s*([^{}]+?)\s*\{([^{}]*)\}')
+RULE = re.compile(r'\s*([^{}@]+?)\s*\{([^{}]*)\}')
+SIMPLE_SELECTOR = re.compile(r'^([\w-]*)((?:\.[\w-]+)*)$')
+
+
+def minify_svg(source):
+    """``source``, a badge template in ``str.format`` syntax, minified into the same syntax.
+
+    Drops the DOCTYPE, comments, indentation and whitespace between tags,
+    ``version`` and unused ``xmlns:xlink``, ids nothing refers to and
+    design-tool ``data-*`` attributes, and empties elements into ``<x/>``.
+    In the stylesheet: whitespace, rules for classes or elements not in the
+    markup, keyframes no animation uses, and repeated keyframe steps (``0%``
+    and ``60%`` with the same declarations become ``0%,60%``). Text content
+    and attribute values other than ``style`` are left alone, so the badge
+    renders the same.
+    """
+    fields = []
+    text = []
+    for literal, field, spec, conversion in Formatter().parse(source):
+        text.append(literal)
+        if field is not None:
+            text.append(FIELD.format(len(fields)))
+            fields.append('{' + field + ('!' + conversion if conversion else '') + (':' + spec if spec else '') + '}')
+    svg = minify_markup(''.join(text))
+    svg = svg.replace('{', '{{').replace('}', '}}')
+    return FIELD_MARK.sub(lambda match: fields[int(match.group(1))], svg)
+
+
+def minify_markup(svg):
+    svg = re.sub(r'<!DOCTYPE[^>]*>|<!--.*?-->', '', svg, flags=re.S)
+    styles = []
+
+    def take_style(match):
+        styles.append(match.group(2))
+        return match.group(1) + STYLESHEET.format(len(styles) - 1) + match.group(3)
+
+    # ids are referenced from the stylesheet too
+    referenced = {name for pair in re.findall(r'url\(#([\w-]+)\)|href="#([\w-]+)"', svg) for name in pair if name}
+    svg = STYLE.sub(take_style, svg)
+    xlink = 'xlink:' in svg.replace('xmlns:xlink', '')
+    svg = TAG.sub(lambda match: minify_tag(match, referenced, xlink), svg)
+    svg = re.sub(r'>\s+<', '><', svg).strip()
+    svg = EMPTY_ELEMENT.sub(lambda match: '<{}{}/>'.format(match.group(1), match.group(2) or ''), svg)
+
+    classes = set()
+    for names in re.findall(r'class="([^"]*)"', svg):
+        classes.update(names.split())
+    elements = set(re.findall(r'<([\w:-]+)', svg))
+    inline_styles = ' '.join(re.findall(r'style="([^"]*)"', svg))
+    return STYLESHEET_MARK.sub(lambda match: '<![CDATA[{}]]>'.format(
+        minify_css(styles[int(match.group(1))], classes, elements, inline_styles)), svg)
+
+
+def minify_tag(match, referenced, xlink):
+    name, attributes, closing = match.groups()
+    kept = []
+    for attribute, value in ATTRIBUTE.findall(attributes):
+        if attribute == 'id' and value not in referenced:
+            continue
+        if attribute.startswith('data-') or attribute == 'version' or (attribute == 'xmlns:xlink' and not xlink):
+            continue
+        if attribute == 'style':
+            value = minify_declarations(value)
+        kept.append('{}="{}"'.format(attribute, value))
+    return '<{}{}{}>'.format(name, ''.join(' ' + attribute for attribute in kept), closing)
+
+
+def minify_declarations(declarations):
+    out = []
+    for declaration in declarations.split(';'):
+        prop, _, value = declaration.partition(':')
+        if prop.strip() and value.strip():
+            value = re.sub(r'\s*,\s*', ',', ' '.join(value.split()))
+            out.append('{}:{}'.format(prop.strip(), value))
+    return ';'.join(out)
+
+
+def selector_used(selector, classes, elements):
+    match = SIMPLE_SELECTOR.match(selector)
+    if match is None or not selector:
+        # anything fancier than `element.class` is kept as it is
+        return True
+    element, names = match.groups()
+    return (not element or element in elements) and all(name in classes for name in names.split('.')[1:])
+
+
+def minify_css(css, classes, elements, inline_styles):
+    # `;` escaped in the font URLs (the same URL to the server): simple CSS
+    # parsers, like the ones in SVG rasterizers, end the @import there and
+    # take the rest as part of the next rule
+    imports = [re.sub(r'url\((.*?)\)', lambda match: 'url({})'.format(match.group(1).replace(';', '%3B')), statement)
+               for statement in IMPORT.findall(css)]
+    css = IMPORT.sub('', css)
+    keyframes = KEYFRAMES.findall(css)
+    css = KEYFRAMES.sub('', css)
+
+    rules = []
+    for selectors, declarations in RULE.findall(css):
+        used = [selector for selector in (part.strip() for part in selectors.split(','))
+                if selector_used(selector, classes, elements)]
+        declarations = minify_declarations(declarations)
+        if used and declarations:
+            rules.append('{}{{{}}}'.format(','.join(used), declarations))
+
+    animations = ' '.join(rules) + ' ' + inline_styles
+    frames = []
+    for name, steps in keyframes:
+        if not re.search(r'\b{}\b'.format(re.escape(name)), animations):
+            continue
+        merged = {}
+        for offsets, declarations in FRAME.findall(steps):
+            offsets = [{'from': '0%', '100%': 'to'}.get(offset.strip(), offset.strip()) for offset in offsets.split(',')]
+            merged.setdefault(minify_declarations(declarations), []).extend(offsets)
+        frames.append('@keyframes {}{{{}}}'.format(name, ''.join(
+            '{}{{{}}}'.format(','.join(offsets), declarations) for declarations, offsets in merged.items())))
+    return ''.join(imports + frames + rules)
@@ -0,0 +1,209 @@
+import os
+import time
+import heapq
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import normalize_handle
+
+logger = logging.getLogger('testlogger')
+
+
+class CountMinSketch(object):
+    """Approximate per-key counters in ``width * depth`` cells; never undercounts."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def _cells(self, key):
+        data = key.encode()
+        return [zlib.crc32(data, seed) % self.width for seed in range(self.depth)]
+
+    def add(self, key, count=1):
+        # conservative update: only raise the cells that are at the current estimate
+        cells = self._cells(key)
+        estimate = min(row[cell] for row, cell in zip(self._rows, cells)) + count
+        for row, cell in zip(self._rows, cells):
+            if row[cell] < estimate:
+                row[cell] = estimate
+        return estimate
+
+    def estimate(self, key):
+        return min(row[cell] for row, cell in zip(self._rows, self._cells(key)))
+
+    def decay(self):
+        for row in self._rows:
+            for i, value in enumerate(row):
+                row[i] = value >> 1
+
+
+class HeavyHitters(object):
+    """Top-``k`` most requested handles, from a count-min sketch and a min-heap.
+
+    ``record`` is called on the request path: a sketch update plus, for
+    handles in (or entering) the top-k, a heap push. Counts are halved every
+    ``decay_every`` records so the ranking follows recent traffic. Each hot
+    handle also remembers the shortest profile TTL it was requested with.
+    """
+
+    def __init__(self, k=256, width=2048, depth=4, decay_every=100000):
+        self.k = k
+        self.decay_every = decay_every
+        self.sketch = CountMinSketch(width, depth)
+        self._top = {}
+        self._ttl = {}
+        self._heap = []
+        self._records = 0
+        self._lock = threading.Lock()
+
+    def record(self, handle, ttl):
+        key = normalize_handle(handle)
+        with self._lock:
+            self._records += 1
+            if self._records % self.decay_every == 0:
+                self._decay()
+            count = self.sketch.add(key)
+            if key in self._top:
+                self._top[key] = count
+                self._ttl[key] = min(ttl, self._ttl[key])
+                heapq.heappush(self._heap, (count, key))
+            elif len(self._top) < self.k or count > self._min_count():
+                if len(self._top) >= self.k:
+                    _, evicted = heapq.heappop(self._heap)
+                    del self._top[evicted]
+                    del self._ttl[evicted]
+                self._top[key] = count
+                self._ttl[key] = ttl
+                heapq.heappush(self._heap, (count, key))
+            # drop superseded heap entries once they dominate
+            if len(self._heap) > 4 * self.k:
+                self._heap = [(count, key) for key, count in self._top.items()]
+                heapq.heapify(self._heap)
+
+    def top(self):
+        """[(handle, count, ttl)] most requested first."""
+        with self._lock:
+            return sorted(((key, count, self._ttl[key]) for key, count in self._top.items()),
+                          key=lambda item: -item[1])
+
+    def _min_count(self):
+        # skip heap entries superseded by a later push for the same key
+        while self._heap and self._top.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else 0
+
+    def _decay(self):
+        self.sketch.decay()
+        self._top = {key: count >> 1 for key, count in self._top.items()}
+        self._heap = [(count, key) for key, count in self._top.items()]
+        heapq.heapify(self._heap)
+
+
+class PrefetchScheduler(object):
+    """Refreshes the hottest handles shortly before their cached profile expires.
+
+    Every ``interval`` seconds the top handles from ``hitters`` whose profile
+    in ``cache`` expires within ``lead`` seconds are refreshed through
+    ``loader(handle)``, with at most ``concurrency`` refreshes in flight and
+    at most ``rate`` started per second. ``start`` runs the loop on a daemon
+    thread of the current process (it restarts after a fork); ``run`` runs
+    it in the foreground for the management command.
+
+    A handle whose refresh failed with an error ``handle_failed(error)`` says
+    is about the handle, e.g. one solved.ac doesn't know, is not due again
+    for ``backoff`` seconds, doubling with every failure in a row up to
+    ``max_backoff``; a success forgets the failures. Other errors (rate
+    limits, an open circuit, solved.ac being down) skip the handle until the
+    next interval. Without ``handle_failed`` nothing backs off.
+    """
+
+    def __init__(self, cache, hitters, loader, handle_failed=None, interval=10, lead=60, concurrency=4, rate=5,
+                 backoff=60, max_backoff=86400):
+        self.cache = cache
+        self.hitters = hitters
+        self.loader = loader
+        self.handle_failed = handle_failed
+        self.interval = interval
+        self.lead = lead
+        self.concurrency = concurrency
+        self.rate = rate
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._pid = None
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            threading.Thread(target=self.run, name='profile-prefetch', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, once=False):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='prefetch') as pool:
+            while not self._stop.is_set():
+                futures = [pool.submit(self._refresh, handle) for handle in self._paced(self.due())]
+                if once:
+                    for future in futures:
+                        future.result()
+                    return
+                self._stop.wait(self.interval)
+
+    def due(self):
+        """Hot handles whose cached profile is missing or expires within ``lead`` seconds."""
+        now = time.time()
+        top = self.hitters.top()
+        with self._lock:
+            # handles that left the top can't come due, so their failures go
+            hot = {handle for handle, _, _ in top}
+            self._failures = {handle: failure for handle, failure in self._failures.items() if handle in hot}
+            retry_at = {handle: failure[1] for handle, failure in self._failures.items()}
+        handles = []
+        for handle, _, ttl in top:
+            if retry_at.get(handle, 0) > now:
+                continue
+            fetched_at = self.cache.fetched_at(handle)
+            if fetched_at is None or fetched_at + ttl - now < self.lead:
+                handles.append(handle)
+        return handles
+
+    def _paced(self, handles):
+        for i, handle in enumerate(handles):
+            if i and self.rate:
+                if self._stop.wait(1.0 / self.rate):
+                    return
+            yield handle
+
+    def _refresh(self, handle):
+        try:
+            self.cache.refresh(handle, lambda: self.loader(handle))
+            self.refreshed += 1
+            with self._lock:
+                self._failures.pop(handle, None)
+        except Exception as e:
+            if self.handle_failed is None or not self.handle_failed(e):
+                # nothing wrong with the handle; the next interval tries again
+                self.skipped += 1
+                logger.info('prefetch of {} skipped: {}'.format(handle, e))
+                return
+            self.failed += 1
+            with self._lock:
+                failures = self._failures.get(handle, (0, 0))[0] + 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+                self._failures[handle] = (failures, time.time() + delay)
+            logger.error('prefetch of {} failed, retrying in {}s: {}'.format(handle, int(delay), e))
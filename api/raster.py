@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .cache import RenderedBadge
+
+try:
+    import cairosvg
+except (ImportError, OSError):
+    # OSError: the package is installed but libcairo is not
+    cairosvg = None
+
+try:
+    import resvg_py
+except ImportError:
+    resvg_py = None
+
+logger = logging.getLogger('testlogger')
+
+# bump when the PNG for the same SVG changes, e.g. a new rasterizer or static frame
+RASTER_VERSION = 1
+
+KEYFRAMES = re.compile(r'@keyframes\s+([\w-]+)\s*\{((?:\s*[\w%,\s]+\{[^{}]*\})*)\s*\}')
+FRAME = re.compile(r'([\w%,\s]+)\{([^{}]*)\}')
+ANIMATED_RULE = re.compile(r'([^{}@;]+)\{([^{}]*\banimation\s*:\s*([\w-]+)[^{}]*)\}')
+
+
+def static_frame(svg):
+    """``svg`` with every CSS animation shown at its last frame.
+
+    Rasterizers draw the document before any animation runs, which for the
+    badges is with the text faded out and the rate bar empty. The last
+    keyframe of each animation is appended as a plain rule for the selectors
+    using it, which is where a browser leaves them (``forwards``).
+    """
+    text = svg.decode()
+    finals = {}
+    for name, frames in KEYFRAMES.findall(text):
+        for offsets, declarations in FRAME.findall(frames):
+            if offsets.strip() in ('to', '100%'):
+                finals[name] = declarations.strip()
+    rules = ['{} {{ {} }}'.format(selector.strip(), finals[name])
+             for selector, _, name in ANIMATED_RULE.findall(text) if name in finals]
+    if not rules:
+        return svg
+    style = '<style type="text/css"><![CDATA[{}]]></style></svg>'.format(' '.join(rules))
+    return (text[:text.rindex('</svg>')] + style).encode()
+
+
+def svg_to_png(svg):
+    # runs in the pool processes
+    svg = static_frame(svg)
+    if cairosvg is not None:
+        return cairosvg.svg2png(bytestring=svg)
+    return bytes(resvg_py.svg_to_bytes(svg_string=svg.decode()))
+
+
+class Rasterizer(object):
+    """Turns badge SVGs into PNGs in a small process pool, off the request threads.
+
+    PNGs are cached in ``cache`` (a ``RenderCache``) by a hash of the SVG,
+    and a second request for an SVG already being rasterized gets the same
+    future. At most ``max_queue`` SVGs are waiting or being rasterized at a
+    time; past that ``rasterize`` returns None and the caller sends the SVG
+    instead. The pool is started on first use in each process, with fresh
+    interpreters rather than forks of a threaded web worker.
+    """
+
+    def __init__(self, cache, processes=2, max_queue=8):
+        self.cache = cache
+        self.processes = processes
+        self.max_queue = max_queue
+        self.rasterized = 0
+        self.overloaded = 0
+        self.failed = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    @property
+    def available(self):
+        return cairosvg is not None or resvg_py is not None
+
+    def rasterize(self, svg):
+        """PNG bytes if cached, else a future of them; None when the pool is full."""
+        key = (hashlib.sha1(svg).hexdigest(),)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.body
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            if len(self._pending) >= self.max_queue:
+                self.overloaded += 1
+                return None
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            future = self._pool.submit(svg_to_png, svg)
+            self._pending[key] = future
+        # cached even if the request stopped waiting for it
+        future.add_done_callback(lambda done: self._done(key, done))
+        return future
+
+    def _done(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+        error = 'cancelled' if future.cancelled() else future.exception()
+        if error is not None:
+            self.failed += 1
+            logger.error('PNG rasterization failed: {}'.format(error))
+            if isinstance(error, BrokenProcessPool):
+                # a pool process died; the next request starts a new pool
+                with self._lock:
+                    self._pool = None
+            return
+        self.rasterized += 1
+        self.cache.set(key, RenderedBadge(future.result(), 'png'))
+
+    def stats(self):
+        return {'rasterized': self.rasterized, 'overloaded': self.overloaded, 'failed': self.failed,
+                'queued': len(self._pending)}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            if sys.version_info >= (3, 9):
+                pool.shutdown(cancel_futures=True)
+            else:
+                # no cancel_futures before 3.9: cancel what hasn't started, don't wait for the rest
+                for future in list(self._pending.values()):
+                    future.cancel()
+                pool.shutdown(wait=False)
@@ -0,0 +1,129 @@
+import os
+import time
+import struct
+import logging
+import threading
+import contextlib
+
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('testlogger')
+
+# a badge someone is waiting for, and a refresh nobody is waiting for
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+class RateLimitedError(requests.RequestException):
+    """The solved.ac request was shed instead of waiting for the rate limiter."""
+
+
+class TokenBucket(object):
+    """Paces solved.ac requests from every worker on a host to ``rate`` per second.
+
+    The bucket holds up to ``burst`` tokens. Its state, 16 bytes, lives in
+    ``path`` and is read and written under an exclusive ``flock``, so all
+    the processes on the host share it (without ``path``, or without fcntl,
+    each process has its own bucket). ``reserve`` takes a token and returns
+    how long to wait for it: callers queue by reserving tokens ahead, which
+    keeps them in order without polling.
+
+    Interactive requests may queue for up to ``budget`` seconds and are shed
+    with ``RateLimitedError`` past that. Background requests never queue:
+    they only get a token while more than ``background_reserve`` are left,
+    so refreshes never delay a badge someone is waiting for.
+    """
+
+    STATE = struct.Struct('dd')
+
+    def __init__(self, rate, burst, path=None, budget=1.0, background_reserve=0):
+        self.rate = rate
+        self.burst = burst
+        self.path = path if fcntl is not None else None
+        self.budget = budget
+        self.background_reserve = background_reserve
+        self.shed = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._state = None
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def reserve(self, priority=INTERACTIVE):
+        """Seconds to wait before sending; raises ``RateLimitedError`` to shed the request."""
+        with self._locked() as state:
+            tokens, now = state
+            if priority == BACKGROUND:
+                if tokens < 1 + self.background_reserve:
+                    self.shed[priority] += 1
+                    raise RateLimitedError('no solved.ac budget left for background refreshes')
+                wait = 0.0
+            else:
+                wait = max(0.0, (1 - tokens) / self.rate)
+                if wait > self.budget:
+                    self.shed[priority] += 1
+                    raise RateLimitedError('solved.ac rate limit: {:.2f}s wait over budget'.format(wait))
+            # tokens below zero are requests queued ahead
+            state[0] = tokens - 1
+        return wait
+
+    def acquire(self, priority=INTERACTIVE):
+        wait = self.reserve(priority)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Hold every request on the host for ``seconds``, e.g. after a 429."""
+        with self._locked() as state:
+            state[0] = min(state[0], 1 - seconds * self.rate)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # yields [tokens, now]; what the block leaves in it is written back unless it raises
+        with self._lock:
+            fd = self._file()
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                tokens, updated = self._read(fd)
+                now = time.time()
+                # a clock stepping back refills nothing
+                state = [min(self.burst, tokens + max(0.0, now - updated) * self.rate), now]
+                yield state
+                self._write(fd, *state)
+            finally:
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _file(self):
+        # flock is per open file: threads share one under self._lock, a fork opens its own
+        if self.path is None:
+            return None
+        if self._pid != os.getpid():
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            except OSError as e:
+                logger.error('rate limiter falls back to this process only: {}'.format(e))
+                self.path = None
+                return None
+            self._pid = os.getpid()
+        return self._fd
+
+    def _read(self, fd):
+        if fd is None:
+            state = self._state
+        else:
+            data = os.pread(fd, self.STATE.size, 0)
+            state = self.STATE.unpack(data) if len(data) == self.STATE.size else None
+        return state if state is not None else (self.burst, time.time())
+
+    def _write(self, fd, tokens, updated):
+        if fd is None:
+            self._state = (tokens, updated)
+        else:
+            os.pwrite(fd, self.STATE.pack(tokens, updated), 0)
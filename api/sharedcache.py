@@ -0,0 +1,286 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .cache import PROFILE_FIELDS, RenderedBadge
+
+logger = logging.getLogger('testlogger')
+
+
+def cache_key(namespace, key):
+    # memcached keys can't hold spaces or control characters and stop at 250 bytes
+    if len(key) <= 64 and key.isascii() and key.isprintable() and ' ' not in key:
+        return namespace + ':' + key
+    return namespace + ':' + hashlib.sha1(key.encode()).hexdigest()
+
+
+class Namespace(object):
+    """The keys of one store in a Django cache, which ``clear`` drops together.
+
+    Django caches can only be emptied as a whole, so every key carries a
+    generation number, kept in the cache itself, and ``clear`` moves to the
+    next one: older entries are never read again and expire on their own.
+    Each process rereads the generation at most every ``refresh`` seconds,
+    so a clear reaches the other workers within that.
+    """
+
+    def __init__(self, cache, name, version=1, refresh=1.0):
+        self.cache = cache
+        self.name = name
+        self.version = version
+        self.refresh = refresh
+        self._generation = None
+        self._read_at = 0
+
+    def key(self, key):
+        now = time.monotonic()
+        if self._generation is None or now - self._read_at >= self.refresh:
+            self._generation = self.cache.get(self.name + ':generation', 0, version=self.version)
+            self._read_at = now
+        # generation 0 keeps the keys written before there were generations
+        return cache_key(self.name + (':{}'.format(self._generation) if self._generation else ''), key)
+
+    def clear(self):
+        generation = self.cache.get(self.name + ':generation', 0, version=self.version) + 1
+        self.cache.set(self.name + ':generation', generation, timeout=None, version=self.version)
+        self._generation = generation
+        self._read_at = time.monotonic()
+
+
+class ProfileStore(object):
+    """Shared second level for ``ProfileCache`` on any Django cache backend.
+
+    Profiles are stored as ``(fetched_at, *PROFILE_FIELDS)`` tuples, which
+    pickle smaller and faster than the dicts. ``version`` is the Django cache
+    key version; bump it when the stored shape changes.
+    """
+
+    def __init__(self, cache, version=1):
+        self.cache = cache
+        self.version = version
+        self.namespace = Namespace(cache, 'profile', version)
+
+    def get(self, key):
+        """(fetched_at, profile) or None."""
+        value = self.cache.get(self.namespace.key(key), version=self.version)
+        if value is None:
+            return None
+        return value[0], {field: v for field, v in zip(PROFILE_FIELDS, value[1:]) if v is not None}
+
+    def set(self, key, profile, fetched_at, expires_at):
+        value = (fetched_at,) + tuple(profile.get(field) for field in PROFILE_FIELDS)
+        self.cache.set(self.namespace.key(key), value,
+                       timeout=max(0, expires_at - time.time()), version=self.version)
+
+    def clear(self):
+        self.namespace.clear()
+
+
+class HistoryStore(object):
+    """Shared store for ``freshness.ChangeHistory`` on any Django cache backend."""
+
+    def __init__(self, cache, version=1):
+        self.cache = cache
+        self.version = version
+        self.namespace = Namespace(cache, 'history', version)
+
+    def get(self, key):
+        """(fingerprint, first_seen, last_seen, changes) or None."""
+        return self.cache.get(self.namespace.key(key), version=self.version)
+
+    def set(self, key, entry, timeout):
+        self.cache.set(self.namespace.key(key), entry, timeout=timeout, version=self.version)
+
+    def clear(self):
+        self.namespace.clear()
+
+
+class BadgeStore(object):
+    """Shared second level for ``RenderCache`` on any Django cache backend.
+
+    Keys hash the render key together with ``namespace`` (the digest of the
+    badge templates) and use ``version`` as the Django cache key version, so
+    either a template edit or a version bump stops old renders from being
+    served, while profiles stored under their own version stay put.
+    """
+
+    def __init__(self, cache, namespace='', version=1, timeout=7 * 86400):
+        self.cache = cache
+        self.namespace = namespace
+        self.version = version
+        self.timeout = timeout
+        self._keys = Namespace(cache, 'badge:' + namespace if namespace else 'badge', version)
+
+    def get(self, key):
+        value = self.cache.get(self._key(key), version=self.version)
+        if value is None:
+            return None
+        return RenderedBadge(*value)
+
+    def set(self, key, badge):
+        self.cache.set(self._key(key), (badge.body, badge.tier_title, badge.encoded, badge.created_at),
+                       timeout=self.timeout, version=self.version)
+
+    def clear(self):
+        # this store's renders only, not the profiles or other namespaces
+        self._keys.clear()
+
+    def _key(self, key):
+        return self._keys.key(hashlib.sha1(repr((self.namespace,) + key).encode()).hexdigest())
+
+
+class SQLiteCache(BaseCache):
+    """Django cache backend in one SQLite file shared by every worker on a host.
+
+    The database runs in WAL mode so readers never block the writer or each
+    other; each thread of each process opens its own connection. Values are
+    pickled. Expired rows are purged, and the table is culled down from
+    ``MAX_ENTRIES``, every ``OPTIONS['PURGE_EVERY']`` writes. Errors are
+    logged and treated as misses: the cache must never fail a badge.
+
+    Unpickling runs whatever the file holds, so the file is only opened when
+    it and its directory belong to this user and nobody else can write them;
+    otherwise the process logs it once and treats every lookup as a miss.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self.purge_every = params.get('OPTIONS', {}).get('PURGE_EVERY', 1000)
+        self._writes = 0
+        self._local = threading.local()
+        # pid of the process that found the file unsafe
+        self._refused = None
+        self._refuse_lock = threading.Lock()
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        row = self._execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()), 'fetchone')
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._execute(
+            'INSERT OR REPLACE INTO cache (key, expires, value) VALUES (?, ?, ?)',
+            (key, self.get_backend_timeout(timeout), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+        self._written()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        added = self._execute(
+            'INSERT INTO cache (key, expires, value) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET expires = excluded.expires, value = excluded.value '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, self.get_backend_timeout(timeout), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now),
+            'rowcount')
+        self._written()
+        return bool(added)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return bool(self._execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()), 'rowcount'))
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return bool(self._execute('DELETE FROM cache WHERE key = ?', (key,), 'rowcount'))
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._execute(
+            'SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()), 'fetchone') is not None
+
+    def clear(self):
+        self._execute('DELETE FROM cache')
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            now = time.time()
+            self._execute('DELETE FROM cache WHERE expires <= ?', (now,))
+            count = self._execute('SELECT COUNT(*) FROM cache', (), 'fetchone')
+            if count is not None and count[0] > self._max_entries:
+                # same policy as Django's database cache: drop the 1/CULL_FREQUENCY closest to expiry
+                self._execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                    'ORDER BY expires IS NULL, expires LIMIT ?)',
+                    (count[0] // self._cull_frequency,))
+
+    def _execute(self, sql, params=(), result=None):
+        if self._refused == os.getpid():
+            return None
+        try:
+            connection = self._connection()
+            if connection is None:
+                return None
+            cursor = connection.execute(sql, params)
+        except sqlite3.Error as e:
+            logger.error('shared cache query failed: {}'.format(e))
+            return None
+        if result == 'fetchone':
+            return cursor.fetchone()
+        if result == 'rowcount':
+            return cursor.rowcount
+        return None
+
+    def _connection(self):
+        # connections can't cross threads or a fork
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            if not self._private():
+                return None
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            # switching to WAL ignores the busy timeout, so workers starting together retry
+            for attempt in range(50):
+                try:
+                    connection.execute('PRAGMA journal_mode=WAL')
+                    break
+                except sqlite3.OperationalError:
+                    time.sleep(0.01 * (attempt + 1))
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, expires REAL, value BLOB NOT NULL) WITHOUT ROWID')
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def _private(self):
+        with self._refuse_lock:
+            if self._refused == os.getpid():
+                return False
+            for path in (os.path.dirname(os.path.abspath(self.path)), self.path):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_uid != os.getuid():
+                    problem = '{} belongs to uid {}, not {}'.format(path, stat.st_uid, os.getuid())
+                elif stat.st_mode & 0o022:
+                    problem = '{} is writable by other users (mode {:o})'.format(path, stat.st_mode & 0o777)
+                else:
+                    continue
+                # once per process: every later lookup is a miss without another try
+                self._refused = os.getpid()
+                logger.error('shared cache {} disabled: {}'.format(self.path, problem))
+                return False
+            return True
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Collapses concurrent calls for the same key into one.
+
+    The first caller for a key runs ``fn``; callers arriving while it is in
+    flight block and get the same result, or the same exception. ``calls``
+    counts the calls actually made and ``collapsed`` the ones that waited
+    on someone else's.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is not None:
+                self.collapsed += 1
+                leader = False
+            else:
+                call = self._inflight[key] = _Call()
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(object):
+    """``SingleFlight`` for coroutines running on one event loop."""
+
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        future = self._inflight.get(key)
+        if future is not None:
+            self.collapsed += 1
+            # shield: a cancelled waiter must not cancel the leader's result
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        # nobody may be waiting on a failure; don't warn about it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.calls += 1
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
@@ -0,0 +1,90 @@
+import hashlib
+from string import Formatter
+
+
+class SvgTemplate(object):
+    """A ``str.format`` style SVG template compiled once into byte chunks.
+
+    ``source`` uses the same ``{field}`` / ``{{ }}`` syntax the views always
+    had, so ``source.format(**values).encode()`` and ``render`` give the same
+    bytes. Fields listed in ``tier_fields`` only depend on the tier (gradient
+    colors, tier image) and are pre-rendered, together with the markup
+    between them, for every key of ``tier_values``; the remaining fields are
+    per-request slots. Rendering copies the static chunk list, drops in the
+    tier chunk and the encoded slot values, and joins.
+    """
+
+    def __init__(self, source, tier_fields, tier_values):
+        self.source = source
+        self.digest = hashlib.sha1(repr((source, sorted(tier_values.items()))).encode()).hexdigest()[:12]
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if literal:
+                parts.append((None, literal))
+            if field is not None:
+                if spec or conversion or not field.isidentifier():
+                    raise ValueError('unsupported template field: {!r}'.format(field))
+                parts.append((field, None))
+
+        # group each run of tier fields (and the literals between them) into one chunk
+        self._segments = []
+        self._slots = []
+        self._tier_slots = []
+        tier_chunks = []
+        run = None
+        pending = []
+        for field, literal in parts:
+            if field in tier_fields:
+                if run is None:
+                    self._flush_static(pending)
+                    run = []
+                else:
+                    run.extend(pending)
+                pending = []
+                run.append((field, None))
+            elif field is None:
+                pending.append((None, literal))
+            else:
+                if run is not None:
+                    tier_chunks.append(self._close_run(run))
+                    run = None
+                self._flush_static(pending)
+                pending = []
+                self._slots.append((len(self._segments), field))
+                self._segments.append(None)
+        if run is not None:
+            tier_chunks.append(self._close_run(run))
+        self._flush_static(pending)
+
+        self.fields = frozenset(field for _, field in self._slots)
+        self._tier_chunks = {
+            tier: [self._render_run(run, values) for run in tier_chunks]
+            for tier, values in tier_values.items()
+        }
+
+    def render(self, tier, **values):
+        out = self._segments[:]
+        for index, run in self._tier_slots:
+            out[index] = self._tier_chunks[tier][run]
+        encoded = {field: str(values[field]).encode() for field in self.fields}
+        for index, field in self._slots:
+            out[index] = encoded[field]
+        return b''.join(out)
+
+    def _flush_static(self, pending):
+        text = ''.join(literal for _, literal in pending)
+        if not text:
+            return
+        if self._segments and isinstance(self._segments[-1], bytes):
+            self._segments[-1] += text.encode()
+        else:
+            self._segments.append(text.encode())
+
+    def _close_run(self, run):
+        self._tier_slots.append((len(self._segments), len(self._tier_slots)))
+        self._segments.append(None)
+        return run
+
+    @staticmethod
+    def _render_run(run, values):
+        return ''.join(literal if field is None else str(values[field]) for field, literal in run).encode()
@@ -1,3 +1,1097 @@
-from django.test import TestCase
+import io
+import os
+import atexit
+import json
+import time
+import zlib
+import gzip
+import asyncio
+import shutil
+import tempfile
+import subprocess
+import socketserver
+import threading
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import pymemcache
+except ImportError:
+    pymemcache = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# views builds its shared cache, rate limiter and metrics at import, so the
+# suite never touches the server's own state files
+STATE_DIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, STATE_DIR, True)
+override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'badges': {'BACKEND': 'api.sharedcache.SQLiteCache', 'LOCATION': os.path.join(STATE_DIR, 'cache.sqlite3')},
+    },
+    SOLVEDAC_COOKIE_FILE=os.path.join(STATE_DIR, 'clearance.json'),
+    SOLVEDAC_RATE_LIMIT_FILE=os.path.join(STATE_DIR, 'ratelimit'),
+    BADGE_METRICS_DIR=os.path.join(STATE_DIR, 'metrics'),
+).enable()
+
+from . import views
+from .assets import decode_data_uri, png_chunks
+from .batching import LookupBatcher
+from .breaker import CircuitBreaker, CircuitOpenError
+from .cache import PROFILE_FIELDS, ProfileCache, RenderCache, RenderedBadge
+from .compression import negotiate
+from .freshness import CachePolicy, ChangeHistory
+from .metrics import Registry
+from .minify import minify_svg
+from .prefetch import HeavyHitters, PrefetchScheduler
+from .raster import Rasterizer, static_frame
+from .ratelimit import BACKGROUND, RateLimitedError, TokenBucket
+from .sharedcache import BadgeStore, ProfileStore, SQLiteCache
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .svg import SvgTemplate
+from .upstream import ChallengeError, UpstreamClient, UpstreamStatusError
+from . import tiers
+from .utils import calculate_percentage
+
+
+def handle_sets():
+    for tier in views.TIERS + ('Unknown',):
+        title, _, rank = tier.partition(' ')
+        yield SimpleNamespace(
+            tier_title=title, tier_rank=rank, solved='1,234', boj_class='7',
+            boj_class_decoration='++', rate='2,345', now_rate='2,345', needed_rate='2,400',
+            percentage=45, bar_size=149.75)
+
+
+class BenchmarkSuiteTests(SimpleTestCase):
+    def test_every_case_runs_and_regressions_are_flagged(self):
+        from benchmarks import suite
+
+        with self.assertLogs('testlogger'):
+            results = suite.run(number=2, warmup=0)
+        self.assertEqual(len(results), 4 * len(suite.VARIANTS))
+        self.assertTrue(all(result['ops_per_sec'] > 0 for result in results.values()))
+
+        baseline = {'render/v1': dict(results['render/v1'], ops_per_sec=results['render/v1']['ops_per_sec'] * 2)}
+        self.assertEqual([name for name, _, _ in suite.compare(baseline, results, 0.1)], ['render/v1'])
+
+
+class SvgTemplateTests(SimpleTestCase):
+    def test_matches_str_format(self):
+        template = SvgTemplate('<a x="{{x}}">{c1}-{c2} {name}</a>{c1}{{}}', ('c1', 'c2'), {
+            'Gold': {'c1': '#fff', 'c2': '#000'},
+        })
+        self.assertEqual(
+            template.render('Gold', name='한글'),
+            '<a x="{{x}}">{c1}-{c2} {name}</a>{c1}{{}}'.format(c1='#fff', c2='#000', name='한글').encode())
+
+    def test_rejects_format_spec(self):
+        with self.assertRaises(ValueError):
+            SvgTemplate('{rate:n}', (), {})
+
+    def test_badges_are_byte_identical_to_str_format(self):
+        url_set = SimpleNamespace(boj_name='ccoco')
+        for handle_set in handle_sets():
+            fields = dict(
+                boj_handle=url_set.boj_name, tier_rank=handle_set.tier_rank,
+                tier_title=handle_set.tier_title, solved=handle_set.solved,
+                boj_class=handle_set.boj_class, boj_class_decoration=handle_set.boj_class_decoration,
+                rate=handle_set.rate, now_rate=handle_set.now_rate, needed_rate=handle_set.needed_rate,
+                percentage=handle_set.percentage, bar_size=handle_set.bar_size)
+            colors = dict(zip(('color1', 'color2', 'color3'), views.BACKGROUND_COLOR[handle_set.tier_title]))
+            pastel = dict(zip(('color1', 'color2'), views.BACKGROUND_COLOR_PASTEL[handle_set.tier_title]))
+            v2_rank = 'M' if handle_set.tier_title == 'Master' else handle_set.tier_rank
+
+            self.assertEqual(
+                views.render_badge(url_set, handle_set),
+                minify_svg(views.BADGE_V1_SVG).format(**fields, **colors).encode())
+            self.assertEqual(
+                views.render_badge_v2_inline(url_set, handle_set),
+                minify_svg(views.BADGE_V2_SVG).format(**dict(fields, tier_rank=v2_rank), **colors,
+                                          tier_img_link=views.TIER_IMG_LINK[handle_set.tier_title]).encode())
+            self.assertEqual(
+                views.render_badge_v2(url_set, handle_set),
+                minify_svg(views.BADGE_V2_SVG).format(**dict(fields, tier_rank=v2_rank), **colors, tier_img_link=(
+                    views.TIER_ASSET_URL + views.TIER_ASSETS[handle_set.tier_title].name)).encode())
+            self.assertEqual(
+                views.render_badge_mini(url_set, handle_set),
+                minify_svg(views.BADGE_MINI_SVG).format(**dict(fields, tier_title=handle_set.tier_title[0]), **colors).encode())
+            self.assertEqual(
+                views.render_badge_pastel(url_set, handle_set),
+                minify_svg(views.BADGE_PASTEL_SVG).format(**fields, **pastel).encode())
+
+    # the largest body of each variant, minified; raise one only with a reason
+    BYTE_BUDGETS = {'v1': 2450, 'v2': 5150, 'v2_inline': 14200, 'mini': 1350, 'pastel': 2450}
+
+    def test_badges_stay_within_byte_budgets(self):
+        for variant, spec in views.BADGE_VARIANTS.items():
+            url_set = SimpleNamespace(boj_name='w' * spec.max_len)
+            largest = max(len(spec.render(url_set, SimpleNamespace(
+                **dict(vars(handle_set), solved='99,999', boj_class='10', rate='3,999', now_rate='3,999',
+                needed_rate='4,000', percentage=100, bar_size=290.0)))) for handle_set in handle_sets())
+            self.assertLessEqual(largest, self.BYTE_BUDGETS[variant], variant)
+
+    def test_minify_keeps_fields_and_referenced_ids(self):
+        svg = minify_svg('''<!DOCTYPE svg>
+            <svg version="1.1" xmlns:xlink="http://www.w3.org/1999/xlink">
+                <!-- gradient -->
+                <defs><linearGradient id="grad"><stop offset="0%" stop-color="{color1}"></stop></linearGradient></defs>
+                <style><![CDATA[
+                    .used {{ fill: url(#grad); animation: fade 1s; }}
+                    .unused {{ fill: red; }}
+                    @keyframes fade {{ from {{ opacity: 0; }} to {{ opacity: 1; }} }}
+                    @keyframes spin {{ to {{ opacity: 1; }} }}
+                ]]></style>
+                <text id="label" class="used" data-name="x">{name} {{</text>
+            </svg>''')
+        self.assertEqual(svg, (
+            '<svg><defs><linearGradient id="grad"><stop offset="0%" stop-color="{color1}"/></linearGradient></defs>'
+            '<style><![CDATA[@keyframes fade{{0%{{opacity:0}}to{{opacity:1}}}}.used{{fill:url(#grad);animation:fade 1s}}]]>'
+            '</style><text class="used">{name} {{</text></svg>'))
+
+
+def reference_progress(rating):
+    # BojDefaultSettings' if-chain and inline progress before api/tiers.py
+    def boj_rating_to_lv(rating):
+        if rating < 30: return 0
+        if rating < 150: return rating // 30
+        if rating < 200: return 5
+        if rating < 500: return (rating-200) // 100 + 6
+        if rating < 1400: return (rating-500) // 150 + 9
+        if rating < 1600: return 15
+        if rating < 1750: return 16
+        if rating < 1900: return 17
+        if rating < 2800: return (rating-1900) // 100 + 18
+        if rating < 3000: return (rating-2800) // 50 + 27
+        return 31
+
+    level = boj_rating_to_lv(rating)
+    if level == 31:
+        prev_rate = next_rate = tiers.TIER_RATES[level]
+        percentage = 100
+    else:
+        prev_rate, next_rate = tiers.TIER_RATES[level], tiers.TIER_RATES[level + 1]
+        percentage = round((rating - prev_rate) * 100 / (next_rate - prev_rate))
+    if tiers.TIERS[level] in ('Unrated', 'Master'):
+        title, rank = tiers.TIERS[level], ''
+    else:
+        title, rank = tiers.TIERS[level].split()
+    return tiers.Progress(level, title, rank, prev_rate, next_rate, percentage, 35 + 2.55 * percentage)
+
+
+class TierMathTests(SimpleTestCase):
+    RATINGS = range(0, 4001)
+
+    def test_matches_previous_computation_for_every_rating(self):
+        for rating in self.RATINGS:
+            self.assertEqual(tiers.progress(rating), reference_progress(rating), rating)
+
+    @skipUnless(numpy, 'numpy is not installed')
+    def test_arrays_match_scalar_path(self):
+        result = tiers.progress_arrays(numpy.arange(-10, 4001))
+        for i, rating in enumerate(range(-10, 4001)):
+            expected = tiers.progress(rating)
+            self.assertEqual(
+                tuple(result[field][i] for field in ('level', 'prev_rate', 'next_rate', 'percentage', 'bar_size')),
+                (expected.level, expected.prev_rate, expected.next_rate, expected.percentage, expected.bar_size))
+
+    def test_calculate_percentage_bounds(self):
+        self.assertEqual(calculate_percentage(10), 0)
+        self.assertEqual(calculate_percentage(9600 + (23040 - 9600) // 2), 50)
+        self.assertEqual(calculate_percentage(6147627385), 100)
+        self.assertEqual(calculate_percentage(10 ** 12), 100)
+
+
+class ProfileCacheTests(SimpleTestCase):
+    def test_freshness_follows_the_variant_ttl(self):
+        cache = ProfileCache()
+        cache.set('ccoco', {'rating': 1}, fetched_at=time.time() - 7200)
+        refreshed = threading.Event()
+        # two hours old: fresh for the daily mini badge, expired for the hourly ones
+        self.assertEqual(cache.get('ccoco', views.PROFILE_TTL['mini'], lambda: self.fail('fetched')), {'rating': 1})
+        self.assertEqual(cache.get('CCoco', views.PROFILE_TTL['v1'], lambda: refreshed.set() or {'rating': 2}),
+                         {'rating': 1})
+        self.assertTrue(refreshed.wait(5))
+        self.assertEqual((cache.hits, cache.stale_hits, cache.misses), (1, 1, 0))
+
+    def test_stale_entries_are_served_only_within_max_stale(self):
+        cache = ProfileCache(max_stale=600)
+        cache.set('stale', {'rating': 1}, fetched_at=time.time() - 3600 - 300)
+        cache.set('expired', {'rating': 1}, fetched_at=time.time() - 3600 - 900)
+        self.assertEqual(cache.get('stale', 3600, self.fail, lambda: {'rating': 2}), {'rating': 1})
+        # past ttl + max_stale the request waits for the fetch
+        self.assertEqual(cache.get('expired', 3600, lambda: {'rating': 2}), {'rating': 2})
+        self.assertEqual((cache.stale_hits, cache.misses), (1, 1))
+
+    def test_one_background_refresh_per_handle(self):
+        cache = ProfileCache()
+        cache.set('ccoco', {'rating': 1}, fetched_at=time.time() - 7200)
+        release = threading.Event()
+        calls = []
+
+        def refresh():
+            calls.append(1)
+            release.wait(5)
+            return {'rating': 2}
+
+        for _ in range(5):
+            self.assertEqual(cache.get('ccoco', 3600, self.fail, refresh), {'rating': 1})
+        release.set()
+        for _ in range(500):
+            if cache.get('ccoco', 3600, self.fail, refresh) == {'rating': 2}:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('ccoco', 3600, self.fail), {'rating': 2})
+        self.assertEqual(len(calls), 1)
+
+
+class RenderCacheTests(SimpleTestCase):
+    def test_bounded_by_bytes(self):
+        cache = RenderCache(max_bytes=3 * (1000 + RenderedBadge.OVERHEAD))
+        for i in range(5):
+            cache.set(('v1', 'user{}'.format(i), None), RenderedBadge(b'x' * 1000, 'Unknown'))
+        self.assertEqual(len(cache), 3)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertIsNone(cache.get(('v1', 'user0', None)))
+        self.assertEqual(cache.get(('v1', 'user4', None)).body, b'x' * 1000)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class ConditionalResponseTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'})
+
+    def test_not_modified_without_rendering(self):
+        first = self.client.get('/api/v2/generate_badge', {'boj': 'ccoco'})
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', first)
+
+        views.render_cache.clear()
+        with mock.patch.object(views, 'BojDefaultSettings') as handle_set:
+            second = self.client.get('/api/v2/generate_badge', {'boj': 'ccoco'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        handle_set.assert_not_called()
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second['Cache-Control'], 'max-age=3600, s-maxage=3600, stale-while-revalidate=3600')
+
+    def test_etag_changes_with_profile(self):
+        first = self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+        views.profile_cache.set('ccoco', {'rating': 1300, 'solvedCount': 501, 'class': 5, 'classDecoration': 'gold'})
+        second = self.client.get('/api/generate_badge', {'boj': 'ccoco'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+
+class ServerTimingTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+
+    def test_phases_and_cache_markers(self):
+        resp = mock.Mock(status_code=200)
+        resp.json.return_value = {'handle': 'ccoco', 'rating': 1234, 'solvedCount': 500, 'class': 5,
+                                  'classDecoration': 'gold'}
+        with mock.patch.object(views, 'SERVER_TIMING', True), \
+                mock.patch.object(views, 'batcher', None), \
+                mock.patch.object(views.upstream, 'get', return_value=resp):
+            first = self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+            second = self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+        phases = [part.split(';')[0] for part in first['Server-Timing'].split(', ')]
+        self.assertEqual(phases, ['profile', 'badge', 'upstream', 'parse', 'compute', 'render', 'compress', 'total'])
+        self.assertIn('profile;desc="miss";dur=', first['Server-Timing'])
+        self.assertIn('profile;desc="hit";dur=', second['Server-Timing'])
+        self.assertIn('badge;desc="hit"', second['Server-Timing'])
+
+    def test_off_by_default(self):
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'})
+        self.assertNotIn('Server-Timing', self.client.get('/api/generate_badge', {'boj': 'ccoco'}))
+
+
+class TierAssetTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+        views.profile_cache.set('ccoco', {'rating': 2500, 'solvedCount': 900, 'class': 6, 'classDecoration': 'none'})
+
+    def test_optimized_png_has_the_same_pixels(self):
+        for tier, uri in views.TIER_IMG_LINK.items():
+            original = decode_data_uri(uri)
+            optimized = views.TIER_ASSETS[tier].body
+            self.assertLessEqual(len(optimized), len(original))
+            pixels = [zlib.decompress(b''.join(body for kind, body in png_chunks(data) if kind == b'IDAT'))
+                      for data in (original, optimized)]
+            self.assertEqual(pixels[0], pixels[1])
+
+    def test_v2_links_the_immutable_tier_image(self):
+        badge = self.client.get('/api/v2/generate_badge', {'boj': 'ccoco', 'inline': '0'})
+        url = '/api/tier/' + views.TIER_ASSETS['Diamond'].name
+        self.assertIn(b'"http://mazassumnida.wtf' + url.encode(), badge.content)
+        self.assertNotIn(b'data:image/png', badge.content)
+
+        image = self.client.get(url)
+        self.assertEqual(image['Content-Type'], 'image/png')
+        self.assertIn('immutable', image['Cache-Control'])
+        self.assertEqual(image.content, views.TIER_ASSETS['Diamond'].body)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=image['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/api/tier/diamond.0000.png').status_code, 404)
+
+    def test_inline_by_default(self):
+        # existing embeds, shown through <img>, can't load the linked image
+        inline = self.client.get('/api/v2/generate_badge', {'boj': 'ccoco'})
+        linked = self.client.get('/api/v2/generate_badge', {'boj': 'ccoco', 'inline': '0'})
+        self.assertIn(views.TIER_IMG_LINK['Diamond'].encode(), inline.content)
+        self.assertEqual(inline.content, self.client.get('/api/v2/generate_badge',
+                                                         {'boj': 'ccoco', 'inline': '1'}).content)
+        self.assertNotEqual(inline['ETag'], linked['ETag'])
+
+
+class CompressionTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+        views.profile_cache.set('ccoco', {'rating': 2500, 'solvedCount': 900, 'class': 6, 'classDecoration': 'none'})
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, deflate', {'gzip': b'', 'br': b''}), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0, identity', {'gzip': b''}), None)
+        self.assertEqual(negotiate('*', {'gzip': b''}), 'gzip')
+        self.assertEqual(negotiate(None, {'gzip': b''}), None)
+
+    def test_gzip_response_is_precompressed_once(self):
+        plain = self.client.get('/api/v2/generate_badge', {'boj': 'ccoco'})
+        self.assertNotIn('Content-Encoding', plain)
+        with mock.patch.object(views, 'compress') as compress:
+            encoded = self.client.get('/api/v2/generate_badge', {'boj': 'ccoco'}, HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(encoded['Content-Encoding'], 'gzip')
+        self.assertEqual(encoded['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(encoded.content), plain.content)
+        self.assertNotEqual(encoded['ETag'], plain['ETag'])
+
+
+@skipUnless(httpx, 'httpx is not installed')
+class AsyncViewTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+
+    def test_same_badge_as_sync_view(self):
+        from . import async_views
+
+        views.profile_cache.set('ccoco', {'rating': 2950, 'solvedCount': 4321, 'class': 9, 'classDecoration': 'silver'})
+        request = RequestFactory().get('/api/pastel/generate_badge', {'boj': 'ccoco'})
+        response = async_to_sync(async_views.generate_badge_pastel)(request)
+        self.assertEqual(response.content, views.generate_badge_pastel(request).content)
+
+    def test_upstream_failure_renders_unknown(self):
+        from . import async_views
+
+        request = RequestFactory().get('/api/generate_badge', {'boj': 'nobody'})
+        with mock.patch.object(async_views.async_upstream, 'get', side_effect=httpx.ConnectError('down')):
+            response = async_to_sync(async_views.generate_badge)(request)
+        self.assertIn(b'>Unknown<', response.content)
+
+    def test_shared_cache_and_compression_run_off_the_event_loop(self):
+        from . import async_views
+
+        on_loop = []
+
+        def recorded(function):
+            def call(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                    on_loop.append(function.__name__)
+                except RuntimeError:
+                    pass
+                return function(*args, **kwargs)
+            return call
+
+        async def fetch(handle, timing=None, priority=None):
+            return {'handle': handle, 'rating': 2950, 'solvedCount': 4321, 'class': 9, 'classDecoration': 'none'}
+
+        request = RequestFactory().get('/api/generate_badge', {'boj': 'ccoco'}, HTTP_ACCEPT_ENCODING='br, gzip')
+        store = views.profile_cache.store
+        with mock.patch.object(async_views, 'fetch_profile', fetch), \
+                mock.patch.object(store, 'get', recorded(store.get)), \
+                mock.patch.object(store, 'set', recorded(store.set)), \
+                mock.patch.object(views.render_cache, 'get', recorded(views.render_cache.get)), \
+                mock.patch.object(views.render_cache, 'set', recorded(views.render_cache.set)), \
+                mock.patch.object(views, 'compress', recorded(views.compress)):
+            response = async_to_sync(async_views.generate_badge)(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(on_loop, [])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_threads_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return {'rating': 100}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('ccoco', fetch))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while flight.collapsed < 7:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'rating': 100}] * 8)
+        self.assertEqual((flight.calls, flight.collapsed), (1, 7))
+
+    def test_waiters_share_the_failure(self):
+        flight = AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError('upstream down')
+
+        async def run():
+            return await asyncio.gather(*(flight.do('ccoco', fetch) for _ in range(5)), return_exceptions=True)
+
+        results = async_to_sync(run)()
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual((flight.calls, flight.collapsed), (1, 4))
+
+
+class LookupBatcherTests(SimpleTestCase):
+    def test_one_request_per_batch(self):
+        lookups = []
+
+        def lookup(handles):
+            lookups.append(sorted(handles))
+            return {handle: {'handle': handle} for handle in handles if handle != 'ghost'}
+
+        batcher = LookupBatcher(lookup, window=0.05, max_batch=10)
+        futures = [batcher.submit(handle) for handle in ('ccoco', 'Koosaga', 'ghost', 'CCoco')]
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual(lookups, [['ccoco', 'ghost', 'koosaga']])
+        self.assertEqual(results, [{'handle': 'ccoco'}, {'handle': 'koosaga'}, None, {'handle': 'ccoco'}])
+
+    def test_failed_or_single_batches_fall_back(self):
+        def lookup(handles):
+            raise ValueError('lookup unavailable')
+
+        batcher = LookupBatcher(lookup, window=0.01, max_batch=2)
+        self.assertEqual([f.result(timeout=5) for f in (batcher.submit('a'), batcher.submit('b'))], [None, None])
+        self.assertIsNone(batcher.submit('c').result(timeout=5))
+        self.assertEqual(batcher.batches, 0)
+
+
+class PrefetchTests(SimpleTestCase):
+    def test_heavy_hitters_keep_the_most_requested(self):
+        hitters = HeavyHitters(k=3)
+        for i in range(200):
+            hitters.record('user{}'.format(i), 3600)
+            for hot in ('ccoco', 'Koosaga', 'malkoring'):
+                hitters.record(hot, 3600 if hot != 'malkoring' else 86400)
+        top = hitters.top()
+        self.assertEqual({handle for handle, _, _ in top}, {'ccoco', 'koosaga', 'malkoring'})
+        self.assertEqual(dict((handle, ttl) for handle, _, ttl in top)['malkoring'], 86400)
+
+    def test_refreshes_only_handles_about_to_expire(self):
+        cache = ProfileCache()
+        hitters = HeavyHitters(k=10)
+        for handle in ('fresh', 'expiring', 'missing'):
+            hitters.record(handle, 3600)
+        cache.set('fresh', {}, fetched_at=time.time())
+        cache.set('expiring', {}, fetched_at=time.time() - 3590)
+        loaded = []
+        scheduler = PrefetchScheduler(cache, hitters, lambda handle: loaded.append(handle) or {}, lead=60, rate=0)
+        self.assertEqual(sorted(scheduler.due()), ['expiring', 'missing'])
+        scheduler.run(once=True)
+        self.assertEqual(sorted(loaded), ['expiring', 'missing'])
+        self.assertEqual(scheduler.due(), [])
+
+    def test_failed_handles_back_off(self):
+        hitters = HeavyHitters(k=10)
+        hitters.record('nobody', 3600)
+        attempts = []
+
+        def loader(handle):
+            attempts.append(handle)
+            raise UpstreamStatusError(404, 'Not Found')
+
+        scheduler = PrefetchScheduler(ProfileCache(), hitters, loader, views.handle_failed, rate=0, backoff=60,
+                                      max_backoff=100)
+        now = time.time()
+        with self.assertLogs('testlogger', 'ERROR'):
+            scheduler.run(once=True)
+        self.assertEqual((attempts, scheduler.due()), (['nobody'], []))
+        with mock.patch('time.time', return_value=now + 61):
+            self.assertEqual(scheduler.due(), ['nobody'])
+            with self.assertLogs('testlogger', 'ERROR'):
+                scheduler.run(once=True)
+        # the second failure in a row doubles the wait, up to max_backoff
+        with mock.patch('time.time', return_value=now + 61 + 99):
+            self.assertEqual(scheduler.due(), [])
+        with mock.patch('time.time', return_value=now + 61 + 101):
+            self.assertEqual(scheduler.due(), ['nobody'])
+
+    def test_rate_limits_and_outages_do_not_back_off(self):
+        hitters = HeavyHitters(k=10)
+        hitters.record('ccoco', 3600)
+        errors = [RateLimitedError('shed'), CircuitOpenError('open'), UpstreamStatusError(503, 'down')]
+
+        def loader(handle):
+            raise errors.pop(0)
+
+        scheduler = PrefetchScheduler(ProfileCache(), hitters, loader, views.handle_failed, rate=0)
+        for _ in range(3):
+            with self.assertLogs('testlogger', 'INFO'):
+                scheduler.run(once=True)
+            self.assertEqual(scheduler.due(), ['ccoco'])
+        self.assertEqual((scheduler.failed, scheduler.skipped), (0, 3))
+
+
+class PngTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+        views.rasterizer.cache.clear()
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'})
+        self.addCleanup(views.profile_cache.clear)
+
+    def test_static_frame_ends_the_animations(self):
+        svg = views.render_badge(SimpleNamespace(boj_name='ccoco', boj_handle='ccoco'), views.BojDefaultSettings(
+            None, SimpleNamespace(boj_handle='ccoco'), views.profile_cache.last_known('ccoco')[1]))
+        frame = static_frame(svg)
+        self.assertTrue(frame.startswith(svg[:svg.rindex(b'</svg>')]))
+        self.assertIn(b'.item { opacity:1 }', frame)
+        self.assertIn(b'.rate-bar { stroke-dashoffset:35 }', frame)
+
+    @skipUnless(views.rasterizer.available, 'needs cairosvg or resvg-py')
+    def test_png_is_rasterized_once_and_falls_back_to_svg_when_full(self):
+        self.addCleanup(views.rasterizer.shutdown)
+        with mock.patch.object(views, 'PNG_TIMEOUT', 60):
+            first = self.client.get('/api/generate_badge', {'boj': 'ccoco', 'format': 'png'})
+        self.assertEqual(first['Content-Type'], 'image/png')
+        self.assertTrue(first.content.startswith(b'\x89PNG'))
+        with mock.patch.object(views.rasterizer, 'max_queue', 0):
+            # cached by SVG hash, so a full pool doesn't matter
+            self.assertEqual(self.client.get('/api/generate_badge', {'boj': 'ccoco', 'format': 'png'}).content,
+                             first.content)
+            svg = self.client.get('/api/mini/generate_badge', {'boj': 'ccoco', 'format': 'png'})
+        self.assertEqual(svg['Content-Type'], 'image/svg+xml')
+        self.assertEqual(svg['Cache-Control'], 'no-cache')
+
+    def test_shutdown_before_python_3_9(self):
+        rasterizer = Rasterizer(RenderCache())
+        rasterizer._pool, queued = mock.Mock(), mock.Mock()
+        rasterizer._pending = {('svg',): queued}
+        pool = rasterizer._pool
+        with mock.patch('api.raster.sys', SimpleNamespace(version_info=(3, 8, 10))):
+            rasterizer.shutdown()
+        queued.cancel.assert_called_once_with()
+        pool.shutdown.assert_called_once_with(wait=False)
+
+
+class PrerenderTests(SimpleTestCase):
+    def test_writes_the_view_badges_and_skips_unchanged_handles(self):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        fd, handles = tempfile.mkstemp()
+        self.addCleanup(os.remove, handles)
+        with os.fdopen(fd, 'w') as f:
+            f.write('CCoco\nmalkoring\nccoco\n')
+        views.profile_cache.clear()
+        self.addCleanup(views.profile_cache.clear)
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'})
+        views.profile_cache.set('malkoring', {'rating': 2800, 'solvedCount': 2000, 'class': 9,
+                                              'classDecoration': 'none'})
+        args = (handles, '--output', output, '--variant', 'v1', '--variant', 'mini', '--compress', '--processes', '1')
+        stdout = io.StringIO()
+        call_command('prerender_badges', *args, stdout=stdout)
+        self.assertIn('2 handles: rendered 2 (4 files)', stdout.getvalue())
+        with open(os.path.join(output, 'v1', 'ccoco.svg'), 'rb') as f:
+            self.assertEqual(f.read(), self.client.get('/api/generate_badge', {'boj': 'CCoco'}).content)
+        with open(os.path.join(output, 'mini', 'malkoring.svg.gz'), 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()),
+                             self.client.get('/api/mini/generate_badge', {'boj': 'malkoring'}).content)
+
+        views.profile_cache.set('malkoring', {'rating': 2900, 'solvedCount': 2001, 'class': 9,
+                                              'classDecoration': 'none'})
+        stdout = io.StringIO()
+        call_command('prerender_badges', *args, stdout=stdout)
+        self.assertIn('rendered 1 (2 files), unchanged 1', stdout.getvalue())
+
+        # an expired profile is fetched again, not served stale
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'},
+                                fetched_at=time.time() - 7200)
+        fetched = {'handle': 'ccoco', 'rating': 1500, 'solvedCount': 600, 'class': 5, 'classDecoration': 'gold'}
+        stdout = io.StringIO()
+        with mock.patch.object(views, 'fetch_profile', return_value=fetched) as fetch:
+            call_command('prerender_badges', *args, stdout=stdout)
+        fetch.assert_called_once_with('CCoco')
+        self.assertIn('rendered 1 (2 files), unchanged 1', stdout.getvalue())
+        self.assertEqual(views.profile_cache.last_known('ccoco')[1]['rating'], 1500)
+
+
+class CachePolicyTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+        self.addCleanup(views.profile_cache.clear)
+
+    def test_lifetime_follows_how_often_the_profile_changes(self):
+        history = ChangeHistory(views.profile_fingerprint)
+        policy = CachePolicy(history, prior=86400, min_age=300, max_age=86400, max_shared_age=7 * 86400)
+        now = time.time()
+        for i in range(84):
+            # a change every two hours for a week, plus the one-day prior: 8128s between changes
+            history.observe('active', {'rating': 1000 + i, 'solvedCount': 100 + i, 'class': 3,
+                                       'classDecoration': 'none'}, now - 7 * 86400 + i * 7200)
+        for day in range(30, -1, -1):
+            history.observe('Dormant', {'rating': 1000, 'solvedCount': 100, 'class': 3,
+                                        'classDecoration': 'none'}, now - day * 86400)
+
+        self.assertEqual(policy.cache_control(3600, 'unseen'),
+                         'max-age=3600, s-maxage=3600, stale-while-revalidate=3600')
+        self.assertEqual(policy.cache_control(3600, 'active'),
+                         'max-age=339, s-maxage=339, stale-while-revalidate=339')
+        # never below the profile TTL, within which the CDN would get the same profile back
+        self.assertEqual(policy.cache_control(3600, 'active', floor=3600),
+                         'max-age=3600, s-maxage=3600, stale-while-revalidate=3600')
+        self.assertEqual(history.get('dormant')[3], 0)
+        self.assertEqual(policy.cache_control(3600, 'dormant'),
+                         'max-age=86400, s-maxage=111600, stale-while-revalidate=86400')
+        self.assertEqual(policy.lifetime(86400, history.get('dormant')), 7 * 86400)
+
+    def test_badges_and_report_use_the_change_history(self):
+        profile = {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'}
+        views.profile_cache.set('ccoco', profile, fetched_at=time.time() - 30 * 86400)
+        views.profile_cache.set('ccoco', profile)
+        response = self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+        self.assertEqual(response['Cache-Control'], 'max-age=86400, s-maxage=111600, stale-while-revalidate=86400')
+        with mock.patch.object(views, 'ADAPTIVE_CACHE', False):
+            response = self.client.get('/api/mini/generate_badge', {'boj': 'ccoco'})
+        self.assertEqual(response['Cache-Control'], 'max-age=86400')
+
+        # past its TTL, the profile being refreshed gets the short lifetime
+        views.profile_cache.set('ccoco', profile, fetched_at=time.time() - 7200)
+        with mock.patch.object(views, 'refresh_profile', return_value=profile):
+            response = self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+            for _ in range(500):
+                if time.time() - views.profile_cache.fetched_at('ccoco') < 60:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(response['Cache-Control'], views.STALE_CACHE_CONTROL)
+        self.assertNotIn('Warning', response)
+        self.assertEqual(views.profile_cache.get('ccoco', 86400, self.fail), profile)
+
+        log = io.StringIO(''.join(
+            '1.2.3.4 - - "GET /api/generate_badge?boj={} HTTP/1.1" 200\n'.format(handle)
+            for handle in ['ccoco'] * 500 + ['newbie'] * 10))
+        stdout = io.StringIO()
+        with mock.patch('sys.stdin', log):
+            call_command('cache_policy_report', stdout=stdout, stderr=io.StringIO())
+        self.assertIn('origin requests per 86400s: 30 -> 8 (-73.9%)', stdout.getvalue())
+
+
+class MetricsTests(SimpleTestCase):
+    def test_workers_add_up_and_exited_workers_keep_only_counters(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        registry = Registry(tmp.name)
+        responses = registry.counter('responses_total', 'Responses.', ('status',))
+        in_flight = registry.gauge('in_flight', 'In flight.')
+        latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+        responses.labels('200').inc(3)
+        in_flight.labels().inc()
+        latency.labels().observe(0.05)
+        latency.labels().observe(0.5)
+
+        # a worker of the same server that has exited since its last flush
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        with open(os.path.join(tmp.name, 'metrics-{}.json'.format(exited.pid)), 'w') as f:
+            json.dump({'pid': exited.pid, 'ppid': os.getppid(), 'metrics': registry.snapshot()}, f)
+
+        text = registry.exposition()
+        self.assertIn('responses_total{status="200"} 6\n', text)
+        self.assertIn('in_flight 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 4\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('latency_seconds_count 4\n', text)
+
+    def test_exited_workers_are_folded_into_one_file(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        registry = Registry(tmp.name)
+        responses = registry.counter('responses_total', 'Responses.', ('status',))
+        in_flight = registry.gauge('in_flight', 'In flight.')
+        responses.labels('200').inc(3)
+        in_flight.labels().inc()
+
+        for total in (6, 9):
+            exited = subprocess.Popen(['true'])
+            exited.wait()
+            with open(os.path.join(tmp.name, 'metrics-{}.json'.format(exited.pid)), 'w') as f:
+                json.dump({'pid': exited.pid, 'ppid': os.getppid(), 'metrics': registry.snapshot()}, f)
+            self.assertIn('responses_total{{status="200"}} {}\n'.format(total), registry.exposition())
+        self.assertEqual(sorted(os.listdir(tmp.name)),
+                         ['exited-{}.json'.format(os.getppid()), 'metrics-{}.json'.format(os.getpid())])
+        text = registry.exposition()
+        self.assertIn('responses_total{status="200"} 9\n', text)
+        self.assertIn('in_flight 1\n', text)
+
+    def test_badge_requests_are_counted(self):
+        views.profile_cache.set('ccoco', {'rating': 2950, 'solvedCount': 4321, 'class': 9, 'classDecoration': 'silver'})
+        with self.assertLogs('testlogger'):
+            self.client.get('/api/mini/generate_badge', {'boj': 'ccoco'})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'badge_requests_in_flight{variant="mini"} 0\n', response.content)
+        self.assertIn(b'badge_cache_requests_total{cache="profile",result="hit"}', response.content)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold_and_lets_one_trial_through(self):
+        breaker = CircuitBreaker(threshold=3, cooldown=60)
+        for _ in range(3):
+            breaker.check()
+            breaker.failure()
+        with self.assertRaises(CircuitOpenError):
+            breaker.check()
+        self.assertEqual(breaker.short_circuited, 1)
+
+        breaker.cooldown = 0
+        breaker.check()
+        # only one trial while it is out
+        with self.assertRaises(CircuitOpenError):
+            breaker.check()
+        breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.check()
+
+    def test_failed_trial_opens_again(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=0)
+        breaker.failure()
+        breaker.check()
+        breaker.failure()
+        breaker.cooldown = 60
+        self.assertEqual(breaker.state, 'open')
+
+
+class LastKnownGoodTests(SimpleTestCase):
+    def setUp(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+        views.breaker.success()
+        self.addCleanup(views.breaker.success)
+
+    def test_outage_serves_the_last_known_badge_marked_stale(self):
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'},
+                                fetched_at=time.time() - 10 * 86400)
+        fresh = views.render_badge(SimpleNamespace(boj_name='ccoco', boj_handle='ccoco'), views.BojDefaultSettings(
+            None, SimpleNamespace(boj_handle='ccoco'), views.profile_cache.last_known('ccoco')[1]))
+        failing = mock.Mock(status_code=503, text='Service Unavailable')
+        with mock.patch.object(views, 'batcher', None), \
+                mock.patch.object(views.upstream, 'get', return_value=failing) as get, \
+                self.assertLogs('testlogger', 'ERROR'):
+            responses = [self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+                         for _ in range(views.breaker.threshold + 2)]
+        # the breaker stopped calling solved.ac
+        self.assertEqual(get.call_count, views.breaker.threshold)
+        for response in responses:
+            self.assertEqual(response.content, fresh)
+            self.assertEqual(response['Cache-Control'], 'max-age=60')
+            self.assertIn('Stale', response['Warning'])
+
+    def test_unknown_user_is_not_an_outage(self):
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'},
+                                fetched_at=time.time() - 10 * 86400)
+        missing = mock.Mock(status_code=404, text='Not Found')
+        with mock.patch.object(views, 'batcher', None), \
+                mock.patch.object(views.upstream, 'get', return_value=missing), \
+                self.assertLogs('testlogger', 'ERROR'):
+            response = self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+        self.assertIn(b'>Unknown<', response.content)
+        self.assertEqual(views.breaker.state, 'closed')
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_refreshes_give_way_to_badge_misses(self):
+        bucket = TokenBucket(rate=1, burst=3, budget=1.5, background_reserve=2)
+        self.assertEqual(bucket.reserve(BACKGROUND), 0)
+        with self.assertRaises(RateLimitedError):
+            bucket.reserve(BACKGROUND)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        # queued behind the previous ones, then over the budget
+        self.assertAlmostEqual(bucket.reserve(), 1, places=1)
+        with self.assertRaises(RateLimitedError):
+            bucket.reserve()
+        self.assertEqual(bucket.shed, {'interactive': 1, 'background': 1})
+
+    def test_workers_share_the_bucket(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        one, other = (TokenBucket(rate=1, burst=2, path=path, budget=0.5) for _ in range(2))
+        one.reserve()
+        other.reserve()
+        with self.assertRaises(RateLimitedError):
+            one.reserve()
+        # a 429 seen by one worker holds back the other
+        fresh = TokenBucket(rate=1, burst=2, path=path + '-2', budget=0.5)
+        self.addCleanup(os.remove, path + '-2')
+        fresh.pause(5)
+        with self.assertRaises(RateLimitedError):
+            TokenBucket(rate=1, burst=2, path=path + '-2', budget=0.5).reserve()
+
+    def test_shed_miss_serves_the_last_known_badge(self):
+        views.profile_cache.clear()
+        views.render_cache.clear()
+        views.profile_cache.set('ccoco', {'rating': 1234, 'solvedCount': 500, 'class': 5, 'classDecoration': 'gold'},
+                                fetched_at=time.time() - 10 * 86400)
+        self.addCleanup(views.profile_cache.clear)
+        with mock.patch.object(views, 'rate_limiter', TokenBucket(rate=1, burst=0, budget=0.5)), \
+                mock.patch.object(views.upstream, 'get') as get, \
+                self.assertLogs('testlogger', 'ERROR'):
+            response = self.client.get('/api/generate_badge', {'boj': 'ccoco'})
+        get.assert_not_called()
+        self.assertIn('Stale', response['Warning'])
+        self.assertNotIn(b'>Unknown<', response.content)
+
+    def test_shed_trial_call_does_not_wedge_the_breaker(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=0)
+        breaker.failure()
+        bucket = TokenBucket(rate=1, burst=2, budget=0.5)
+        bucket.pause(10)
+        with mock.patch.object(views, 'breaker', breaker), mock.patch.object(views, 'rate_limiter', bucket), \
+                mock.patch.object(views.upstream, 'get', return_value=mock.Mock(status_code=200)) as get:
+            # the half-open trial is shed by the paused bucket
+            with self.assertRaises(RateLimitedError):
+                views.upstream_get('https://solved.ac/api', 'show')
+            # the pause is over
+            bucket._state = (2, time.time())
+            views.upstream_get('https://solved.ac/api', 'show')
+        get.assert_called_once()
+        self.assertEqual(breaker.state, 'closed')
+
+
+class StubUpstreamTests(SimpleTestCase):
+    def setUp(self):
+        from benchmarks.stub_server import StubServer
+
+        self.StubServer = StubServer
+        self.client = UpstreamClient()
+        self.addCleanup(self.client.close)
+
+    def test_challenge_page_is_a_request_exception(self):
+        server = self.StubServer(challenges=1.0).start()
+        self.addCleanup(server.stop)
+        with self.assertRaises(ChallengeError):
+            self.client.get(server.api_server + '/v3/user/show?handle=ccoco')
+
+    def test_replays_recorded_responses_in_turn(self):
+        fd, recording = tempfile.mkstemp(suffix='.jsonl')
+        self.addCleanup(os.remove, recording)
+        with os.fdopen(fd, 'w') as f:
+            f.write('{"path": "/v3/user/show?handle=ccoco", "status": 200, '
+                    '"content_type": "application/json", "body": "{\\"rating\\": 1}"}\n')
+            f.write('{"path": "/v3/user/show?handle=ccoco", "status": 429, '
+                    '"content_type": "text/plain", "body": "slow down"}\n')
+        server = self.StubServer(replay=recording).start()
+        self.addCleanup(server.stop)
+        url = server.api_server + '/v3/user/show?handle=ccoco'
+        self.assertEqual(self.client.get(url).json(), {'rating': 1})
+        self.assertEqual(self.client.get(url).status_code, 429)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # paths that were never recorded get a fake profile
+        self.assertEqual(self.client.get(server.api_server + '/v3/user/show?handle=other').json()['handle'], 'other')
+
+    def test_one_pooled_connection_and_clearance_shared_between_workers(self):
+        from benchmarks.stub_server import StubHandler
+
+        server = self.StubServer().start()
+        self.addCleanup(server.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cookie_file = os.path.join(directory.name, 'clearance.json')
+        first, second = UpstreamClient(cookie_file), UpstreamClient(cookie_file)
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+        seen = []
+        do_get = StubHandler.do_GET
+
+        def recorded(handler):
+            seen.append((handler.client_address, handler.headers.get('User-Agent'), handler.headers.get('Cookie')))
+            do_get(handler)
+
+        url = server.api_server + '/v3/user/show?handle=ccoco'
+        with mock.patch.object(StubHandler, 'do_GET', recorded):
+            for _ in range(3):
+                self.assertEqual(first.get(url).status_code, 200)
+            # another worker starts with the clearance the first one earned
+            self.assertEqual(second.get(url).status_code, 200)
+        self.assertEqual(len({address for address, _, _ in seen[:3]}), 1)
+        self.assertIsNone(seen[0][2])
+        self.assertEqual(seen[3][1:], (seen[0][1], 'cf_clearance=stub'))
+
+
+class FakeMemcachedHandler(socketserver.StreamRequestHandler):
+    # just enough of the memcached text protocol for Django's PyMemcacheCache
+    def handle(self):
+        data = self.server.data
+        for line in self.rfile:
+            command, *args = line.split()
+            noreply = args[-1:] == [b'noreply']
+            if command in (b'get', b'gets'):
+                reply = b''
+                for key in args:
+                    if key in data and (data[key][2] is None or data[key][2] > time.time()):
+                        flags, value, _ = data[key]
+                        reply += b'VALUE %s %s %d\r\n%s\r\n' % (key, flags, len(value), value)
+                reply += b'END'
+            elif command in (b'set', b'add'):
+                key, flags, exptime, size = args[:4]
+                value = self.rfile.read(int(size) + 2)[:-2]
+                if command == b'add' and key in data:
+                    reply = b'NOT_STORED'
+                else:
+                    data[key] = (flags, value, time.time() + int(exptime) if int(exptime) else None)
+                    reply = b'STORED'
+            elif command == b'delete':
+                reply = b'DELETED' if data.pop(args[0], None) else b'NOT_FOUND'
+            elif command == b'flush_all':
+                data.clear()
+                reply = b'OK'
+            else:
+                reply = b'ERROR'
+            if not noreply:
+                self.wfile.write(reply + b'\r\n')
+
+
+class FakeMemcached(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeMemcachedHandler)
+        self.data = {}
+
+
+class SharedCacheTests(object):
+    """Two workers' caches over one shared Django cache; subclasses pick the backend."""
+
+    def backend(self):
+        raise NotImplementedError
+
+    def test_profile_fetched_by_one_worker_is_fresh_for_another(self):
+        first = ProfileCache(store=ProfileStore(self.backend()))
+        second = ProfileCache(store=ProfileStore(self.backend()))
+        profile = {'handle': 'ccoco', 'rating': 1234, 'solvedCount': 500, 'class': 5,
+                   'classDecoration': 'gold', 'bio': 'dropped'}
+        self.assertEqual(first.get('ccoco', 3600, lambda: profile)['rating'], 1234)
+        cached = second.get('CCoco', 3600, lambda: self.fail('fetched twice'))
+        self.assertEqual(cached, {field: profile[field] for field in PROFILE_FIELDS})
+
+    def test_newer_shared_entry_replaces_expired_local_one(self):
+        first = ProfileCache(store=ProfileStore(self.backend()))
+        second = ProfileCache(store=ProfileStore(self.backend()))
+        second.set('ccoco', {'rating': 1}, fetched_at=time.time() - 7200)
+        first.set('ccoco', {'rating': 2})
+        self.assertEqual(second.get('ccoco', 3600, lambda: self.fail('fetched')), {'rating': 2})
+
+    def test_template_version_bump_drops_badges_but_keeps_profiles(self):
+        key = ('v1', 'ccoco', (1234, 500, 5, 'gold'))
+        badge = RenderedBadge(b'<svg/>', 'Gold 1', {'gzip': b'gz'})
+        RenderCache(store=BadgeStore(self.backend(), 'abc')).set(key, badge)
+        ProfileCache(store=ProfileStore(self.backend())).set('ccoco', {'rating': 1234})
+
+        shared = RenderCache(store=BadgeStore(self.backend(), 'abc')).get(key)
+        self.assertEqual((shared.body, shared.tier_title, shared.encoded, shared.created_at),
+                         (badge.body, badge.tier_title, badge.encoded, badge.created_at))
+        self.assertIsNone(RenderCache(store=BadgeStore(self.backend(), 'abc', version=2)).get(key))
+        self.assertIsNone(RenderCache(store=BadgeStore(self.backend(), 'edited')).get(key))
+        profiles = ProfileCache(store=ProfileStore(self.backend()))
+        self.assertEqual(profiles.get('ccoco', 3600, lambda: self.fail('fetched')), {'rating': 1234})
+
+    def test_clearing_profiles_keeps_badges_and_other_entries(self):
+        key = ('v1', 'ccoco', (1234, 500, 5, 'gold'))
+        backend = self.backend()
+        backend.set('unrelated', 'kept')
+        RenderCache(store=BadgeStore(self.backend(), 'abc')).set(key, RenderedBadge(b'<svg/>', 'Gold 1', {}))
+        ProfileCache(store=ProfileStore(self.backend())).set('ccoco', {'rating': 1234})
+
+        ProfileCache(store=ProfileStore(self.backend())).clear()
+        self.assertIsNone(ProfileStore(self.backend()).get('ccoco'))
+        self.assertEqual(RenderCache(store=BadgeStore(self.backend(), 'abc')).get(key).body, b'<svg/>')
+        self.assertEqual(self.backend().get('unrelated'), 'kept')
+        ProfileCache(store=ProfileStore(self.backend())).set('ccoco', {'rating': 1})
+        self.assertEqual(ProfileStore(self.backend()).get('ccoco')[1], {'rating': 1})
+
+
+class SQLiteSharedCacheTests(SharedCacheTests, SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+
+    def backend(self):
+        return SQLiteCache(self.path, {})
+
+    def test_file_others_can_write_is_not_opened(self):
+        self.backend().set('ccoco', 1)
+        os.chmod(os.path.dirname(self.path), 0o777)
+        self.addCleanup(os.chmod, os.path.dirname(self.path), 0o700)
+        backend = self.backend()
+        with self.assertLogs('testlogger', 'ERROR') as logs:
+            self.assertIsNone(backend.get('ccoco'))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('writable by other users', logs.output[0])
+        # no second check, connection or log line for the rest of the process
+        with mock.patch('sqlite3.connect') as connect, mock.patch.object(os, 'stat') as stat:
+            backend.set('ccoco', 2)
+            self.assertIsNone(backend.get('ccoco'))
+        connect.assert_not_called()
+        stat.assert_not_called()
+
+
+class LocMemSharedCacheTests(SharedCacheTests, SimpleTestCase):
+    def setUp(self):
+        self.location = self.id()
+
+    def backend(self):
+        return LocMemCache(self.location, {})
+
+
+@skipUnless(pymemcache, 'pymemcache is not installed')
+class MemcachedSharedCacheTests(SharedCacheTests, SimpleTestCase):
+    def setUp(self):
+        server = FakeMemcached()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.location = '127.0.0.1:{}'.format(server.server_address[1])
+
+    def backend(self):
+        from django.core.cache.backends.memcached import PyMemcacheCache
+
+        return PyMemcacheCache(self.location, {})
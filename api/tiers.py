@@ -0,0 +1,98 @@
+from bisect import bisect_right
+from collections import namedtuple
+
+TIERS = (
+    "Unrated",
+    "Bronze 5", "Bronze 4", "Bronze 3", "Bronze 2", "Bronze 1",
+    "Silver 5", "Silver 4", "Silver 3", "Silver 2", "Silver 1",
+    "Gold 5", "Gold 4", "Gold 3", "Gold 2", "Gold 1",
+    "Platinum 5", "Platinum 4", "Platinum 3", "Platinum 2", "Platinum 1",
+    "Diamond 5", "Diamond 4", "Diamond 3", "Diamond 2", "Diamond 1",
+    "Ruby 5", "Ruby 4", "Ruby 3", "Ruby 2", "Ruby 1",
+    "Master"
+)
+
+# lowest rating of each level in TIERS
+TIER_RATES = (
+    0, # unranked
+    30, 60, 90, 120, 150, # bronze
+    200, 300, 400, 500, 650, # silver
+    800, 950, 1100, 1250, 1400, # gold
+    1600, 1750, 1900, 2000, 2100, # platinum
+    2200, 2300, 2400, 2500, 2600, # diamond
+    2700, 2800, 2850, 2900, 2950, # ruby
+    3000 # master
+)
+
+MASTER = len(TIERS) - 1
+
+# level of every rating below Master, so the per-badge lookup is one index
+_LEVELS = tuple(bisect_right(TIER_RATES, rating) - 1 for rating in range(TIER_RATES[MASTER]))
+
+Progress = namedtuple('Progress', 'level tier_title tier_rank prev_rate next_rate percentage bar_size')
+
+
+def level(rating):
+    """Index into TIERS for a solved.ac rating."""
+    if rating >= TIER_RATES[MASTER]:
+        return MASTER
+    return _LEVELS[rating] if rating > 0 else 0
+
+
+def split_tier(level):
+    """('Gold', '3') for a level; ('Unrated', '') and ('Master', '') have no rank."""
+    title, _, rank = TIERS[level].partition(' ')
+    return title, rank
+
+
+def bar_size(percentage):
+    # x2 of the progress bar in the badges, from 35 (empty) to 290 (full)
+    return 35 + 2.55 * percentage
+
+
+def progress(rating):
+    """Tier and progress towards the next tier for one rating, as the badges draw them."""
+    lv = level(rating)
+    title, rank = split_tier(lv)
+    if lv == MASTER:
+        prev_rate = next_rate = TIER_RATES[lv]
+        percentage = 100
+    else:
+        prev_rate, next_rate = TIER_RATES[lv], TIER_RATES[lv + 1]
+        percentage = round((rating - prev_rate) * 100 / (next_rate - prev_rate))
+    return Progress(lv, title, rank, prev_rate, next_rate, percentage, bar_size(percentage))
+
+
+def levels(ratings):
+    """``level`` for an array of ratings at once; needs NumPy."""
+    import numpy as np
+
+    rates = np.asarray(TIER_RATES)
+    return np.maximum(np.searchsorted(rates, np.asarray(ratings), side='right') - 1, 0)
+
+
+def progress_arrays(ratings):
+    """``progress`` for an array of ratings at once, as a dict of NumPy arrays.
+
+    Keys are the numeric fields of ``Progress``; tier names are
+    ``np.asarray(TIERS)[result['level']]``. For bulk rendering and
+    analytics jobs, the views use the scalar ``progress``.
+    """
+    import numpy as np
+
+    ratings = np.asarray(ratings)
+    rates = np.asarray(TIER_RATES)
+    lv = levels(ratings)
+    master = lv == MASTER
+    prev_rate = rates[lv]
+    next_rate = np.where(master, prev_rate, rates[np.minimum(lv + 1, MASTER)])
+    span = np.where(master, 1, next_rate - prev_rate)
+    # same float division and round-half-even as the scalar path
+    percentage = np.where(master, 100, np.rint((ratings - prev_rate) * 100 / span)).astype(np.int64)
+    return {
+        'level': lv,
+        'prev_rate': prev_rate,
+        'next_rate': next_rate,
+        'percentage': percentage,
+        'bar_size': bar_size(percentage),
+    }
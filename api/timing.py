@@ -0,0 +1,39 @@
+import time
+
+
+class ServerTiming(object):
+    """Phases of one badge request, sent back as a ``Server-Timing`` header.
+
+    The views only create one when ``BADGE_SERVER_TIMING`` is on and check
+    for None everywhere else, so with it off a request pays for an attribute
+    lookup per phase. Phases measured twice add up. Once the header is built
+    the object is closed: a background refresh started by the request can't
+    change it afterwards.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.descriptions = {}
+        self.closed = False
+
+    def add(self, name, seconds):
+        if not self.closed:
+            self.durations[name] = self.durations.get(name, 0) + seconds
+
+    def describe(self, name, description):
+        if not self.closed:
+            self.descriptions[name] = description
+
+    def header(self):
+        self.add('total', time.perf_counter() - self.started)
+        self.closed = True
+        parts = []
+        for name in dict.fromkeys(list(self.descriptions) + list(self.durations)):
+            part = name
+            if name in self.descriptions:
+                part += ';desc="{}"'.format(self.descriptions[name])
+            if name in self.durations:
+                part += ';dur={:.3f}'.format(self.durations[name] * 1e3)
+            parts.append(part)
+        return ', '.join(parts)
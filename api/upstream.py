@@ -0,0 +1,210 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+import threading
+from json import JSONDecodeError
+
+import cloudscraper
+import requests
+from asgiref.sync import sync_to_async
+from cloudscraper import CipherSuiteAdapter
+from cloudscraper.exceptions import CloudflareException
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('testlogger')
+
+# cookies Cloudflare hands out once a challenge is solved
+CLEARANCE_COOKIES = ('cf_clearance', '__cf_bm', '__cfduid')
+
+
+class ChallengeError(requests.RequestException):
+    """Cloudflare served a challenge cloudscraper could not solve."""
+
+
+class UpstreamStatusError(JSONDecodeError):
+    """solved.ac answered with something other than 200 and a profile."""
+
+    def __init__(self, status, body):
+        super().__init__('Non-200 response', body, 0)
+        self.status = status
+
+
+def read_clearance(cookie_file, seen_mtime=None):
+    """(state, mtime) of the shared clearance file; state is None if it is missing or unchanged."""
+    if not cookie_file:
+        return None, seen_mtime
+    try:
+        mtime = os.stat(cookie_file).st_mtime
+    except OSError:
+        return None, seen_mtime
+    if mtime == seen_mtime:
+        return None, seen_mtime
+    try:
+        with open(cookie_file) as f:
+            return json.load(f), mtime
+    except (OSError, ValueError) as e:
+        logger.error('could not read clearance cookies: {}'.format(e))
+        return None, seen_mtime
+
+
+class UpstreamClient(object):
+    """Long-lived cloudscraper session shared by every thread of a worker.
+
+    The session keeps one keep-alive connection pool for solved.ac, and every
+    request carries explicit (connect, read) timeouts. Cloudflare clearance
+    cookies are tied to the User-Agent that solved the challenge, so both are
+    written to ``cookie_file`` and picked up by the other gunicorn workers
+    (and by this one after a restart) instead of solving the challenge again.
+    """
+
+    def __init__(self, cookie_file=None, connect_timeout=3.05, read_timeout=10,
+                 pool_size=10):
+        self.cookie_file = cookie_file
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._scraper = None
+        self._cookie_mtime = None
+        self._saved_clearance = {}
+
+    def get(self, url):
+        scraper = self.scraper
+        self._load_clearance(scraper)
+        try:
+            resp = scraper.get(url, timeout=self.timeout)
+        except CloudflareException as e:
+            # cloudscraper's errors aren't RequestExceptions; the views only expect those
+            raise ChallengeError(str(e)) from e
+        self._save_clearance(scraper)
+        return resp
+
+    @property
+    def scraper(self):
+        if self._scraper is None:
+            with self._lock:
+                if self._scraper is None:
+                    self._scraper = self._create_scraper()
+        return self._scraper
+
+    def close(self):
+        with self._lock:
+            if self._scraper is not None:
+                self._scraper.close()
+                self._scraper = None
+
+    def _create_scraper(self):
+        scraper = cloudscraper.create_scraper()
+        # same TLS fingerprint as cloudscraper's own adapter, with a bigger pool;
+        # its SSL context is reused, loading the CA store again costs ~35 ms
+        scraper.mount('https://', CipherSuiteAdapter(
+            cipherSuite=scraper.cipherSuite,
+            ecdhCurve=scraper.ecdhCurve,
+            server_hostname=scraper.server_hostname,
+            source_address=scraper.source_address,
+            ssl_context=scraper.adapters['https://'].ssl_context,
+            pool_connections=1,
+            pool_maxsize=self.pool_size))
+        scraper.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+        return scraper
+
+    def _load_clearance(self, scraper):
+        with self._lock:
+            state, self._cookie_mtime = read_clearance(self.cookie_file, self._cookie_mtime)
+            if state is None:
+                return
+            if state.get('user_agent'):
+                scraper.headers['User-Agent'] = state['user_agent']
+            for cookie in state.get('cookies', []):
+                scraper.cookies.set(cookie['name'], cookie['value'],
+                                    domain=cookie['domain'], path=cookie['path'])
+            self._saved_clearance = self._clearance(scraper)
+
+    def _save_clearance(self, scraper):
+        if not self.cookie_file:
+            return
+        clearance = self._clearance(scraper)
+        if not clearance or clearance == self._saved_clearance:
+            return
+        with self._lock:
+            state = {
+                'user_agent': scraper.headers.get('User-Agent'),
+                'cookies': [
+                    {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path}
+                    for c in scraper.cookies if c.name in CLEARANCE_COOKIES
+                ],
+            }
+            # write then rename so other workers never read a half-written file
+            directory = os.path.dirname(os.path.abspath(self.cookie_file))
+            try:
+                fd, tmp = tempfile.mkstemp(dir=directory, prefix='.clearance-')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.cookie_file)
+                self._cookie_mtime = os.stat(self.cookie_file).st_mtime
+            except OSError as e:
+                logger.error('could not write clearance cookies: {}'.format(e))
+                return
+            self._saved_clearance = clearance
+
+    @staticmethod
+    def _clearance(scraper):
+        return {(c.name, c.domain): c.value for c in scraper.cookies if c.name in CLEARANCE_COOKIES}
+
+
+class AsyncUpstreamClient(object):
+    """Non-blocking httpx client used by the async badge views.
+
+    It sends the clearance cookies and User-Agent the cloudscraper client left
+    in the shared cookie file. httpx can't solve a Cloudflare challenge, so a
+    challenge page is retried through ``fallback`` (an ``UpstreamClient``) in
+    a worker thread, and the clearance it earns is picked up on the next call.
+    The httpx client is bound to the event loop it was created on.
+    """
+
+    def __init__(self, fallback, cookie_file=None, connect_timeout=3.05, read_timeout=10,
+                 pool_size=100):
+        self.fallback = fallback
+        self.cookie_file = cookie_file
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self._client = None
+        self._loop = None
+        self._cookie_mtime = None
+
+    async def get(self, url):
+        client = self._client_for_running_loop()
+        self._load_clearance(client)
+        resp = await client.get(url)
+        if resp.status_code in (403, 503) and 'json' not in resp.headers.get('content-type', ''):
+            return await sync_to_async(self.fallback.get, thread_sensitive=False)(url)
+        return resp
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _client_for_running_loop(self):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size))
+            self._loop = loop
+            self._cookie_mtime = None
+        return self._client
+
+    def _load_clearance(self, client):
+        state, self._cookie_mtime = read_clearance(self.cookie_file, self._cookie_mtime)
+        if state is None:
+            return
+        if state.get('user_agent'):
+            client.headers['User-Agent'] = state['user_agent']
+        for cookie in state.get('cookies', []):
+            client.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
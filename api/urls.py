@@ -1,9 +1,16 @@
+from django.conf import settings
 from django.urls import path
-from .views import generate_badge, generate_badge_v2, generate_badge_mini, generate_badge_pastel
+
+if getattr(settings, 'BADGE_ASYNC_VIEWS', False):
+    from .async_views import generate_badge, generate_badge_v2, generate_badge_mini, generate_badge_pastel
+else:
+    from .views import generate_badge, generate_badge_v2, generate_badge_mini, generate_badge_pastel
+from .views import tier_image
 
 urlpatterns = [
     path('generate_badge', generate_badge),
     path('v2/generate_badge', generate_badge_v2),
     path('mini/generate_badge', generate_badge_mini),
-    path('pastel/generate_badge', generate_badge_pastel)
+    path('pastel/generate_badge', generate_badge_pastel),
+    path('tier/<str:name>', tier_image),
 ]
@@ -1,3 +1,6 @@
+from bisect import bisect_right
+
+
 def calculate_percentage(now_exp):
     accumulate = (
         # 10, 9590, 23030, 42110, 69590,  # bronze
@@ -15,16 +18,10 @@ def calculate_percentage(now_exp):
         854562265, 1434637585, 2354056985, 3815933825, 6147627385  # ruby
     )
 
-    i = 0
-    try:
-        for exp in accumulate:  # 루비 1 예외처리하기
-            if now_exp - exp < 0:
-                temp = now_exp - accumulate[i - 1]
-                break
-            i += 1
-        need_exp = accumulate[i] - accumulate[i - 1]
-        now_percentage = int(temp / need_exp * 100)
-
-        return now_percentage
-    except:
+    # index of the first threshold above now_exp; past the last one is 100%
+    i = bisect_right(accumulate, now_exp)
+    if i == len(accumulate):
         return 100
+    temp = now_exp - accumulate[i - 1]
+    need_exp = accumulate[i] - accumulate[i - 1]
+    return int(temp / need_exp * 100)
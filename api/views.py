@@ -1,29 +1,39 @@
 import os
+import time
+import hashlib
 import requests
-import locale
 import logging
+from collections import namedtuple
+from concurrent.futures import Future
 from json import JSONDecodeError
-import cloudscraper
+from urllib.parse import quote, urljoin
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from .assets import tier_assets
+from .batching import LookupBatcher
+from .breaker import CircuitBreaker, upstream_failed
+from .cache import ProfileCache, RenderCache, RenderedBadge, normalize_handle
+from .compression import ENCODINGS, compress, negotiate
+from .freshness import CachePolicy, ChangeHistory
+from .metrics import Registry
+from .minify import minify_svg
+from .prefetch import HeavyHitters, PrefetchScheduler
+from .raster import RASTER_VERSION, Rasterizer
+from .ratelimit import BACKGROUND, INTERACTIVE, RateLimitedError, TokenBucket
+from .sharedcache import BadgeStore, HistoryStore, ProfileStore
+from .svg import SvgTemplate
+from .tiers import TIERS, progress
+from .timing import ServerTiming
+from .upstream import UpstreamClient, UpstreamStatusError
 from .images import UNKNOWN, UNRATED, BRONZE, SILVER, GOLD, PLATINUM, DIAMOND, RUBY, MASTER
 
-locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
-
 logger = logging.getLogger('testlogger')
 
 # Create your views here.
-TIERS = (
-    "Unrated",
-    "Bronze 5", "Bronze 4", "Bronze 3", "Bronze 2", "Bronze 1",
-    "Silver 5", "Silver 4", "Silver 3", "Silver 2", "Silver 1",
-    "Gold 5", "Gold 4", "Gold 3", "Gold 2", "Gold 1",
-    "Platinum 5", "Platinum 4", "Platinum 3", "Platinum 2", "Platinum 1",
-    "Diamond 5", "Diamond 4", "Diamond 3", "Diamond 2", "Diamond 1",
-    "Ruby 5", "Ruby 4", "Ruby 3", "Ruby 2", "Ruby 1",
-    "Master"
-)
-
 BACKGROUND_COLOR = {
     'Unknown': ['#AAAAAA', '#666666', '#000000'],
     'Unrated': ['#666666', '#2D2D2D', '#040202'],
@@ -60,72 +70,328 @@ TIER_IMG_LINK = {
     'Master': MASTER
 }
 
-TIER_RATES = (
-    0, # unranked
-    30, 60, 90, 120, 150, # bronze
-    200, 300, 400, 500, 650, # silver
-    800, 950, 1100, 1250, 1400, # gold
-    1600, 1750, 1900, 2000, 2100, # platinum
-    2200, 2300, 2400, 2500, 2600, # diamond
-    2700, 2800, 2850, 2900, 2950, # ruby
-    3000 # master
-)
+# seconds a fetched profile stays fresh for each badge variant, see README
+PROFILE_TTL = {
+    'v1': 3600,
+    'v2': 3600,
+    'mini': 86400,
+    'pastel': 3600,
+}
+PROFILE_TTL.update(getattr(settings, 'BADGE_PROFILE_TTL', {}))
+PROFILE_TTL.setdefault('v2_inline', PROFILE_TTL['v2'])
+
+PROFILE_MAX_STALE = getattr(settings, 'BADGE_PROFILE_MAX_STALE', 86400)
+
+# alias in settings.CACHES shared by all workers, empty for per-worker caches only
+SHARED_CACHE = getattr(settings, 'BADGE_CACHE', '')
+
+
+def profile_fingerprint(profile):
+    # the profile fields the badges are rendered from; None renders the Unknown badge
+    if profile is None:
+        return None
+    return (profile['rating'], profile['solvedCount'], profile['class'], profile['classDecoration'])
+
+
+# how often each handle's badge fields change, for the Cache-Control of its badges
+change_history = ChangeHistory(
+    profile_fingerprint,
+    maxsize=getattr(settings, 'BADGE_CHANGE_HISTORY_SIZE', 65536),
+    store=HistoryStore(
+        caches[SHARED_CACHE],
+        version=getattr(settings, 'BADGE_PROFILE_CACHE_VERSION', 1)) if SHARED_CACHE else None,
+    retention=getattr(settings, 'BADGE_CHANGE_HISTORY_RETENTION', 90 * 86400))
+
+cache_policy = CachePolicy(
+    change_history,
+    prior=getattr(settings, 'BADGE_CACHE_PRIOR_INTERVAL', 86400),
+    min_age=getattr(settings, 'BADGE_CACHE_MIN_AGE', 300),
+    max_age=getattr(settings, 'BADGE_CACHE_MAX_AGE', 86400),
+    max_shared_age=getattr(settings, 'BADGE_CACHE_MAX_SHARED_AGE', 7 * 86400),
+    max_stale=PROFILE_MAX_STALE)
+
+# off: every badge gets its variant's max-age, see BadgeVariant
+ADAPTIVE_CACHE = getattr(settings, 'BADGE_ADAPTIVE_CACHE', True)
+
+profile_cache = ProfileCache(
+    maxsize=getattr(settings, 'BADGE_PROFILE_CACHE_SIZE', 4096),
+    max_stale=PROFILE_MAX_STALE,
+    store=ProfileStore(
+        caches[SHARED_CACHE],
+        version=getattr(settings, 'BADGE_PROFILE_CACHE_VERSION', 1)) if SHARED_CACHE else None,
+    # kept as the last known good profile for when solved.ac is down
+    retention=max(max(PROFILE_TTL.values()) + PROFILE_MAX_STALE,
+                  getattr(settings, 'BADGE_PROFILE_RETENTION', 30 * 86400)),
+    history=change_history)
+
+BROTLI_QUALITY = getattr(settings, 'BADGE_BROTLI_QUALITY', 5)
+
+upstream = UpstreamClient(
+    cookie_file=getattr(settings, 'SOLVEDAC_COOKIE_FILE', None),
+    connect_timeout=getattr(settings, 'SOLVEDAC_CONNECT_TIMEOUT', 3.05),
+    read_timeout=getattr(settings, 'SOLVEDAC_READ_TIMEOUT', 10),
+    pool_size=getattr(settings, 'SOLVEDAC_POOL_SIZE', 10))
+
+breaker = CircuitBreaker(
+    threshold=getattr(settings, 'SOLVEDAC_BREAKER_THRESHOLD', 5),
+    cooldown=getattr(settings, 'SOLVEDAC_BREAKER_COOLDOWN', 30))
+
+# solved.ac requests paced for every worker on the host together
+rate_limiter = TokenBucket(
+    rate=getattr(settings, 'SOLVEDAC_RATE_LIMIT', 10),
+    burst=getattr(settings, 'SOLVEDAC_RATE_BURST', 20),
+    path=getattr(settings, 'SOLVEDAC_RATE_LIMIT_FILE', None) or None,
+    budget=getattr(settings, 'SOLVEDAC_QUEUE_BUDGET', 1.0),
+    background_reserve=getattr(settings, 'SOLVEDAC_BACKGROUND_RESERVE', 5),
+) if getattr(settings, 'SOLVEDAC_RATE_LIMIT', 10) else None
+
+# seconds everyone holds off after a 429 without Retry-After
+RATE_LIMIT_PAUSE = getattr(settings, 'SOLVEDAC_RATE_LIMIT_PAUSE', 10)
+
+# badges drawn from the last known profile while solved.ac is failing
+STALE_CACHE_CONTROL = getattr(settings, 'BADGE_STALE_CACHE_CONTROL', 'max-age=60')
+
+registry = Registry(
+    directory=getattr(settings, 'BADGE_METRICS_DIR', None),
+    flush_interval=getattr(settings, 'BADGE_METRICS_FLUSH_INTERVAL', 1),
+    enabled=getattr(settings, 'BADGE_METRICS', True))
+
+upstream_seconds = registry.histogram(
+    'solvedac_request_seconds', 'solved.ac request latency.', ('endpoint',))
+upstream_responses = registry.counter(
+    'solvedac_responses_total', 'solved.ac responses by status code, "error" when none came back.',
+    ('endpoint', 'status'))
+unknown_fallbacks = registry.counter(
+    'badge_unknown_fallbacks_total', 'Badges drawn as Unknown because the profile could not be loaded.',
+    ('error',))
+render_seconds = registry.histogram(
+    'badge_render_seconds', 'Time to render a badge SVG, without compression.', ('variant',))
+png_responses = registry.counter(
+    'badge_png_responses_total', '?format=png requests by how they were answered: cached, rasterized or svg.',
+    ('result',))
+requests_in_flight = registry.gauge(
+    'badge_requests_in_flight', 'Badge requests being served.', ('variant',))
+cache_requests = registry.counter(
+    'badge_cache_requests_total', 'Profile and render cache lookups by result.', ('cache', 'result'))
+stale_fallbacks = registry.counter(
+    'badge_stale_fallbacks_total', 'Badges drawn from the last known profile because solved.ac failed.')
+circuit_open = registry.gauge(
+    'solvedac_circuit_open', '1 while the solved.ac circuit breaker is open or half-open.')
+short_circuits = registry.counter(
+    'solvedac_short_circuits_total', 'solved.ac requests not sent because the circuit breaker was open.')
+rate_limited = registry.counter(
+    'solvedac_rate_limited_total', 'solved.ac requests shed by the rate limiter.', ('priority',))
+queue_seconds = registry.histogram(
+    'solvedac_queue_seconds', 'Time solved.ac requests waited for the rate limiter.', ('priority',))
+
+
+@registry.collect
+def collect_breaker_stats():
+    circuit_open.labels().set(0 if breaker.state == 'closed' else 1)
+    short_circuits.labels().set(breaker.short_circuited)
+
+
+def record_upstream(endpoint, started, status):
+    upstream_seconds.labels(endpoint).observe(time.perf_counter() - started)
+    upstream_responses.labels(endpoint, str(status)).inc()
+    if status == 'error' or upstream_failed(status):
+        breaker.failure()
+    else:
+        breaker.success()
+
+
+def reserve_upstream(priority, timing=None):
+    """Seconds to wait before calling solved.ac, raises ``RateLimitedError`` to shed the call."""
+    if rate_limiter is None:
+        return 0
+    try:
+        wait = rate_limiter.reserve(priority)
+    except RateLimitedError:
+        rate_limited.labels(priority).inc()
+        raise
+    queue_seconds.labels(priority).observe(wait)
+    if timing is not None and wait:
+        timing.add('queue', wait)
+    return wait
+
+
+def back_off(resp):
+    # solved.ac throttled us: every worker on the host waits, not just this one
+    if rate_limiter is None or resp.status_code != 429:
+        return
+    try:
+        seconds = float(resp.headers.get('Retry-After', RATE_LIMIT_PAUSE))
+    except ValueError:
+        seconds = RATE_LIMIT_PAUSE
+    logger.error('solved.ac rate limit hit, pausing for {}s'.format(seconds))
+    rate_limiter.pause(min(seconds, 300))
+
+
+def upstream_get(url, endpoint, timing=None, priority=INTERACTIVE):
+    trial = breaker.check()
+    try:
+        wait = reserve_upstream(priority, timing)
+        if wait:
+            time.sleep(wait)
+    except BaseException:
+        # not sent, so no success or failure ends the trial
+        if trial:
+            breaker.release()
+        raise
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        resp = upstream.get(url)
+        status = resp.status_code
+        back_off(resp)
+        return resp
+    finally:
+        record_upstream(endpoint, started, status)
+        if timing is not None:
+            timing.add('upstream', time.perf_counter() - started)
+
+
+def parse_profile(resp, timing=None):
+    if timing is None:
+        return resp.json()
+    started = time.perf_counter()
+    profile = resp.json()
+    timing.add('parse', time.perf_counter() - started)
+    return profile
+
+
+# Server-Timing header on badge responses, see api/timing.py
+SERVER_TIMING = getattr(settings, 'BADGE_SERVER_TIMING', False)
+
 
 class UrlSettings(object):
-    def __init__(self, request, MAX_LEN):
-        self.api_server = 'https://solved.ac/api'
-        self.boj_handle = request.GET.get("boj", "ccoco")
+    def __init__(self, request, MAX_LEN, handle=None):
+        # handle is given instead of a request by manage.py prerender_badges
+        self.api_server = getattr(settings, 'SOLVEDAC_API_SERVER', 'https://solved.ac/api')
+        self.boj_handle = handle if request is None else request.GET.get("boj", "ccoco")
         if len(self.boj_handle) > MAX_LEN:
             self.boj_name = self.boj_handle[:(MAX_LEN - 2)] + "..."
         else:
             self.boj_name = self.boj_handle
-        self.user_information_url = self.api_server + \
-            '/v3/user/show?handle=' + self.boj_handle
+        self.user_information_url = user_information_url(self.boj_handle)
+        self.timing = ServerTiming() if SERVER_TIMING else None
+        # set when the profile is the last known one, solved.ac having failed
+        self.stale = False
+        # set when the profile is past its TTL and being refreshed
+        self.expired = False
+
+
+def user_information_url(handle):
+    return getattr(settings, 'SOLVEDAC_API_SERVER', 'https://solved.ac/api') + \
+        '/v3/user/show?handle=' + handle
+
+
+def lookup_profiles(handles):
+    # one solved.ac request for many handles, used by the batcher
+    url = getattr(settings, 'SOLVEDAC_API_SERVER', 'https://solved.ac/api') + \
+        '/v3/user/lookup?handles=' + quote(','.join(handles), safe=',')
+    resp = upstream_get(url, 'lookup')
+    if resp.status_code != 200:
+        raise UpstreamStatusError(resp.status_code, resp.text)
+    return {normalize_handle(profile['handle']): profile for profile in resp.json()}
+
+
+BATCH_WINDOW = getattr(settings, 'SOLVEDAC_BATCH_WINDOW', 0.005)
+
+batcher = LookupBatcher(
+    lookup_profiles, window=BATCH_WINDOW,
+    max_batch=getattr(settings, 'SOLVEDAC_BATCH_SIZE', 50)) if BATCH_WINDOW else None
+
+
+def fetch_profile(handle, timing=None, priority=INTERACTIVE):
+    if timing is not None:
+        timing.describe('profile', 'miss')
+    # no batching while the breaker is open: the per-handle request fails fast.
+    # Batches are sent as interactive, so refreshes stay out of them.
+    if batcher is not None and priority == INTERACTIVE and breaker.state == 'closed':
+        started = time.perf_counter()
+        profile = batcher.submit(handle).result()
+        if timing is not None:
+            timing.add('upstream', time.perf_counter() - started)
+        if profile is not None:
+            return profile
+    resp = upstream_get(user_information_url(handle), 'show', timing, priority)
+    if resp.status_code != 200:
+        logger.error(f"API request failed: {resp.status_code} {resp.text}")
+        raise UpstreamStatusError(resp.status_code, resp.text)
+    return parse_profile(resp, timing)
+
+
+def refresh_profile(handle):
+    # stale and prefetch refreshes: nobody is waiting, so badge misses go first
+    return fetch_profile(handle, priority=BACKGROUND)
+
+
+def handle_failed(error):
+    """Whether a failed fetch is about the handle (e.g. no such user) rather than solved.ac or our limits."""
+    return isinstance(error, UpstreamStatusError) and not upstream_failed(error.status)
+
+
+def load_profile(url_set, variant):
+    """Cached solved.ac profile of the requested handle, None if it can't be fetched."""
+    timing = url_set.timing
+    if timing is not None:
+        timing.describe('profile', 'hit')
+        started = time.perf_counter()
+    try:
+        profile, fresh = profile_cache.lookup(
+            url_set.boj_handle, PROFILE_TTL[variant],
+            lambda: fetch_profile(url_set.boj_handle, timing),
+            lambda: refresh_profile(url_set.boj_handle))
+        url_set.expired = not fresh
+        return profile
+    except (JSONDecodeError, requests.RequestException) as e:
+        return last_known_profile(url_set, e)
+    finally:
+        if timing is not None:
+            timing.add('profile', time.perf_counter() - started)
+
+
+def last_known_profile(url_set, error):
+    """The newest profile kept for the handle after a failed fetch, None for the Unknown badge."""
+    logger.error(error)
+    entry = None
+    # a 404 means there is no such user; anything else is solved.ac failing
+    if not handle_failed(error):
+        entry = profile_cache.last_known(url_set.boj_handle)
+    if entry is None:
+        unknown_fallbacks.labels(type(error).__name__).inc()
+        return None
+    stale_fallbacks.labels().inc()
+    url_set.stale = True
+    if url_set.timing is not None:
+        url_set.timing.describe('profile', 'stale')
+    return entry[1]
+
+
+hot_handles = HeavyHitters(k=getattr(settings, 'BADGE_PREFETCH_TOP_K', 256))
+
+prefetcher = PrefetchScheduler(
+    profile_cache, hot_handles, refresh_profile, handle_failed,
+    interval=getattr(settings, 'BADGE_PREFETCH_INTERVAL', 10),
+    lead=getattr(settings, 'BADGE_PREFETCH_LEAD', 60),
+    concurrency=getattr(settings, 'BADGE_PREFETCH_CONCURRENCY', 4),
+    rate=getattr(settings, 'BADGE_PREFETCH_RATE', 5),
+    backoff=getattr(settings, 'BADGE_PREFETCH_BACKOFF', 60),
+    max_backoff=getattr(settings, 'BADGE_PREFETCH_MAX_BACKOFF', 86400)) if getattr(settings, 'BADGE_PREFETCH', False) else None
+
+
+def track_request(url_set, variant):
+    # feeds the in-process prefetcher, a no-op when it is off
+    if prefetcher is not None:
+        hot_handles.record(url_set.boj_handle, PROFILE_TTL[variant])
+        prefetcher.start()
 
 
 class BojDefaultSettings(object):
-    def __init__(self, request, url_set):
-        try:
-            # self.json = requests.get(url_set.user_information_url).json()
-            scraper = cloudscraper.create_scraper()
-            resp = scraper.get(url_set.user_information_url)
-            if resp.status_code != 200:
-                logger.error(f"API request failed: {resp.status_code} {resp.text}")
-                raise JSONDecodeError("Non-200 response", resp.text, 0)
-            self.json = resp.json()
-            self.rating = self.json['rating']
-            self.level = self.boj_rating_to_lv(self.json['rating'])
-            self.solved = '{0:n}'.format(self.json['solvedCount'])
-            self.boj_class = self.json['class']
-            self.boj_class_decoration = ''
-            if self.json['classDecoration'] == 'silver':
-                self.boj_class_decoration = '+'
-            elif self.json['classDecoration'] == 'gold':
-                self.boj_class_decoration = '++'
-
-            self.my_rate = self.json['rating']
-            if self.level == 31:
-                self.prev_rate = TIER_RATES[self.level]
-                self.next_rate = TIER_RATES[self.level]
-                self.percentage = 100
-            else:
-                self.prev_rate = TIER_RATES[self.level]
-                self.next_rate = TIER_RATES[self.level+1]
-                self.percentage = round(
-                    (self.my_rate - self.prev_rate) * 100 / (self.next_rate - self.prev_rate))
-            self.bar_size = 35 + 2.55 * self.percentage
-
-            self.needed_rate = '{0:n}'.format(self.next_rate)
-            self.now_rate = '{0:n}'.format(self.my_rate)
-            self.rate = '{0:n}'.format(self.my_rate)
-
-            if TIERS[self.level] == 'Unrated' or TIERS[self.level] == 'Master':
-                self.tier_title = TIERS[self.level]
-                self.tier_rank = ''
-            else:
-                self.tier_title, self.tier_rank = TIERS[self.level].split()
-        except JSONDecodeError as e:
-            logger.error(e)
+    def __init__(self, request, url_set, profile):
+        self.json = profile
+        if profile is None:
             self.tier_title = "Unknown"
             url_set.boj_handle = 'Unknown'
             self.tier_rank = ''
@@ -137,26 +403,38 @@ class BojDefaultSettings(object):
             self.needed_rate = '0'
             self.percentage = '0'
             self.bar_size = '35'
+            return
 
-    def boj_rating_to_lv(self, rating):
-        if rating < 30: return 0
-        if rating < 150: return rating // 30
-        if rating < 200: return 5
-        if rating < 500: return (rating-200) // 100 + 6
-        if rating < 1400: return (rating-500) // 150 + 9
-        if rating < 1600: return 15
-        if rating < 1750: return 16
-        if rating < 1900: return 17
-        if rating < 2800: return (rating-1900) // 100 + 18
-        if rating < 3000: return (rating-2800) // 50 + 27
-        return 31
+        self.rating = self.json['rating']
+        tier = progress(self.rating)
+        self.level = tier.level
+        self.solved = '{:,}'.format(self.json['solvedCount'])
+        self.boj_class = self.json['class']
+        self.boj_class_decoration = ''
+        if self.json['classDecoration'] == 'silver':
+            self.boj_class_decoration = '+'
+        elif self.json['classDecoration'] == 'gold':
+            self.boj_class_decoration = '++'
 
+        self.my_rate = self.rating
+        self.prev_rate = tier.prev_rate
+        self.next_rate = tier.next_rate
+        self.percentage = tier.percentage
+        self.bar_size = tier.bar_size
 
-def generate_badge(request):
-    MAX_LEN = 11
-    url_set = UrlSettings(request, MAX_LEN)
-    handle_set = BojDefaultSettings(request, url_set)
-    svg = '''
+        self.needed_rate = '{:,}'.format(self.next_rate)
+        self.now_rate = '{:,}'.format(self.my_rate)
+        self.rate = '{:,}'.format(self.my_rate)
+
+        self.tier_title = tier.tier_title
+        self.tier_rank = tier.tier_rank
+
+
+TIER_TITLES = ('Unknown',) + tuple(dict.fromkeys(tier.split()[0] for tier in TIERS))
+
+# The templates below are kept readable and minified once at import, see api/minify.py
+
+BADGE_V1_SVG = '''
     <!DOCTYPE svg PUBLIC
         "-//W3C//DTD SVG 1.1//EN"
         "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
@@ -271,34 +549,9 @@ def generate_badge(request):
     <text x="297" y="142" alignment-baseline="middle" class="percentage">{percentage}%</text>
     <text x="293" y="157" class="progress" text-anchor="end">{now_rate} / {needed_rate}</text>
 </svg>
-    '''.format(color1=BACKGROUND_COLOR[handle_set.tier_title][0],
-               color2=BACKGROUND_COLOR[handle_set.tier_title][1],
-               color3=BACKGROUND_COLOR[handle_set.tier_title][2],
-               boj_handle=url_set.boj_name,
-               tier_rank=handle_set.tier_rank,
-               tier_title=handle_set.tier_title,
-               solved=handle_set.solved,
-               boj_class=handle_set.boj_class,
-               boj_class_decoration=handle_set.boj_class_decoration,
-               rate=handle_set.rate,
-               now_rate=handle_set.now_rate,
-               needed_rate=handle_set.needed_rate,
-               percentage=handle_set.percentage,
-               bar_size=handle_set.bar_size)
-
-    logger.info('[/generate_badge] user: {}, tier: {}'.format(url_set.boj_name, handle_set.tier_title))
-    response = HttpResponse(content=svg)
-    response['Content-Type'] = 'image/svg+xml'
-    response['Cache-Control'] = 'max-age=3600'
-
-    return response
+    '''
 
-
-def generate_badge_v2(request):
-    MAX_LEN = 15
-    url_set = UrlSettings(request, MAX_LEN)
-    handle_set = BojDefaultSettings(request, url_set)
-    svg = '''
+BADGE_V2_SVG = '''
     <!DOCTYPE svg PUBLIC
         "-//W3C//DTD SVG 1.1//EN"
         "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
@@ -471,34 +724,9 @@ def generate_badge_v2(request):
     <text x="297" y="142" alignment-baseline="middle" class="percentage">{percentage}%</text>
     <text x="293" y="157" class="progress" text-anchor="end">{now_rate} / {needed_rate}</text>
 </svg>
-    '''.format(color1=BACKGROUND_COLOR[handle_set.tier_title][0],
-               color2=BACKGROUND_COLOR[handle_set.tier_title][1],
-               color3=BACKGROUND_COLOR[handle_set.tier_title][2],
-               boj_handle=url_set.boj_name,
-               tier_rank=('M' if handle_set.tier_title == 'Master' else handle_set.tier_rank),
-               tier_img_link=TIER_IMG_LINK[handle_set.tier_title],
-               solved=handle_set.solved,
-               boj_class=handle_set.boj_class,
-               boj_class_decoration=handle_set.boj_class_decoration,
-               rate=handle_set.rate,
-               now_rate=handle_set.now_rate,
-               needed_rate=handle_set.needed_rate,
-               percentage=handle_set.percentage,
-               bar_size=handle_set.bar_size)
-
-    logger.info('[/generate_badge/v2] user: {}, tier: {}'.format(url_set.boj_name, handle_set.tier_title))
-    response = HttpResponse(content=svg)
-    response['Content-Type'] = 'image/svg+xml'
-    response['Cache-Control'] = 'max-age=3600'
+    '''
 
-    return response
-
-def generate_badge_mini(request):
-    MAX_LEN = 11
-    url_set = UrlSettings(request, MAX_LEN)
-    handle_set = BojDefaultSettings(request, url_set)
-
-    svg = '''
+BADGE_MINI_SVG = '''
     <!DOCTYPE svg PUBLIC
         "-//W3C//DTD SVG 1.1//EN"
         "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
@@ -561,33 +789,9 @@ def generate_badge_mini(request):
 
 
 </svg>
-    '''.format(color1=BACKGROUND_COLOR[handle_set.tier_title][0],
-               color2=BACKGROUND_COLOR[handle_set.tier_title][1],
-               color3=BACKGROUND_COLOR[handle_set.tier_title][2],
-               boj_handle=url_set.boj_name,
-               tier_rank=handle_set.tier_rank,
-               tier_title=handle_set.tier_title[0],
-               solved=handle_set.solved,
-               boj_class=handle_set.boj_class,
-               rate=handle_set.rate,
-               now_rate=handle_set.now_rate,
-               needed_rate=handle_set.needed_rate,
-               percentage=handle_set.percentage,
-               bar_size=handle_set.bar_size)
-    logger.info('[/generate_badge/mini ] user: {}, tier: {}'.format(url_set.boj_name, handle_set.tier_title))
-    response = HttpResponse(content=svg)
-    response['Content-Type'] = 'image/svg+xml'
-    response['Cache-Control'] = 'max-age=86400'
-
-    return response
-
+    '''
 
-def generate_badge_pastel(request):
-    MAX_LEN = 11
-    url_set = UrlSettings(request, MAX_LEN)
-    handle_set = BojDefaultSettings(request, url_set)
-
-    svg = '''
+BADGE_PASTEL_SVG = '''
     <!DOCTYPE svg PUBLIC
         "-//W3C//DTD SVG 1.1//EN"
         "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
@@ -704,23 +908,353 @@ def generate_badge_pastel(request):
     <text x="297" y="142" alignment-baseline="middle" class="percentage">{percentage}%</text>
     <text x="293" y="157" class="progress" text-anchor="end">{now_rate} / {needed_rate}</text>
 </svg>
-    '''.format(color1=BACKGROUND_COLOR_PASTEL[handle_set.tier_title][0],
-               color2=BACKGROUND_COLOR_PASTEL[handle_set.tier_title][1],
-               boj_handle=url_set.boj_name,
-               tier_rank=handle_set.tier_rank,
-               tier_title=handle_set.tier_title,
-               solved=handle_set.solved,
-               boj_class=handle_set.boj_class,
-               boj_class_decoration=handle_set.boj_class_decoration,
-               rate=handle_set.rate,
-               now_rate=handle_set.now_rate,
-               needed_rate=handle_set.needed_rate,
-               percentage=handle_set.percentage,
-               bar_size=handle_set.bar_size)
-
-    logger.info('[/generate_badge/pastel] user: {}, tier: {}'.format(url_set.boj_name, handle_set.tier_title))
-    response = HttpResponse(content=svg)
-    response['Content-Type'] = 'image/svg+xml'
-    response['Cache-Control'] = 'max-age=3600'
+    '''
+
+BADGE_V1 = SvgTemplate(minify_svg(BADGE_V1_SVG), ('color1', 'color2', 'color3'), {
+    title: dict(zip(('color1', 'color2', 'color3'), BACKGROUND_COLOR[title]))
+    for title in TIER_TITLES
+})
+
+TIER_ASSETS = tier_assets(TIER_IMG_LINK)
+
+TIER_ASSETS_BY_NAME = {asset.name: asset for asset in TIER_ASSETS.values()}
+
+# where the tier image endpoint is mounted, see urls.py; absolute, since
+# a relative URL in an SVG resolves against whatever host proxies it
+TIER_ASSET_URL = urljoin(getattr(settings, 'BADGE_PUBLIC_URL', 'http://mazassumnida.wtf') + '/',
+                         getattr(settings, 'BADGE_TIER_ASSET_URL', '/api/tier/'))
+
+# v2 embeds the tier image as a data URI by default; `?inline=0` (or this setting) links it
+V2_INLINE_IMAGES = getattr(settings, 'BADGE_V2_INLINE_IMAGES', True)
+
+BADGE_V2 = SvgTemplate(minify_svg(BADGE_V2_SVG), ('color1', 'color2', 'color3', 'tier_img_link'), {
+    title: dict(zip(('color1', 'color2', 'color3'), BACKGROUND_COLOR[title]),
+                tier_img_link=TIER_ASSET_URL + TIER_ASSETS[title].name)
+    for title in TIER_TITLES
+})
+
+BADGE_V2_INLINE = SvgTemplate(minify_svg(BADGE_V2_SVG), ('color1', 'color2', 'color3', 'tier_img_link'), {
+    title: dict(zip(('color1', 'color2', 'color3'), BACKGROUND_COLOR[title]),
+                tier_img_link=TIER_IMG_LINK[title])
+    for title in TIER_TITLES
+})
+
+BADGE_MINI = SvgTemplate(minify_svg(BADGE_MINI_SVG), ('color1', 'color2', 'color3'), {
+    title: dict(zip(('color1', 'color2', 'color3'), BACKGROUND_COLOR[title]))
+    for title in TIER_TITLES
+})
+
+BADGE_PASTEL = SvgTemplate(minify_svg(BADGE_PASTEL_SVG), ('color1', 'color2'), {
+    title: dict(zip(('color1', 'color2'), BACKGROUND_COLOR_PASTEL[title]))
+    for title in TIER_TITLES
+})
+
+
+def render_badge(url_set, handle_set):
+    return BADGE_V1.render(
+        handle_set.tier_title,
+        boj_handle=url_set.boj_name,
+        tier_rank=handle_set.tier_rank,
+        tier_title=handle_set.tier_title,
+        solved=handle_set.solved,
+        boj_class=handle_set.boj_class,
+        boj_class_decoration=handle_set.boj_class_decoration,
+        rate=handle_set.rate,
+        now_rate=handle_set.now_rate,
+        needed_rate=handle_set.needed_rate,
+        percentage=handle_set.percentage,
+        bar_size=handle_set.bar_size)
+
+
+def render_badge_v2(url_set, handle_set, template=None):
+    return (template or BADGE_V2).render(
+        handle_set.tier_title,
+        boj_handle=url_set.boj_name,
+        tier_rank=('M' if handle_set.tier_title == 'Master' else handle_set.tier_rank),
+        solved=handle_set.solved,
+        boj_class=handle_set.boj_class,
+        boj_class_decoration=handle_set.boj_class_decoration,
+        rate=handle_set.rate,
+        now_rate=handle_set.now_rate,
+        needed_rate=handle_set.needed_rate,
+        percentage=handle_set.percentage,
+        bar_size=handle_set.bar_size)
+
+
+def render_badge_v2_inline(url_set, handle_set):
+    return render_badge_v2(url_set, handle_set, BADGE_V2_INLINE)
+
+
+def render_badge_mini(url_set, handle_set):
+    return BADGE_MINI.render(
+        handle_set.tier_title,
+        tier_rank=handle_set.tier_rank,
+        tier_title=handle_set.tier_title[0],
+        bar_size=handle_set.bar_size)
+
+
+def render_badge_pastel(url_set, handle_set):
+    return BADGE_PASTEL.render(
+        handle_set.tier_title,
+        boj_handle=url_set.boj_name,
+        tier_rank=handle_set.tier_rank,
+        tier_title=handle_set.tier_title,
+        solved=handle_set.solved,
+        boj_class=handle_set.boj_class,
+        boj_class_decoration=handle_set.boj_class_decoration,
+        rate=handle_set.rate,
+        now_rate=handle_set.now_rate,
+        needed_rate=handle_set.needed_rate,
+        percentage=handle_set.percentage,
+        bar_size=handle_set.bar_size)
+
+
+# max_age: the Cache-Control max-age, for a handle changing at the usual rate with the adaptive policy
+BadgeVariant = namedtuple('BadgeVariant', 'max_len template render log_path max_age')
+
+BADGE_VARIANTS = {
+    'v1': BadgeVariant(11, BADGE_V1, render_badge, '/generate_badge', 3600),
+    'v2': BadgeVariant(15, BADGE_V2, render_badge_v2, '/generate_badge/v2', 3600),
+    'v2_inline': BadgeVariant(15, BADGE_V2_INLINE, render_badge_v2_inline, '/generate_badge/v2', 3600),
+    'mini': BadgeVariant(11, BADGE_MINI, render_badge_mini, '/generate_badge/mini ', 86400),
+    'pastel': BadgeVariant(11, BADGE_PASTEL, render_badge_pastel, '/generate_badge/pastel', 3600),
+}
+
+render_cache = RenderCache(
+    max_bytes=getattr(settings, 'BADGE_RENDER_CACHE_BYTES', 64 * 1024 * 1024),
+    store=BadgeStore(
+        caches[SHARED_CACHE],
+        # a template edit changes the shared keys, so other deploys' renders are never served
+        namespace=''.join(spec.template.digest for _, spec in sorted(BADGE_VARIANTS.items())),
+        version=getattr(settings, 'BADGE_TEMPLATE_VERSION', 1),
+        timeout=getattr(settings, 'BADGE_RENDER_CACHE_TIMEOUT', 7 * 86400)) if SHARED_CACHE else None)
+
+
+# ?format=png, rasterized in a process pool and cached by SVG hash, see api/raster.py
+rasterizer = Rasterizer(
+    RenderCache(
+        max_bytes=getattr(settings, 'BADGE_PNG_CACHE_BYTES', 32 * 1024 * 1024),
+        store=BadgeStore(
+            caches[SHARED_CACHE], namespace='png{}'.format(RASTER_VERSION),
+            version=getattr(settings, 'BADGE_TEMPLATE_VERSION', 1),
+            timeout=getattr(settings, 'BADGE_RENDER_CACHE_TIMEOUT', 7 * 86400)) if SHARED_CACHE else None),
+    processes=getattr(settings, 'BADGE_PNG_PROCESSES', 2),
+    max_queue=getattr(settings, 'BADGE_PNG_QUEUE', 8))
+
+PNG_ENABLED = getattr(settings, 'BADGE_PNG', True) and rasterizer.available
+
+# seconds a request waits for its PNG before it gets the SVG
+PNG_TIMEOUT = getattr(settings, 'BADGE_PNG_TIMEOUT', 2)
+
+PNG_FALLBACK_CACHE_CONTROL = getattr(settings, 'BADGE_PNG_FALLBACK_CACHE_CONTROL', 'no-cache')
+
+
+def badge_cache_control(variant, url_set):
+    spec = BADGE_VARIANTS[variant]
+    if url_set.expired:
+        # the refresh under way lands within a minute; don't pin the old profile for longer
+        return STALE_CACHE_CONTROL
+    if not ADAPTIVE_CACHE:
+        return 'max-age={}'.format(spec.max_age)
+    return cache_policy.cache_control(spec.max_age, url_set.boj_handle, PROFILE_TTL[variant])
+
+
+def badge_etag(spec, key, coding=None):
+    # strong validator: same template, display name and profile fields give the same bytes
+    digest = hashlib.sha1(repr((spec.template.digest,) + key).encode()).hexdigest()[:32]
+    return quote_etag(digest + '-' + coding if coding else digest)
+
+
+@registry.collect
+def collect_cache_stats():
+    # the caches count their own lookups; copied in only when metrics are read
+    for name, stats in (('profile', profile_cache.stats()), ('render', render_cache.stats())):
+        for result, label in (('hits', 'hit'), ('stale_hits', 'stale_hit'), ('shared_hits', 'shared_hit'),
+                              ('misses', 'miss')):
+            if result in stats:
+                cache_requests.labels(name, label).set(stats[result])
+
+
+def badge_response(request, variant):
+    registry.start()
+    in_flight = requests_in_flight.labels(variant)
+    in_flight.inc()
+    try:
+        url_set = UrlSettings(request, BADGE_VARIANTS[variant].max_len)
+        track_request(url_set, variant)
+        profile = load_profile(url_set, variant)
+        if wants_png(request):
+            png = png_badge(request, variant, url_set, profile)
+            if isinstance(png, Future):
+                png = wait_png(png, url_set.timing)
+            return png_badge_response(request, variant, url_set, profile, png)
+        return profile_badge_response(request, variant, url_set, profile)
+    finally:
+        in_flight.dec()
+
+
+def render_profile_badge(request, variant, url_set, profile, key):
+    # a render cache miss: draw, compress and cache the badge
+    spec = BADGE_VARIANTS[variant]
+    timing = url_set.timing
+    started = time.perf_counter()
+    handle_set = BojDefaultSettings(request, url_set, profile)
+    computed = time.perf_counter()
+    body = spec.render(url_set, handle_set)
+    rendered = time.perf_counter()
+    render_seconds.labels(variant).observe(rendered - computed)
+    badge = RenderedBadge(body, handle_set.tier_title, compress(body, BROTLI_QUALITY))
+    if timing is not None:
+        timing.add('compute', computed - started)
+        timing.add('render', rendered - computed)
+        timing.add('compress', time.perf_counter() - rendered)
+    render_cache.set(key, badge)
+    return badge
+
+
+def profile_badge_response(request, variant, url_set, profile):
+    # everything after the profile is loaded, shared with the async views
+    spec = BADGE_VARIANTS[variant]
+    timing = url_set.timing
+    key = (variant, url_set.boj_name, profile_fingerprint(profile))
+    badge = render_cache.get(key)
+    if timing is not None:
+        timing.describe('badge', 'miss' if badge is None else 'hit')
+    coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING'),
+                       badge.encoded if badge is not None else ENCODINGS)
+    etag = badge_etag(spec, key, coding)
+    last_modified = badge.created_at if badge is not None else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if badge is None:
+            badge = render_profile_badge(request, variant, url_set, profile, key)
+            last_modified = badge.created_at
+            if coding is not None and coding not in badge.encoded:
+                coding = None
+                etag = badge_etag(spec, key)
+        if coding is not None:
+            response = HttpResponse(content=badge.encoded[coding])
+            response['Content-Encoding'] = coding
+        else:
+            response = HttpResponse(content=badge.body)
+        response['Content-Type'] = 'image/svg+xml'
+        logger.info('[{}] user: {}, tier: {}'.format(spec.log_path, url_set.boj_name, badge.tier_title))
+    else:
+        logger.info('[{}] user: {}, not modified'.format(spec.log_path, url_set.boj_name))
+
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if url_set.stale:
+        # same bytes as the fresh badge was, but ask to be fetched again soon
+        response['Cache-Control'] = STALE_CACHE_CONTROL
+        response['Warning'] = '110 - "Response is Stale"'
+    else:
+        response['Cache-Control'] = badge_cache_control(variant, url_set)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if timing is not None:
+        response['Server-Timing'] = timing.header()
 
     return response
+
+
+def wants_png(request):
+    return PNG_ENABLED and request.GET.get('format') == 'png'
+
+
+def png_badge(request, variant, url_set, profile):
+    """PNG of the badge, a future of it, None to send the SVG instead, or b'' if the client has it."""
+    spec = BADGE_VARIANTS[variant]
+    key = (variant, url_set.boj_name, profile_fingerprint(profile))
+    if get_conditional_response(request, etag=badge_etag(spec, key, 'png')) is not None:
+        return b''
+    badge = render_cache.get(key) or render_profile_badge(request, variant, url_set, profile, key)
+    png = rasterizer.rasterize(badge.body)
+    if isinstance(png, bytes):
+        png_responses.labels('cached').inc()
+    return png
+
+
+def wait_png(future, timing=None):
+    # the request thread only waits; the pool process does the work
+    started = time.perf_counter()
+    try:
+        png = future.result(PNG_TIMEOUT)
+        png_responses.labels('rasterized').inc()
+        return png
+    except Exception:
+        # timed out or failed, the rasterizer logs failures
+        return None
+    finally:
+        if timing is not None:
+            timing.add('raster', time.perf_counter() - started)
+
+
+def png_badge_response(request, variant, url_set, profile, png):
+    spec = BADGE_VARIANTS[variant]
+    if png is None:
+        # overloaded: the SVG now, and the PNG once the client asks again
+        png_responses.labels('svg').inc()
+        response = profile_badge_response(request, variant, url_set, profile)
+        response['Cache-Control'] = PNG_FALLBACK_CACHE_CONTROL
+        return response
+    key = (variant, url_set.boj_name, profile_fingerprint(profile))
+    etag = badge_etag(spec, key, 'png')
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content=png, content_type='image/png')
+        logger.info('[{}] user: {}, png'.format(spec.log_path, url_set.boj_name))
+    response['ETag'] = etag
+    if url_set.stale:
+        response['Cache-Control'] = STALE_CACHE_CONTROL
+        response['Warning'] = '110 - "Response is Stale"'
+    else:
+        response['Cache-Control'] = badge_cache_control(variant, url_set)
+    if url_set.timing is not None:
+        response['Server-Timing'] = url_set.timing.header()
+    return response
+
+
+def generate_badge(request):
+    return badge_response(request, 'v1')
+
+
+def v2_variant(request):
+    inline = request.GET.get('inline')
+    if inline in ('1', 'true'):
+        return 'v2_inline'
+    if inline in ('0', 'false'):
+        return 'v2'
+    return 'v2_inline' if V2_INLINE_IMAGES else 'v2'
+
+
+def generate_badge_v2(request):
+    return badge_response(request, v2_variant(request))
+
+
+def generate_badge_mini(request):
+    return badge_response(request, 'mini')
+
+
+def generate_badge_pastel(request):
+    return badge_response(request, 'pastel')
+
+
+def tier_image(request, name):
+    # content-addressed: a new image gets a new name, so the response never changes
+    asset = TIER_ASSETS_BY_NAME.get(name)
+    if asset is None:
+        raise Http404('unknown tier image')
+    response = get_conditional_response(request, etag=asset.etag)
+    if response is None:
+        response = HttpResponse(content=asset.body, content_type='image/png')
+    response['ETag'] = asset.etag
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def metrics(request):
+    if not registry.enabled:
+        raise Http404('metrics are off')
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
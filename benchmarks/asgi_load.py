@@ -0,0 +1,104 @@
+"""Throughput of the sync vs async badge views on the ASGI application.
+
+Each request asks for a different handle, so every one of them waits on a
+local solved.ac stub that answers after ``--latency`` seconds. Each run
+gets an empty cache of its own and no rate limit, and only real badges
+count as ok, not Unknown ones.
+
+    python -m benchmarks.asgi_load --latency 0.1 --concurrency 1 10 50
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import shutil
+import tempfile
+import subprocess
+
+from benchmarks.stub_server import StubServer
+
+
+async def call(app, path, query):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return messages[0]['status'], body
+
+
+async def drive(app, requests, concurrency):
+    gate = asyncio.Semaphore(concurrency)
+    ok = []
+
+    async def one(i):
+        async with gate:
+            status, body = await call(app, '/api/generate_badge', 'boj=user{}'.format(i))
+            # an Unknown badge means the fetch failed or was shed, not served
+            ok.append(status == 200 and b'>Unknown<' not in body)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {'requests': requests, 'ok': sum(ok), 'seconds': elapsed, 'rps': requests / elapsed}
+
+
+def child(args):
+    from mazassumnida.asgi import application
+    print(json.dumps(asyncio.run(drive(application, args.requests, args.concurrency[0]))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    server = StubServer(latency=args.latency).start()
+    try:
+        print('{:<6} {:>11} {:>9} {:>8}'.format('views', 'concurrency', 'req/s', 'ok'))
+        for mode in ('sync', 'async'):
+            for concurrency in args.concurrency:
+                # a cold cache and no rate limit, so every request is a solved.ac fetch
+                workdir = tempfile.mkdtemp(prefix='asgi-load-')
+                env = dict(os.environ, SOLVEDAC_API_SERVER=server.api_server,
+                           BADGE_ASYNC_VIEWS='1' if mode == 'async' else '0',
+                           SOLVEDAC_RATE_LIMIT='0',
+                           BADGE_STATE_DIR=workdir,
+                           BADGE_CACHE_LOCATION=os.path.join(workdir, 'cache.sqlite3'),
+                           SOLVEDAC_COOKIE_FILE=os.path.join(workdir, 'clearance.json'))
+                # sync views serve far fewer requests per second; keep their runs short
+                requests = args.requests if mode == 'async' else min(args.requests, concurrency * 10)
+                try:
+                    out = subprocess.run(
+                        [sys.executable, '-m', 'benchmarks.asgi_load', '--child', '--requests', str(requests),
+                         '--concurrency', str(concurrency)],
+                        env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                result = json.loads(out.decode().strip().splitlines()[-1])
+                print('{:<6} {:>11} {:>9.1f} {:>4}/{:<4}'.format(
+                    mode, concurrency, result['rps'], result['ok'], result['requests']))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Badge latency and correctness while solved.ac is down.
+
+Runs the views in-process against the local solved.ac stub, with every
+profile already expired so each badge needs solved.ac, through these phases:
+
+    healthy     every handle fetched once; the responses are the reference
+    errors      the stub answers 503 to everything
+    hanging     the stub answers after twice the read timeout
+    recovered   the stub is healthy again, after one breaker cooldown
+
+Each outage phase runs twice: as the app is now (circuit breaker, last known
+good profiles) and as it was before (no breaker, Unknown badge on failure).
+Each phase starts with empty per-worker caches, as after a restart, so the
+last known profiles come from the shared SQLite cache. For each phase:
+latency, and how many badges were fresh, stale (with the same SVG as in
+the healthy phase) or Unknown.
+
+    python -m benchmarks.chaos --handles 50 --timeout 0.5
+"""
+import os
+import time
+import logging
+import argparse
+import tempfile
+from unittest import mock
+
+import django
+
+
+def run_phase(client, handles, reference=None):
+    from api import views
+
+    # as after a worker restart: only the shared cache survives
+    with views.profile_cache._lock:
+        views.profile_cache._data.clear()
+    views.render_cache._data.clear()
+    views.render_cache.size = 0
+
+    latencies = []
+    outcomes = {'fresh': 0, 'stale': 0, 'unknown': 0, 'wrong': 0}
+    bodies = {}
+    for handle in handles:
+        start = time.perf_counter()
+        response = client.get('/api/generate_badge', {'boj': handle})
+        latencies.append(time.perf_counter() - start)
+        bodies[handle] = response.content
+        if b'>Unknown<' in response.content:
+            outcomes['unknown'] += 1
+        elif reference is not None and response.content != reference[handle]:
+            outcomes['wrong'] += 1
+        elif response.has_header('Warning'):
+            outcomes['stale'] += 1
+        else:
+            outcomes['fresh'] += 1
+    latencies.sort()
+    return {
+        'p50_ms': latencies[len(latencies) // 2] * 1e3,
+        'p99_ms': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1e3,
+        'max_ms': latencies[-1] * 1e3,
+        'total_s': sum(latencies),
+        **outcomes,
+    }, bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handles', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=0.5, help='read timeout towards solved.ac, seconds')
+    parser.add_argument('--cooldown', type=float, default=1.0, help='circuit breaker cooldown, seconds')
+    args = parser.parse_args()
+
+    from benchmarks.stub_server import StubServer
+
+    stub = StubServer(latency=0.005).start()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mazassumnida.settings')
+    os.environ['SOLVEDAC_API_SERVER'] = stub.api_server
+    os.environ['BADGE_CACHE_LOCATION'] = os.path.join(tempfile.mkdtemp(prefix='chaos-'), 'cache.sqlite3')
+    os.environ['BADGE_CACHE'] = 'badges'
+    os.environ['BADGE_METRICS_DIR'] = ''
+    os.environ['SOLVEDAC_COOKIE_FILE'] = ''
+    django.setup()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    logging.disable(logging.CRITICAL)
+    from api import views
+
+    client = Client()
+    handles = ['user{}'.format(i) for i in range(args.handles)]
+    views.upstream.timeout = (args.timeout, args.timeout)
+    views.breaker.cooldown = args.cooldown
+    # every profile is expired and past its stale window, so each badge asks solved.ac
+    ttl = dict.fromkeys(views.PROFILE_TTL, 0)
+    no_breaker = mock.patch.object(views.breaker, 'threshold', float('inf'))
+    no_last_known = mock.patch.object(views.profile_cache, 'last_known', lambda handle: None)
+
+    print('{:<22} {:>9} {:>9} {:>9} {:>9} {:>6} {:>6} {:>8} {:>6}'.format(
+        'phase', 'p50 ms', 'p99 ms', 'max ms', 'total s', 'fresh', 'stale', 'unknown', 'wrong'))
+
+    def report(name, result):
+        print('{:<22} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.2f} {:>6} {:>6} {:>8} {:>6}'.format(
+            name, result['p50_ms'], result['p99_ms'], result['max_ms'], result['total_s'],
+            result['fresh'], result['stale'], result['unknown'], result['wrong']), flush=True)
+
+    with mock.patch.dict(views.PROFILE_TTL, ttl), mock.patch.object(views.profile_cache, 'max_stale', 0):
+        result, reference = run_phase(client, handles)
+        report('healthy', result)
+
+        outages = (
+            ('errors', {'faults': (('error', 1.0),)}),
+            ('hanging', {'latency': args.timeout * 2}),
+        )
+        for name, broken in outages:
+            for mode in ('before', 'now'):
+                views.breaker.success()
+                with mock.patch.multiple(stub, **broken):
+                    if mode == 'before':
+                        with no_breaker, no_last_known:
+                            result, _ = run_phase(client, handles, reference)
+                    else:
+                        result, _ = run_phase(client, handles, reference)
+                report('{} ({})'.format(name, mode), result)
+
+        time.sleep(args.cooldown)
+        result, _ = run_phase(client, handles, reference)
+        report('recovered', result)
+    stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""End-to-end load test of the app under gunicorn, against a local solved.ac stub.
+
+Starts ``benchmarks.stub_server`` (with its latency, fault and replay
+options) and then, for every worker class and worker count, a gunicorn
+serving the production settings with a fresh shared cache and, unless
+``--rate-limit`` is given, no solved.ac rate limit. Each run drives
+``--concurrency`` keep-alive connections for ``--duration`` seconds, asking
+for handles drawn from a Zipf distribution over ``--handles`` users so a
+few are hot and most are cold, and reports throughput, tail latency and the
+status codes. Nothing leaves the machine.
+
+Worker classes: ``sync`` and ``gthread`` (``--threads`` each) run the WSGI
+app, ``uvicorn`` runs the ASGI app with the async views.
+
+    python -m benchmarks.loadgen --worker-class sync gthread uvicorn --workers 1 2 4
+    python -m benchmarks.loadgen --latency 0.05 --jitter 0.1 --errors 0.02 --challenges 0.01
+    python -m benchmarks.loadgen --replay solvedac.jsonl --output load.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import itertools
+import subprocess
+from collections import Counter
+
+WORKER_CLASSES = {
+    'sync': ['mazassumnida.wsgi', '--worker-class', 'sync'],
+    'gthread': ['mazassumnida.wsgi', '--worker-class', 'gthread'],
+    'uvicorn': ['mazassumnida.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+BADGE_PATHS = ('/api/generate_badge', '/api/v2/generate_badge', '/api/mini/generate_badge')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def zipf_handles(count, exponent, seed):
+    """Endless stream of ``user<n>`` handles, user0 the most requested."""
+    rng = random.Random(seed)
+    handles = ['user{}'.format(i) for i in range(count)]
+    weights = list(itertools.accumulate(1 / (i + 1) ** exponent for i in range(count)))
+    while True:
+        yield from rng.choices(handles, cum_weights=weights, k=1024)
+
+
+class Connection(object):
+    """Minimal HTTP/1.1 keep-alive client; reconnects when the server closes."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write('GET {} HTTP/1.1\r\nHost: {}\r\nAccept-Encoding: gzip\r\n\r\n'.format(
+            path, self.host).encode())
+        status_line = await self.reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+            headers['connection'] = 'close'
+        if headers.get('connection') == 'close':
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def drive(port, concurrency, duration, handles):
+    latencies = []
+    statuses = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def user(i):
+        connection = Connection('127.0.0.1', port)
+        paths = itertools.cycle(BADGE_PATHS[i % len(BADGE_PATHS):] + BADGE_PATHS[:i % len(BADGE_PATHS)])
+        while time.perf_counter() < deadline:
+            path = '{}?boj={}'.format(next(paths), next(handles))
+            start = time.perf_counter()
+            try:
+                status = await connection.get(path)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                connection.close()
+                status = 'error'
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+        connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e3
+
+    return {
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'max_ms': latencies[-1] * 1e3,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+
+
+def wait_until_ready(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('exited with status {}'.format(process.returncode))
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('not listening after {}s'.format(timeout))
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_app(worker_class, workers, args, api_server):
+    """Measurements of one gunicorn configuration."""
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='loadgen-')
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE='mazassumnida.settings_production',
+               SOLVEDAC_API_SERVER=api_server,
+               SOLVEDAC_RATE_LIMIT=str(args.rate_limit),
+               BADGE_STATE_DIR=workdir,
+               BADGE_CACHE_LOCATION=os.path.join(workdir, 'cache.sqlite3'),
+               SOLVEDAC_COOKIE_FILE=os.path.join(workdir, 'clearance.json'))
+    command = [sys.executable, '-m', 'gunicorn', *WORKER_CLASSES[worker_class],
+               '--bind', '127.0.0.1:{}'.format(port), '--workers', str(workers),
+               '--threads', str(args.threads if worker_class == 'gthread' else 1),
+               '--preload', '--log-level', 'warning']
+    app = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port, app)
+        handles = zipf_handles(args.handles, args.zipf, args.seed)
+        if args.warmup:
+            asyncio.run(drive(port, args.concurrency, args.warmup, handles))
+        return asyncio.run(drive(port, args.concurrency, args.duration, handles))
+    finally:
+        stop(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-class', nargs='+', choices=sorted(WORKER_CLASSES),
+                        default=['sync', 'gthread', 'uvicorn'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='open connections')
+    parser.add_argument('--duration', type=float, default=10, help='seconds measured per run')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds before measuring')
+    parser.add_argument('--handles', type=int, default=5000, help='distinct users requested')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the handle popularity')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='SOLVEDAC_RATE_LIMIT of the app, solved.ac requests per second (0: unlimited)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    stub = parser.add_argument_group('solved.ac stub', 'passed on to benchmarks.stub_server')
+    stub.add_argument('--latency', type=float, default=0.02)
+    stub.add_argument('--jitter', type=float, default=0.03)
+    stub.add_argument('--rate-limited', type=float, default=0.0)
+    stub.add_argument('--errors', type=float, default=0.0)
+    stub.add_argument('--challenges', type=float, default=0.0)
+    stub.add_argument('--replay')
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub_command = [sys.executable, '-m', 'benchmarks.stub_server', '--port', str(stub_port),
+                    '--latency', str(args.latency), '--jitter', str(args.jitter),
+                    '--rate-limited', str(args.rate_limited), '--errors', str(args.errors),
+                    '--challenges', str(args.challenges), '--seed', str(args.seed)]
+    if args.replay:
+        stub_command += ['--replay', args.replay]
+    stub_server = subprocess.Popen(stub_command, stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_until_ready(stub_port, stub_server)
+        api_server = 'http://127.0.0.1:{}/api'.format(stub_port)
+        print('{:<8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}  statuses'.format(
+            'class', 'workers', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+        for worker_class in args.worker_class:
+            for workers in args.workers:
+                result = run_app(worker_class, workers, args, api_server)
+                result.update(worker_class=worker_class, workers=workers)
+                results.append(result)
+                print('{:<8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}  {}'.format(
+                    worker_class, workers, result['rps'], result['p50_ms'], result['p90_ms'],
+                    result['p99_ms'], result['max_ms'],
+                    ' '.join('{}:{}'.format(status, count) for status, count in result['statuses'].items())),
+                    flush=True)
+    finally:
+        stop(stub_server)
+
+    if args.output:
+        options = {key: value for key, value in vars(args).items() if key != 'output'}
+        with open(args.output, 'w') as f:
+            json.dump({'options': options, 'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
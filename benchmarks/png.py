@@ -0,0 +1,96 @@
+"""Throughput and latency of ``?format=png`` badges.
+
+Runs the badge views in-process with profiles already cached, from
+``--threads`` client threads, through these cases:
+
+    svg         the SVG badge, as a baseline
+    uncached    a PNG for every request: distinct handles, empty PNG cache
+    cached      the same handles again, every PNG from the cache
+    overload    uncached again, with more requests in flight than the queue
+                holds: the ones over the limit get the SVG straight away
+
+For each case: requests per second, p50/p99 latency and how many responses
+were PNG or SVG.
+
+    python -m benchmarks.png --handles 200 --threads 8 --processes 2
+"""
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+
+def run_case(client, handles, threads, fmt='png', variant='/api/generate_badge'):
+    def get(handle):
+        params = {'boj': handle}
+        if fmt:
+            params['format'] = fmt
+        start = time.perf_counter()
+        response = client.get(variant, params)
+        return time.perf_counter() - start, response['Content-Type']
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(get, handles))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'rps': len(results) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1e3,
+        'p99_ms': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1e3,
+        'png': sum(content_type == 'image/png' for _, content_type in results),
+        'svg': sum(content_type == 'image/svg+xml' for _, content_type in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handles', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8, help='concurrent client requests')
+    parser.add_argument('--processes', type=int, default=2, help='rasterizer pool size')
+    parser.add_argument('--queue', type=int, default=8, help='rasterizer queue limit')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mazassumnida.settings')
+    os.environ['BADGE_CACHE'] = ''
+    os.environ['BADGE_METRICS_DIR'] = ''
+    django.setup()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    logging.disable(logging.CRITICAL)
+    from api import views
+
+    if not views.rasterizer.available:
+        parser.exit(1, 'no rasterizer installed: pip install cairosvg (needs libcairo) or resvg-py\n')
+    views.rasterizer.processes = args.processes
+    views.rasterizer.max_queue = args.queue
+    views.PNG_TIMEOUT = 60
+    client = Client()
+    handles = ['user{}'.format(i) for i in range(args.handles)]
+    for i, handle in enumerate(handles):
+        views.profile_cache.set(handle, {'rating': 100 + 20 * i, 'solvedCount': i, 'class': i % 10,
+                                         'classDecoration': 'none'})
+    # start the pool processes outside the timings
+    run_case(client, ['warmup'], 1)
+
+    print('{:<10} {:>9} {:>9} {:>9} {:>6} {:>6}'.format('case', 'req/s', 'p50 ms', 'p99 ms', 'png', 'svg'))
+
+    def report(name, result):
+        print('{:<10} {:>9.1f} {:>9.1f} {:>9.1f} {:>6} {:>6}'.format(
+            name, result['rps'], result['p50_ms'], result['p99_ms'], result['png'], result['svg']), flush=True)
+
+    report('svg', run_case(client, handles, args.threads, fmt=None))
+    report('uncached', run_case(client, handles, args.threads))
+    report('cached', run_case(client, handles, args.threads))
+    views.rasterizer.cache.clear()
+    views.rasterizer.max_queue = max(1, args.threads // 4)
+    report('overload', run_case(client, handles, args.threads))
+    views.rasterizer.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Render time per badge variant: str.format of the source vs SvgTemplate.
+
+    DJANGO_SETTINGS_MODULE=mazassumnida.settings python -m benchmarks.render
+"""
+import timeit
+import argparse
+from types import SimpleNamespace
+
+import django
+
+
+def sample(tier_title='Gold', tier_rank='3'):
+    url_set = SimpleNamespace(boj_name='ccoco', boj_handle='ccoco')
+    handle_set = SimpleNamespace(
+        tier_title=tier_title, tier_rank=tier_rank, solved='1,234', boj_class='7',
+        boj_class_decoration='+', rate='1,234', now_rate='1,234', needed_rate='1,250',
+        percentage=89, bar_size=261.95)
+    return url_set, handle_set
+
+
+def format_kwargs(palette, url_set, handle_set, **extra):
+    kwargs = dict(
+        boj_handle=url_set.boj_name, tier_rank=handle_set.tier_rank, tier_title=handle_set.tier_title,
+        solved=handle_set.solved, boj_class=handle_set.boj_class,
+        boj_class_decoration=handle_set.boj_class_decoration, rate=handle_set.rate,
+        now_rate=handle_set.now_rate, needed_rate=handle_set.needed_rate,
+        percentage=handle_set.percentage, bar_size=handle_set.bar_size)
+    kwargs.update(('color{}'.format(i + 1), c) for i, c in enumerate(palette[handle_set.tier_title]))
+    kwargs.update(extra)
+    return kwargs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    django.setup()
+    from api import views
+    from api.minify import minify_svg
+
+    url_set, handle_set = sample()
+    cases = (
+        ('v1', views.BADGE_V1_SVG, format_kwargs(views.BACKGROUND_COLOR, url_set, handle_set),
+         views.render_badge),
+        ('v2', views.BADGE_V2_SVG, format_kwargs(
+            views.BACKGROUND_COLOR, url_set, handle_set,
+            tier_img_link=views.TIER_IMG_LINK[handle_set.tier_title]), views.render_badge_v2_inline),
+        ('mini', views.BADGE_MINI_SVG, format_kwargs(
+            views.BACKGROUND_COLOR, url_set, handle_set, tier_title=handle_set.tier_title[0]),
+         views.render_badge_mini),
+        ('pastel', views.BADGE_PASTEL_SVG, format_kwargs(views.BACKGROUND_COLOR_PASTEL, url_set, handle_set),
+         views.render_badge_pastel),
+    )
+    print('{:<8} {:>12} {:>12} {:>8}'.format('variant', 'format (us)', 'template (us)', 'speedup'))
+    for name, source, kwargs, render in cases:
+        source = minify_svg(source)
+        assert source.format(**kwargs).encode() == render(url_set, handle_set)
+        before = timeit.timeit(lambda: source.format(**kwargs).encode(), number=args.number)
+        after = timeit.timeit(lambda: render(url_set, handle_set), number=args.number)
+        print('{:<8} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+            name, before / args.number * 1e6, after / args.number * 1e6, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Per-worker profile caches vs the shared SQLite cache at 1, 4 and 16 workers.
+
+Every worker process serves its share of a Zipf-distributed stream of badge
+requests. Reported: upstream fetches across all workers, cache hit ratio and
+the mean time of a cache read that didn't have to fetch. The run stops if
+any store operation fails: the store treats errors as misses, which would
+report per-worker numbers as the shared ones.
+
+    python -m benchmarks.shared_cache --requests 40000 --handles 5000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+
+from api.cache import ProfileCache
+from api.sharedcache import ProfileStore, SQLiteCache
+
+
+def stream(requests, handles, seed):
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(handles)]
+    return ['user{}'.format(i) for i in rng.choices(range(handles), weights=weights, k=requests)]
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def worker(path, requests, handles, seed, results):
+    # the store logs its errors on the app logger and carries on
+    errors = ErrorCounter()
+    logging.getLogger('testlogger').addHandler(errors)
+    cache = ProfileCache(maxsize=4096, store=ProfileStore(SQLiteCache(path, {})) if path else None)
+    fetches = 0
+    hits = 0
+    elapsed = 0.0
+
+    def fetch():
+        nonlocal fetches
+        fetches += 1
+        time.sleep(0.0005)
+        return {'handle': 'x', 'rating': 1234, 'solvedCount': 100, 'class': 3, 'classDecoration': 'none'}
+
+    for handle in stream(requests, handles, seed):
+        before = fetches
+        start = time.perf_counter()
+        cache.get(handle, 3600, fetch)
+        if fetches == before:
+            elapsed += time.perf_counter() - start
+            hits += 1
+    results.put((fetches, hits, elapsed, errors.count))
+
+
+def run(workers, path, requests, handles):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(path, requests // workers, handles, i, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return tuple(sum(values) for values in zip(*collected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=40000)
+    parser.add_argument('--handles', type=int, default=5000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    print('{:>7} {:<9} {:>9} {:>9} {:>10}'.format('workers', 'cache', 'fetches', 'hit %', 'us / hit'))
+    for workers in args.workers:
+        for name in ('local', 'sqlite'):
+            directory = path = None
+            if name == 'sqlite':
+                # mkdtemp is private to this user, which SQLiteCache insists on
+                directory = tempfile.mkdtemp(prefix='shared-cache-')
+                path = os.path.join(directory, 'cache.sqlite3')
+            try:
+                fetches, hits, elapsed, errors = run(workers, path, args.requests, args.handles)
+            finally:
+                if directory:
+                    shutil.rmtree(directory, ignore_errors=True)
+            if errors:
+                sys.exit('{} store operations failed with {} workers, see the log above'.format(errors, workers))
+            requests = args.requests // workers * workers
+            print('{:>7} {:<9} {:>9} {:>8.1f}% {:>10.1f}'.format(
+                workers, name, fetches, 100.0 * hits / requests, elapsed / hits * 1e6))
+
+
+if __name__ == '__main__':
+    main()
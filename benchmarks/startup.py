@@ -0,0 +1,87 @@
+"""Cold start and per-request overhead of the default vs the lean settings.
+
+Each run is a fresh process: it imports the WSGI application, serves a
+first badge (its profile comes from a local solved.ac stub) and then serves
+the same badge ``--requests`` times straight from the caches, so what is
+left per request is Django's request handling, middleware and the view.
+
+    python -m benchmarks.startup --runs 5 --requests 5000
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+from wsgiref.util import setup_testing_defaults
+
+from benchmarks.stub_server import StubServer
+
+SETTINGS = ('mazassumnida.settings', 'mazassumnida.settings_production')
+
+
+def environ(query):
+    env = {'PATH_INFO': '/api/generate_badge', 'QUERY_STRING': query, 'HTTP_HOST': 'localhost'}
+    setup_testing_defaults(env)
+    return env
+
+
+def child(args):
+    start = time.perf_counter()
+    from mazassumnida.wsgi import application
+    imported = time.perf_counter()
+
+    def start_response(status, headers):
+        assert status.startswith('200'), status
+
+    b''.join(application(environ('boj=ccoco'), start_response))
+    first = time.perf_counter()
+
+    # the view logs every badge; keep the console out of the measurement
+    logging.disable(logging.INFO)
+    request = time.perf_counter()
+    for _ in range(args.requests):
+        b''.join(application(environ('boj=ccoco'), start_response))
+    per_request = (time.perf_counter() - request) / args.requests
+
+    print(json.dumps({'import': imported - start, 'first': first - start, 'per_request': per_request}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    server = StubServer(latency=0).start()
+    try:
+        print('{:<36} {:>10} {:>10} {:>12} {:>14}'.format(
+            'settings', 'process', 'load app', 'first badge', 'us / request'))
+        for module in SETTINGS:
+            env = dict(os.environ, DJANGO_SETTINGS_MODULE=module, SOLVEDAC_API_SERVER=server.api_server,
+                       BADGE_CACHE='', SOLVEDAC_COOKIE_FILE='')
+            runs = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                out = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.startup', '--child', '--requests', str(args.requests)],
+                    env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+                result = json.loads(out.decode().strip().splitlines()[-1])
+                # interpreter start up to the first badge, without the request loop
+                result['process'] = time.perf_counter() - start - result['per_request'] * args.requests
+                runs.append(result)
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            print('{:<36} {:>8.0f}ms {:>8.0f}ms {:>10.0f}ms {:>14.1f}'.format(
+                module, median['process'] * 1e3, median['import'] * 1e3, median['first'] * 1e3,
+                median['per_request'] * 1e6))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""Local stand-in for the solved.ac API used by the benchmarks.
+
+Serves ``/api/v3/user/show`` and ``/api/v3/user/lookup`` with deterministic
+fake profiles, after ``--latency`` seconds plus up to ``--jitter`` more.
+A share of the requests can be turned into failures: 429 rate limits,
+5xx errors, and Cloudflare challenge pages (403, HTML) like the ones
+cloudscraper can't solve.
+
+``--record FILE --upstream URL`` proxies every request to the real API and
+appends the responses to FILE (JSON lines); ``--replay FILE`` serves them
+back offline, cycling through the responses recorded for each path, and
+falls back to fake profiles for paths that were never recorded (or 404s
+with ``--replay-strict``).
+
+    python -m benchmarks.stub_server --port 8001 --latency 0.05 --jitter 0.05
+    python -m benchmarks.stub_server --port 8001 --rate-limited 0.02 --errors 0.01 --challenges 0.01
+    python -m benchmarks.stub_server --record solvedac.jsonl --upstream https://solved.ac/api
+    python -m benchmarks.stub_server --replay solvedac.jsonl
+"""
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# what Cloudflare answers when it wants a browser; cloudscraper gives up on it
+CHALLENGE_PAGE = b'''<!DOCTYPE html><html lang="en-US"><head><title>Just a moment...</title></head><body>
+<img src="/cdn-cgi/images/trace/managed/js/transparent.gif?ray=stub" style="display: none">
+<form id="challenge-form" action="/api/v3/user/show?__cf_chl_f_tk=stub" method="POST" enctype="application/x-www-form-urlencoded"></form>
+<script>(function(){var cpo=document.createElement('script');cpo.src='/cdn-cgi/challenge-platform/h/g/orchestrate/managed/v1?ray=stub';document.getElementsByTagName('head')[0].appendChild(cpo);}());</script>
+</body></html>'''
+
+ERROR_PAGES = (
+    (500, 'application/json', b'{"message":"Internal Server Error"}'),
+    (502, 'text/html', b'<html><head><title>502 Bad Gateway</title></head><body>502 Bad Gateway</body></html>'),
+    (503, 'text/html', b'<html><head><title>503 Service Unavailable</title></head><body>503 Service Unavailable</body></html>'),
+)
+
+
+def fake_profile(handle):
+    # deterministic per handle so repeated runs render the same badges
+    seed = zlib.crc32(handle.lower().encode())
+    return {
+        'handle': handle,
+        'rating': seed % 3200,
+        'solvedCount': seed % 5000,
+        'class': seed % 11,
+        'classDecoration': ('none', 'silver', 'gold')[seed % 3],
+    }
+
+
+def load_recording(path):
+    """{path: [response, ...]} from a file written by ``--record``."""
+    responses = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                response = json.loads(line)
+                responses[response['path']].append(response)
+    return dict(responses)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        # the stub is mounted where solved.ac serves /api
+        path = self.path[len('/api'):] if self.path.startswith('/api/') else self.path
+        delay = server.latency + (server.random() * server.jitter if server.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        fault = server.pick_fault()
+        if fault == 'rate_limited':
+            return self.send(429, 'application/json', b'{"message":"Too Many Requests"}', {'Retry-After': '1'})
+        if fault == 'error':
+            return self.send(*ERROR_PAGES[int(server.random() * len(ERROR_PAGES))])
+        if fault == 'challenge':
+            return self.send(403, 'text/html; charset=UTF-8', CHALLENGE_PAGE,
+                             {'Server': 'cloudflare', 'cf-mitigated': 'challenge'})
+
+        if server.upstream is not None:
+            return self.proxy(path)
+        if server.recording is not None:
+            response = server.replayed(path)
+            if response is not None:
+                return self.send(response['status'], response['content_type'], response['body'].encode())
+            if server.replay_strict:
+                return self.send_json(404, {'message': 'not recorded'})
+
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        if url.path == '/v3/user/show' and query.get('handle'):
+            self.send_json(200, fake_profile(query['handle'][0]))
+        elif url.path == '/v3/user/lookup' and query.get('handles'):
+            self.send_json(200, [fake_profile(handle) for handle in query['handles'][0].split(',')])
+        else:
+            self.send_json(404, {'message': 'not found'})
+
+    def proxy(self, path):
+        server = self.server
+        resp = server.upstream.get(server.upstream_url + path)
+        content_type = resp.headers.get('Content-Type', 'application/octet-stream')
+        with server.lock:
+            with open(server.record_file, 'a') as f:
+                f.write(json.dumps({'path': path, 'status': resp.status_code,
+                                    'content_type': content_type, 'body': resp.text}) + '\n')
+        self.send(resp.status_code, content_type, resp.content)
+
+    def send_json(self, status, payload):
+        self.send(status, 'application/json', json.dumps(payload).encode())
+
+    def send(self, status, content_type, body, headers=None):
+        headers = dict(headers or {})
+        self.server_header = headers.pop('Server', None)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('Set-Cookie', 'cf_clearance=stub; Path=/')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.request_count += 1
+            self.server.status_counts[status] += 1
+
+    def version_string(self):
+        return self.server_header or super().version_string()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, rate_limited=0.0, errors=0.0,
+                 challenges=0.0, replay=None, replay_strict=False, record=None, upstream=None, seed=0):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.faults = (('rate_limited', rate_limited), ('error', errors), ('challenge', challenges))
+        self.recording = load_recording(replay) if replay else None
+        self.replay_strict = replay_strict
+        self.record_file = record
+        self.upstream_url = upstream
+        self.upstream = None
+        if record and upstream:
+            from api.upstream import UpstreamClient
+            self.upstream = UpstreamClient()
+        self.request_count = 0
+        self.status_counts = defaultdict(int)
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._replayed = defaultdict(int)
+
+    @property
+    def api_server(self):
+        return 'http://{}:{}/api'.format(*self.server_address)
+
+    def random(self):
+        with self.lock:
+            return self._random.random()
+
+    def pick_fault(self):
+        roll = self.random()
+        for fault, share in self.faults:
+            if roll < share:
+                return fault
+            roll -= share
+        return None
+
+    def replayed(self, path):
+        responses = self.recording.get(path)
+        if not responses:
+            return None
+        with self.lock:
+            i = self._replayed[path]
+            self._replayed[path] += 1
+        return responses[i % len(responses)]
+
+    def handle_error(self, request, client_address):
+        # clients that time out hang up before a slow reply is written
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds, uniformly')
+    parser.add_argument('--rate-limited', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--errors', type=float, default=0.0, help='share of requests answered with a 5xx')
+    parser.add_argument('--challenges', type=float, default=0.0,
+                        help='share of requests answered with a Cloudflare challenge page')
+    parser.add_argument('--replay', help='serve the responses recorded in this file')
+    parser.add_argument('--replay-strict', action='store_true', help='404 for paths missing from the recording')
+    parser.add_argument('--record', help='append the upstream responses to this file')
+    parser.add_argument('--upstream', default='https://solved.ac/api', help='API to record from')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = StubServer(
+        (args.host, args.port), latency=args.latency, jitter=args.jitter, rate_limited=args.rate_limited,
+        errors=args.errors, challenges=args.challenges, replay=args.replay, replay_strict=args.replay_strict,
+        record=args.record, upstream=args.upstream if args.record else None, seed=args.seed)
+    print('stub solved.ac listening on {}'.format(server.api_server), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
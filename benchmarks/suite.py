@@ -0,0 +1,181 @@
+"""Render-path benchmark suite for every badge variant.
+
+Cases, for v1, v2 with ?inline=0, v2, mini and pastel:
+
+    render/<variant>   BojDefaultSettings + the variant's render function
+    view/<variant>     the view through Django's test client, render cache
+                       cleared before every request (render + precompress)
+    cached/<variant>   the view through the test client, served from cache
+    unknown/<variant>  the Unknown-user fallback (profile can't be fetched)
+
+Profiles are stubbed, nothing goes upstream. For each case: ops/s, p50 and
+p99 latency, and the peak memory allocated per operation (tracemalloc, on
+a separate pass so it doesn't skew the timings). ``--output`` writes the
+results as JSON; ``--compare`` checks them against an earlier file and
+exits with status 1 when a case lost more than ``--max-regression`` of its
+ops/s.
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --compare bench.json --max-regression 0.1
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+
+import django
+
+PROFILE = {'handle': 'ccoco', 'rating': 2512, 'solvedCount': 1234, 'class': 7, 'classDecoration': 'gold'}
+
+VARIANTS = (
+    ('v1', '/api/generate_badge', {}),
+    ('v2', '/api/v2/generate_badge', {'inline': '0'}),
+    ('v2_inline', '/api/v2/generate_badge', {'inline': '1'}),
+    ('mini', '/api/mini/generate_badge', {}),
+    ('pastel', '/api/pastel/generate_badge', {}),
+)
+
+
+def measure(fn, number, warmup=50, traced=200):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(number):
+        start = time.perf_counter_ns()
+        fn()
+        times.append(time.perf_counter_ns() - start)
+    times.sort()
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(min(number, traced)):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    peaks.sort()
+
+    return {
+        'ops_per_sec': number / (sum(times) / 1e9),
+        'p50_us': times[len(times) // 2] / 1e3,
+        'p99_us': times[min(len(times) - 1, len(times) * 99 // 100)] / 1e3,
+        'alloc_bytes': peaks[len(peaks) // 2],
+    }
+
+
+def cases():
+    """{name: callable} for every case; needs Django set up."""
+    from django.test import Client
+    from api import views
+
+    client = Client()
+    found = {}
+    for variant, path, query in VARIANTS:
+        spec = views.BADGE_VARIANTS[variant]
+
+        def render(spec=spec):
+            url_set = SimpleNamespace(boj_name='ccoco', boj_handle='ccoco')
+            return spec.render(url_set, views.BojDefaultSettings(None, url_set, PROFILE))
+
+        def view(path=path, query=query):
+            views.render_cache.clear()
+            return client.get(path, dict(query, boj='ccoco'))
+
+        def cached(path=path, query=query):
+            return client.get(path, dict(query, boj='ccoco'))
+
+        def unknown(path=path, query=query):
+            return client.get(path, dict(query, boj='nobody'))
+
+        found['render/' + variant] = render
+        found['view/' + variant] = view
+        found['cached/' + variant] = cached
+        found['unknown/' + variant] = unknown
+    return found
+
+
+def run(number, selected=None, warmup=50):
+    """{case: measurements}, with the profile loader stubbed."""
+    from api import views
+
+    def load_profile(url_set, variant):
+        return PROFILE if url_set.boj_handle == 'ccoco' else None
+
+    results = {}
+    with mock.patch.object(views, 'load_profile', load_profile):
+        for name, fn in cases().items():
+            if selected and not any(name.startswith(prefix) for prefix in selected):
+                continue
+            results[name] = measure(fn, number, warmup)
+    return results
+
+
+def compare(baseline, results, max_regression):
+    """[(case, old ops/s, new ops/s)] of the cases slower than ``max_regression`` allows."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old and result['ops_per_sec'] < old['ops_per_sec'] * (1 - max_regression):
+            regressions.append((name, old['ops_per_sec'], result['ops_per_sec']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='timed operations per case')
+    parser.add_argument('--case', action='append', help='only cases starting with this, e.g. view/ or render/v2')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to check against')
+    parser.add_argument('--max-regression', type=float, default=0.1)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mazassumnida.settings')
+    # measure the workers' own caches, not a shared cache file
+    os.environ.setdefault('BADGE_CACHE', '')
+    django.setup()
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    # the views log every badge; keep the console out of the measurement
+    logging.disable(logging.INFO)
+
+    results = run(args.number, args.case)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print('{:<20} {:>10} {:>10} {:>10} {:>11} {:>9}'.format(
+        'case', 'ops/s', 'p50 us', 'p99 us', 'alloc KiB', 'vs base'))
+    for name, result in results.items():
+        old = baseline.get(name)
+        change = '{:+.1%}'.format(result['ops_per_sec'] / old['ops_per_sec'] - 1) if old else ''
+        print('{:<20} {:>10.0f} {:>10.1f} {:>10.1f} {:>11.1f} {:>9}'.format(
+            name, result['ops_per_sec'], result['p50_us'], result['p99_us'],
+            result['alloc_bytes'] / 1024, change))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'number': args.number,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    regressions = compare(baseline, results, args.max_regression)
+    for name, old, new in regressions:
+        print('regression: {} {:.0f} -> {:.0f} ops/s'.format(name, old, new), file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Bytes per badge variant before and after minify_svg.
+
+For every variant: the template source, and the largest response over all
+tiers with the longest handle and field values a badge shows, rendered from
+the source as written and from the minified template, identity / gzip /
+brotli as served.
+
+    DJANGO_SETTINGS_MODULE=mazassumnida.settings python -m benchmarks.svg_size
+"""
+from types import SimpleNamespace
+
+import django
+
+from .render import format_kwargs
+
+
+def widest(tier_title, tier_rank):
+    return SimpleNamespace(
+        tier_title=tier_title, tier_rank=tier_rank, solved='99,999', boj_class='10',
+        boj_class_decoration='++', rate='3,999', now_rate='3,999', needed_rate='4,000',
+        percentage=100, bar_size=290.0)
+
+
+def main():
+    django.setup()
+    from api import views
+    from api.compression import compress
+    from api.minify import minify_svg
+
+    def v2_rank(handle_set):
+        return 'M' if handle_set.tier_title == 'Master' else handle_set.tier_rank
+
+    cases = (
+        ('v1', views.BADGE_V1_SVG, lambda url_set, handle_set: format_kwargs(
+            views.BACKGROUND_COLOR, url_set, handle_set)),
+        ('v2', views.BADGE_V2_SVG, lambda url_set, handle_set: format_kwargs(
+            views.BACKGROUND_COLOR, url_set, handle_set, tier_rank=v2_rank(handle_set),
+            tier_img_link=views.TIER_ASSET_URL + views.TIER_ASSETS[handle_set.tier_title].name)),
+        ('v2_inline', views.BADGE_V2_SVG, lambda url_set, handle_set: format_kwargs(
+            views.BACKGROUND_COLOR, url_set, handle_set, tier_rank=v2_rank(handle_set),
+            tier_img_link=views.TIER_IMG_LINK[handle_set.tier_title])),
+        ('mini', views.BADGE_MINI_SVG, lambda url_set, handle_set: format_kwargs(
+            views.BACKGROUND_COLOR, url_set, handle_set, tier_title=handle_set.tier_title[0])),
+        ('pastel', views.BADGE_PASTEL_SVG, lambda url_set, handle_set: format_kwargs(
+            views.BACKGROUND_COLOR_PASTEL, url_set, handle_set)),
+    )
+    print('{:<10} {:>16} {:>16} {:>16} {:>16}'.format('variant', 'template', 'identity', 'gzip', 'br'))
+    for name, source, kwargs in cases:
+        spec = views.BADGE_VARIANTS[name]
+        minified = minify_svg(source)
+        largest = [0] * 6
+        for tier in views.TIERS + ('Unknown',):
+            title, _, rank = tier.partition(' ')
+            url_set, handle_set = SimpleNamespace(boj_name='w' * spec.max_len), widest(title, rank)
+            before = source.format(**kwargs(url_set, handle_set)).encode()
+            after = spec.render(url_set, handle_set)
+            assert after == minified.format(**kwargs(url_set, handle_set)).encode()
+            before_encoded, after_encoded = compress(before), compress(after)
+            sizes = (len(before), len(after), len(before_encoded.get('gzip', before)),
+                     len(after_encoded.get('gzip', after)), len(before_encoded.get('br', before)),
+                     len(after_encoded.get('br', after)))
+            largest = [max(a, b) for a, b in zip(largest, sizes)]
+        print('{:<10} {:>16} {:>16} {:>16} {:>16}'.format(
+            name, '{} -> {}'.format(len(source), len(minified)),
+            *('{} -> {}'.format(largest[i], largest[i + 1]) for i in (0, 2, 4))))
+
+
+if __name__ == '__main__':
+    main()
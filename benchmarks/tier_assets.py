@@ -0,0 +1,48 @@
+"""Bytes per v2 badge response with the tier image inlined vs linked.
+
+For every tier: the v2 body with the data URI (?inline=1) and with the
+/api/tier/ link, identity / gzip / brotli as served, and the tier image
+itself before and after optimize_png. Also times naming and optimizing the assets.
+
+    DJANGO_SETTINGS_MODULE=mazassumnida.settings python -m benchmarks.tier_assets
+"""
+import time
+
+import django
+
+from .render import sample
+
+
+def main():
+    django.setup()
+    from api import views
+    from api.assets import decode_data_uri, tier_assets
+    from api.compression import compress
+
+    start = time.perf_counter()
+    assets = tier_assets(views.TIER_IMG_LINK)
+    built = time.perf_counter()
+    for asset in assets.values():
+        asset.body
+    print('naming the tier assets: {:.1f} ms, optimizing them: {:.1f} ms'.format(
+        (built - start) * 1e3, (time.perf_counter() - built) * 1e3))
+    print()
+    print('{:<9} {:>15} {:>15} {:>15} {:>13}'.format('tier', 'identity', 'gzip', 'br', 'png'))
+    totals = [0] * 6
+    for title in views.TIER_TITLES:
+        url_set, handle_set = sample(title, '' if title in ('Master', 'Unknown', 'Unrated') else '3')
+        inline = views.render_badge_v2_inline(url_set, handle_set)
+        linked = views.render_badge_v2(url_set, handle_set)
+        inline_encoded, linked_encoded = compress(inline), compress(linked)
+        sizes = (len(inline), len(linked), len(inline_encoded.get('gzip', inline)),
+                 len(linked_encoded.get('gzip', linked)), len(inline_encoded.get('br', inline)),
+                 len(linked_encoded.get('br', linked)))
+        totals = [a + b for a, b in zip(totals, sizes)]
+        print('{:<9} {:>6} -> {:<6} {:>6} -> {:<6} {:>6} -> {:<6} {:>5} -> {:<5}'.format(
+            title, *sizes, len(decode_data_uri(views.TIER_IMG_LINK[title])), len(views.TIER_ASSETS[title].body)))
+    count = len(views.TIER_TITLES)
+    print('{:<9} {:>6} -> {:<6} {:>6} -> {:<6} {:>6} -> {:<6}'.format('mean', *(total // count for total in totals)))
+
+
+if __name__ == '__main__':
+    main()
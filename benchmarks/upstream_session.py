@@ -0,0 +1,55 @@
+"""Per-request latency of a fresh cloudscraper per call vs the pooled client.
+
+    python -m benchmarks.upstream_session --requests 200
+"""
+import time
+import argparse
+import statistics
+
+import cloudscraper
+
+from api.upstream import UpstreamClient
+from benchmarks.stub_server import StubServer
+
+
+def timed(fn, n):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print('{:<24} mean {:7.3f} ms  p50 {:7.3f} ms  p99 {:7.3f} ms'.format(
+        name, statistics.mean(samples), samples[len(samples) // 2],
+        samples[min(len(samples) - 1, int(len(samples) * 0.99))]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    server = StubServer().start()
+    url = server.api_server + '/v3/user/show?handle=user{}'
+    try:
+        def fresh(i):
+            cloudscraper.create_scraper().get(url.format(i)).json()
+
+        client = UpstreamClient()
+
+        def pooled(i):
+            client.get(url.format(i)).json()
+
+        pooled(-1)  # open the keep-alive connection outside the measurement
+        report('create_scraper() per call', timed(fresh, args.requests))
+        report('pooled UpstreamClient', timed(pooled, args.requests))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
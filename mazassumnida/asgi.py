@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mazassumnida.settings')
+# serve the async badge views; the WSGI entry point keeps the sync ones
+os.environ.setdefault('BADGE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
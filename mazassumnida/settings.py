@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'api',
 ]
 
 MIDDLEWARE = [
@@ -149,3 +150,212 @@ LOGGING = {
         }
     }
 }
+
+# Files shared by the workers of a host (cache, clearance cookies, rate
+# limiter, metrics) live in this directory, readable by the server's user
+# only: the cache holds pickles, which must not be planted by anyone else.
+BADGE_STATE_DIR = os.environ.get('BADGE_STATE_DIR', os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'mazassumnida'))
+
+try:
+    os.makedirs(BADGE_STATE_DIR, mode=0o700, exist_ok=True)
+except OSError:
+    pass
+
+# Badge caching
+# Seconds a solved.ac profile stays fresh per badge variant; expired entries
+# are served stale (up to BADGE_PROFILE_MAX_STALE more seconds) while one
+# background refresh runs.
+
+BADGE_PROFILE_TTL = {
+    'v1': 3600,
+    'v2': 3600,
+    'mini': 86400,
+    'pastel': 3600,
+}
+
+BADGE_PROFILE_CACHE_SIZE = 4096
+
+BADGE_PROFILE_MAX_STALE = 86400
+
+# Profiles stay in the shared cache this long as the last known good one:
+# when solved.ac fails, badges are drawn from it, marked stale, with
+# BADGE_STALE_CACHE_CONTROL, instead of the Unknown badge
+BADGE_PROFILE_RETENTION = 30 * 86400
+
+BADGE_STALE_CACHE_CONTROL = 'max-age=60'
+
+# Cache shared by all workers, holding profiles and rendered badges behind
+# each worker's own LRUs. The default is one SQLite file (WAL mode) per host;
+# point BADGE_CACHE_BACKEND / BADGE_CACHE_LOCATION at memcached, Redis or a
+# file-based cache instead, or set BADGE_CACHE to '' for per-worker caches only.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'badges': {
+        'BACKEND': os.environ.get('BADGE_CACHE_BACKEND', 'api.sharedcache.SQLiteCache'),
+        'LOCATION': os.environ.get('BADGE_CACHE_LOCATION', os.path.join(BADGE_STATE_DIR, 'cache.sqlite3')),
+        'KEY_PREFIX': 'mazassumnida',
+        'OPTIONS': {
+            'MAX_ENTRIES': 200000,
+        },
+    },
+}
+
+BADGE_CACHE = os.environ.get('BADGE_CACHE', 'badges')
+
+# Cache key versions: bump BADGE_TEMPLATE_VERSION to drop every shared
+# rendered badge while keeping the profiles (template edits already change
+# the keys), BADGE_PROFILE_CACHE_VERSION when the stored profile shape changes.
+BADGE_TEMPLATE_VERSION = 1
+
+BADGE_PROFILE_CACHE_VERSION = 1
+
+# seconds a rendered badge is kept in the shared cache
+BADGE_RENDER_CACHE_TIMEOUT = 7 * 86400
+
+# Cache-Control of badge responses from how often each handle's rating,
+# solved count and class change: a handle never seen changes once every
+# BADGE_CACHE_PRIOR_INTERVAL seconds and gets the variant's usual max-age
+# (3600, 86400 for mini), scaled by the observed time between changes within
+# [BADGE_CACHE_MIN_AGE, BADGE_CACHE_MAX_SHARED_AGE] as s-maxage. Browsers get
+# at most BADGE_CACHE_MAX_AGE. False sends the usual max-age only.
+# `manage.py cache_policy_report` shows the predicted origin traffic.
+BADGE_ADAPTIVE_CACHE = os.environ.get('BADGE_ADAPTIVE_CACHE', '1') == '1'
+
+BADGE_CACHE_PRIOR_INTERVAL = 86400
+
+BADGE_CACHE_MIN_AGE = 300
+
+BADGE_CACHE_MAX_AGE = 86400
+
+BADGE_CACHE_MAX_SHARED_AGE = 7 * 86400
+
+# handles whose change history is kept, per worker, and seconds it is kept
+# in the shared cache after a handle was last fetched
+BADGE_CHANGE_HISTORY_SIZE = 65536
+
+BADGE_CHANGE_HISTORY_RETENTION = 90 * 86400
+
+# v2 badges embed their tier image as a data URI, which is the only way it
+# shows in SVGs loaded through <img> (GitHub READMEs). `?inline=0` links it
+# from BADGE_TIER_ASSET_URL instead (content-hashed, cached forever), for
+# pages that load the SVG directly; False here makes linking the default.
+BADGE_V2_INLINE_IMAGES = True
+
+# where linked tier images are served, relative to BADGE_PUBLIC_URL unless absolute
+BADGE_PUBLIC_URL = os.environ.get('BADGE_PUBLIC_URL', 'http://mazassumnida.wtf')
+
+BADGE_TIER_ASSET_URL = os.environ.get('BADGE_TIER_ASSET_URL', '/api/tier/')
+
+
+# solved.ac upstream
+
+SOLVEDAC_API_SERVER = os.environ.get('SOLVEDAC_API_SERVER', 'https://solved.ac/api')
+
+# Cloudflare clearance cookies shared by every worker on the host
+SOLVEDAC_COOKIE_FILE = os.environ.get(
+    'SOLVEDAC_COOKIE_FILE', os.path.join(BADGE_STATE_DIR, 'clearance.json'))
+
+SOLVEDAC_CONNECT_TIMEOUT = 3.05
+
+SOLVEDAC_READ_TIMEOUT = 5
+
+SOLVEDAC_POOL_SIZE = 10
+
+# After SOLVEDAC_BREAKER_THRESHOLD failures in a row (errors, timeouts, 429
+# and 5xx) a worker stops calling solved.ac for SOLVEDAC_BREAKER_COOLDOWN
+# seconds, then lets one request through to see if it is back
+SOLVEDAC_BREAKER_THRESHOLD = 5
+
+SOLVEDAC_BREAKER_COOLDOWN = 30
+
+# solved.ac requests from all the workers on the host are paced to
+# SOLVEDAC_RATE_LIMIT per second (bursts of SOLVEDAC_RATE_BURST), through
+# SOLVEDAC_RATE_LIMIT_FILE; 0 disables. A badge miss waits at most
+# SOLVEDAC_QUEUE_BUDGET seconds for its turn before it is drawn from the last
+# known profile instead. Background refreshes never wait, and leave the last
+# SOLVEDAC_BACKGROUND_RESERVE requests of the burst to badge misses.
+SOLVEDAC_RATE_LIMIT = float(os.environ.get('SOLVEDAC_RATE_LIMIT', 10))
+
+SOLVEDAC_RATE_BURST = 20
+
+SOLVEDAC_RATE_LIMIT_FILE = os.environ.get(
+    'SOLVEDAC_RATE_LIMIT_FILE', os.path.join(BADGE_STATE_DIR, 'ratelimit'))
+
+SOLVEDAC_QUEUE_BUDGET = 1.0
+
+SOLVEDAC_BACKGROUND_RESERVE = 5
+
+# seconds to hold off after a 429 that has no Retry-After
+SOLVEDAC_RATE_LIMIT_PAUSE = 10
+
+# Rendered SVGs are cached up to this many bytes per worker
+BADGE_RENDER_CACHE_BYTES = 64 * 1024 * 1024
+
+# Async badge views with a non-blocking solved.ac client, see mazassumnida/asgi.py
+BADGE_ASYNC_VIEWS = os.environ.get('BADGE_ASYNC_VIEWS') == '1'
+
+SOLVEDAC_ASYNC_POOL_SIZE = 100
+
+BADGE_BROTLI_QUALITY = 5
+
+# Profile misses arriving within this many seconds of each other are fetched
+# with one multi-handle lookup (up to SOLVEDAC_BATCH_SIZE handles); 0 disables
+SOLVEDAC_BATCH_WINDOW = 0.005
+
+SOLVEDAC_BATCH_SIZE = 50
+
+# Refresh the BADGE_PREFETCH_TOP_K most requested handles BADGE_PREFETCH_LEAD
+# seconds before their profile expires, from a thread in each worker. The same
+# loop runs standalone with `manage.py prefetch_profiles`.
+BADGE_PREFETCH = os.environ.get('BADGE_PREFETCH') == '1'
+
+BADGE_PREFETCH_TOP_K = 256
+
+BADGE_PREFETCH_INTERVAL = 10
+
+BADGE_PREFETCH_LEAD = 60
+
+BADGE_PREFETCH_CONCURRENCY = 4
+
+BADGE_PREFETCH_RATE = 5
+
+# A handle whose refresh failed because of the handle (e.g. no such user, but
+# not rate limits or outages) waits this long before the next try, doubling
+# per failure in a row up to BADGE_PREFETCH_MAX_BACKOFF
+BADGE_PREFETCH_BACKOFF = 60
+
+BADGE_PREFETCH_MAX_BACKOFF = 86400
+
+# Prometheus metrics at /metrics. Every worker writes its numbers to
+# BADGE_METRICS_DIR each BADGE_METRICS_FLUSH_INTERVAL seconds, and /metrics
+# adds up all the workers of the server; empty for this worker's only.
+BADGE_METRICS = os.environ.get('BADGE_METRICS', '1') == '1'
+
+BADGE_METRICS_DIR = os.environ.get(
+    'BADGE_METRICS_DIR', os.path.join(BADGE_STATE_DIR, 'metrics'))
+
+BADGE_METRICS_FLUSH_INTERVAL = 1
+
+# `?format=png` on the badge endpoints, for places that don't show SVG. Each
+# worker rasterizes in BADGE_PNG_PROCESSES processes (cairosvg, or resvg-py),
+# with at most BADGE_PNG_QUEUE badges queued; past that, or after waiting
+# BADGE_PNG_TIMEOUT seconds, the SVG is sent instead. PNGs are cached by the
+# hash of their SVG, locally and in the shared cache.
+BADGE_PNG = True
+
+BADGE_PNG_PROCESSES = 2
+
+BADGE_PNG_QUEUE = 8
+
+BADGE_PNG_TIMEOUT = 2
+
+BADGE_PNG_CACHE_BYTES = 32 * 1024 * 1024
+
+# Server-Timing header on every badge response, breaking the request down
+# into profile (upstream, parse), compute, render and compress, with whether
+# the profile and the rendered badge came from cache
+BADGE_SERVER_TIMING = os.environ.get('BADGE_SERVER_TIMING') == '1'
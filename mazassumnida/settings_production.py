@@ -0,0 +1,36 @@
+"""
+Lean settings for serving badges, used by the Procfile.
+
+Everything from settings.py, minus what the badge endpoints never touch:
+the admin, auth, sessions, messages and staticfiles apps, their
+middleware, the template engine and translations. Security headers and
+the ALLOWED_HOSTS check (CommonMiddleware) stay.
+
+    DJANGO_SETTINGS_MODULE=mazassumnida.settings_production gunicorn mazassumnida.wsgi
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'api',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+# badge URLs have no trailing slash; with this on, CommonMiddleware resolves
+# every badge URL a second time to see whether a slash would match
+APPEND_SLASH = False
+
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+USE_I18N = False
+
+USE_L10N = False
+
+# see wsgi.py; the Procfile runs gunicorn with --preload
+BADGE_PRELOAD_VIEWS = True
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mazassumnida.settings')
 
 application = get_wsgi_application()
+
+if getattr(settings, 'BADGE_PRELOAD_VIEWS', False):
+    # import the URLconf (and the badge views) now, so `gunicorn --preload`
+    # does it once in the master instead of in every worker's first request
+    get_resolver().url_patterns